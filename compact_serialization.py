@@ -0,0 +1,320 @@
+""" Compact binary serialization of the credential objects
+
+The jsonpickle format (see serialization_utils) wraps every group element in
+base64 inside a JSON document. This module provides a versioned binary codec for
+the objects that are exchanged between the client and the server:
+PublicKey, IssueRequest, BlindSignature, Signature, DisclosureProof and ZKProof.
+
+Layout:
+- header: MAGIC (2 bytes) || version (1 byte) || object type (1 byte)
+- integers (lengths, counts, indices): unsigned LEB128 varints
+- Bn: varint length || big-endian binary
+- group elements: varint length || petrelic `to_binary()` (compressed points)
+- lists: varint count || items
+- strings: varint length || utf-8
+- attribute index sets: varint bit count || little-endian bitmap (bit i set iff index i is in the set)
+
+The anonymized credential of a disclosure proof is encoded without its `t`: it
+is a secret of the prover and is never used by the verifier. Proofs that carry
+their hidden-attribute indices are encoded without their generators: the
+verifier re-derives them from the public key.
+"""
+from typing import Any, Callable, List
+
+from petrelic.bn import Bn
+from petrelic.multiplicative.pairing import G1Element, G2Element, GTElement
+
+from credential_utils import *
+
+COMPACT_MAGIC = b"\xc5\x53"
+COMPACT_VERSION = 2
+
+# object types
+TYPE_PUBLIC_KEY = 1
+TYPE_ISSUE_REQUEST = 2
+TYPE_BLIND_SIGNATURE = 3
+TYPE_SIGNATURE = 4
+TYPE_DISCLOSURE_PROOF = 5
+TYPE_ZK_PROOF = 6
+
+# group element types (the generators of a ZKProof are in G1 or GT)
+ELEMENT_G1 = 1
+ELEMENT_G2 = 2
+ELEMENT_GT = 3
+ELEMENT_CLASSES = {ELEMENT_G1: G1Element, ELEMENT_G2: G2Element, ELEMENT_GT: GTElement}
+
+# optional fields of a ZKProof
+ZKP_HAS_GENERATORS = 0x01
+ZKP_HAS_COM = 0x02
+ZKP_HAS_R = 0x04
+ZKP_HAS_INDICES = 0x08
+
+
+class CompactSerializationError(ValueError):
+    """ Exception raised when an object cannot be encoded or decoded """
+    pass
+
+
+def is_compact(data: bytes) -> bool:
+    """ Returns whether the bytes are in the compact format """
+    return data[:len(COMPACT_MAGIC)] == COMPACT_MAGIC
+
+
+def can_encode(obj: Any) -> bool:
+    """ Returns whether the object has a compact encoding """
+    return isinstance(obj, (PublicKey, IssueRequest, BlindSignature, Signature, DisclosureProof, ZKProof))
+
+
+def encode(obj: Any) -> bytes:
+    """ Encode an object in the compact format """
+    writer = Writer()
+    writer.write_bytes_raw(COMPACT_MAGIC + bytes([COMPACT_VERSION]))
+    if isinstance(obj, PublicKey):
+        writer.write_varint(TYPE_PUBLIC_KEY)
+        _write_public_key(writer, obj)
+    elif isinstance(obj, IssueRequest):
+        writer.write_varint(TYPE_ISSUE_REQUEST)
+        writer.write_element(obj.C)
+        _write_zk_proof(writer, obj.pi)
+    elif isinstance(obj, BlindSignature):
+        writer.write_varint(TYPE_BLIND_SIGNATURE)
+        writer.write_element(obj.sigma_1)
+        writer.write_element(obj.sigma_2)
+    elif isinstance(obj, Signature):
+        writer.write_varint(TYPE_SIGNATURE)
+        writer.write_element(obj.sigma_1)
+        writer.write_element(obj.sigma_2)
+    elif isinstance(obj, DisclosureProof):
+        writer.write_varint(TYPE_DISCLOSURE_PROOF)
+        writer.write_element(obj.credential_showed.sigma_1)
+        writer.write_element(obj.credential_showed.sigma_2)
+        _write_zk_proof(writer, obj.pi)
+    elif isinstance(obj, ZKProof):
+        writer.write_varint(TYPE_ZK_PROOF)
+        _write_zk_proof(writer, obj)
+    else:
+        raise CompactSerializationError("No compact encoding for {}".format(type(obj)))
+    return writer.to_bytes()
+
+
+def decode(data: bytes) -> Any:
+    """ Decode an object from the compact format """
+    if not is_compact(data) or len(data) < len(COMPACT_MAGIC) + 1:
+        raise CompactSerializationError("Not in the compact format")
+    version = data[len(COMPACT_MAGIC)]
+    if version != COMPACT_VERSION:
+        raise CompactSerializationError("Unsupported compact format version {}".format(version))
+
+    reader = Reader(data, len(COMPACT_MAGIC) + 1)
+    obj_type = reader.read_varint()
+    if obj_type == TYPE_PUBLIC_KEY:
+        obj = _read_public_key(reader)
+    elif obj_type == TYPE_ISSUE_REQUEST:
+        obj = IssueRequest(reader.read_element(G1Element), _read_zk_proof(reader))
+    elif obj_type == TYPE_BLIND_SIGNATURE:
+        obj = BlindSignature(reader.read_element(G1Element), reader.read_element(G1Element))
+    elif obj_type == TYPE_SIGNATURE:
+        obj = Signature(reader.read_element(G1Element), reader.read_element(G1Element))
+    elif obj_type == TYPE_DISCLOSURE_PROOF:
+        credential = AnonymousCredential(reader.read_element(G1Element), reader.read_element(G1Element), None)
+        obj = DisclosureProof(_read_zk_proof(reader), credential)
+    elif obj_type == TYPE_ZK_PROOF:
+        obj = _read_zk_proof(reader)
+    else:
+        raise CompactSerializationError("Unknown object type {}".format(obj_type))
+
+    if not reader.at_end():
+        raise CompactSerializationError("Trailing bytes after the encoded object")
+    return obj
+
+
+#############################
+## OBJECT ENCODING HELPERS ##
+#############################
+
+def _write_public_key(writer: "Writer", pk: PublicKey):
+    writer.write_element(pk.g)
+    writer.write_list(pk.Y, writer.write_element)
+    writer.write_element(pk.g_tilde)
+    writer.write_element(pk.X_tilde)
+    writer.write_list(pk.Y_tilde, writer.write_element)
+    writer.write_varint(len(pk.attr_indices_dict))
+    for key, index in pk.attr_indices_dict.items():
+        writer.write_string(key)
+        writer.write_varint(index)
+
+
+def _read_public_key(reader: "Reader") -> PublicKey:
+    g = reader.read_element(G1Element)
+    Y = reader.read_list(lambda: reader.read_element(G1Element))
+    g_tilde = reader.read_element(G2Element)
+    X_tilde = reader.read_element(G2Element)
+    Y_tilde = reader.read_list(lambda: reader.read_element(G2Element))
+    attr_indices_dict = {}
+    for _ in range(reader.read_varint()):
+        key = reader.read_string()
+        attr_indices_dict[key] = reader.read_varint()
+    return PublicKey(g, Y, g_tilde, X_tilde, Y_tilde, attr_indices_dict)
+
+
+def _write_zk_proof(writer: "Writer", pi: ZKProof):
+    generators = pi.generators
+    com = getattr(pi, "com", None)
+    R = getattr(pi, "R", None)
+    indices = getattr(pi, "indices", None)
+
+    if indices is not None:
+        # the generators are derived from the key and the indices
+        generators = None
+
+    flags = 0
+    flags |= ZKP_HAS_GENERATORS if generators is not None else 0
+    flags |= ZKP_HAS_COM if com is not None else 0
+    flags |= ZKP_HAS_R if R is not None else 0
+    flags |= ZKP_HAS_INDICES if indices is not None else 0
+    writer.write_varint(flags)
+
+    writer.write_bn(pi.c)
+    writer.write_list(pi.s, writer.write_bn)
+    if generators is not None:
+        writer.write_list(generators, writer.write_typed_element)
+    if com is not None:
+        writer.write_typed_element(com)
+    if R is not None:
+        writer.write_typed_element(R)
+    if indices is not None:
+        writer.write_index_set(indices)
+
+
+def _read_zk_proof(reader: "Reader") -> ZKProof:
+    flags = reader.read_varint()
+    c = reader.read_bn()
+    s = reader.read_list(reader.read_bn)
+    generators = reader.read_list(reader.read_typed_element) if flags & ZKP_HAS_GENERATORS else None
+    com = reader.read_typed_element() if flags & ZKP_HAS_COM else None
+    R = reader.read_typed_element() if flags & ZKP_HAS_R else None
+    indices = reader.read_index_set() if flags & ZKP_HAS_INDICES else None
+    return ZKProof(generators, c, s, com, R, indices)
+
+
+######################
+## BYTE-LEVEL CODEC ##
+######################
+
+class Writer:
+    """ Appends encoded values to a buffer """
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.buffer)
+
+    def write_bytes_raw(self, data: bytes):
+        self.buffer += data
+
+    def write_varint(self, value: int):
+        if value < 0:
+            raise CompactSerializationError("Negative varint")
+        while True:
+            byte = value & 0x7f
+            value >>= 7
+            if value:
+                self.buffer.append(byte | 0x80)
+            else:
+                self.buffer.append(byte)
+                return
+
+    def write_bytes(self, data: bytes):
+        self.write_varint(len(data))
+        self.buffer += data
+
+    def write_string(self, value: str):
+        self.write_bytes(value.encode("utf-8"))
+
+    def write_bn(self, value: Bn):
+        self.write_bytes(value.binary())
+
+    def write_element(self, element: Any):
+        self.write_bytes(element.to_binary())
+
+    def write_typed_element(self, element: Any):
+        for element_type, element_class in ELEMENT_CLASSES.items():
+            if isinstance(element, element_class):
+                self.write_varint(element_type)
+                self.write_element(element)
+                return
+        raise CompactSerializationError("Unsupported group element {}".format(type(element)))
+
+    def write_list(self, items: List[Any], write_item: Callable[[Any], None]):
+        self.write_varint(len(items))
+        for item in items:
+            write_item(item)
+
+    def write_index_set(self, indices: List[int]):
+        if any(indices[i] >= indices[i + 1] for i in range(len(indices) - 1)):
+            raise CompactSerializationError("Index sets must be strictly increasing")
+        num_bits = indices[-1] + 1 if indices else 0
+        bitmap = bytearray((num_bits + 7) // 8)
+        for index in indices:
+            if index < 0:
+                raise CompactSerializationError("Negative index")
+            bitmap[index // 8] |= 1 << (index % 8)
+        self.write_varint(num_bits)
+        self.buffer += bitmap
+
+
+class Reader:
+    """ Reads encoded values from a buffer """
+    def __init__(self, data: bytes, offset: int = 0):
+        self.data = data
+        self.offset = offset
+
+    def at_end(self) -> bool:
+        return self.offset == len(self.data)
+
+    def read_varint(self) -> int:
+        value, shift = 0, 0
+        while True:
+            if self.offset >= len(self.data):
+                raise CompactSerializationError("Truncated varint")
+            byte = self.data[self.offset]
+            self.offset += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value
+
+    def read_bytes(self) -> bytes:
+        length = self.read_varint()
+        if self.offset + length > len(self.data):
+            raise CompactSerializationError("Truncated field")
+        data = self.data[self.offset:self.offset + length]
+        self.offset += length
+        return data
+
+    def read_string(self) -> str:
+        return self.read_bytes().decode("utf-8")
+
+    def read_bn(self) -> Bn:
+        return Bn.from_binary(self.read_bytes())
+
+    def read_element(self, element_class: Any) -> Any:
+        return element_class.from_binary(self.read_bytes())
+
+    def read_typed_element(self) -> Any:
+        element_type = self.read_varint()
+        if element_type not in ELEMENT_CLASSES:
+            raise CompactSerializationError("Unknown group element type {}".format(element_type))
+        return self.read_element(ELEMENT_CLASSES[element_type])
+
+    def read_list(self, read_item: Callable[[], Any]) -> List[Any]:
+        return [read_item() for _ in range(self.read_varint())]
+
+    def read_index_set(self) -> List[int]:
+        num_bits = self.read_varint()
+        num_bytes = (num_bits + 7) // 8
+        if self.offset + num_bytes > len(self.data):
+            raise CompactSerializationError("Truncated index set")
+        bitmap = self.data[self.offset:self.offset + num_bytes]
+        self.offset += num_bytes
+        return [index for index in range(num_bits) if bitmap[index // 8] >> (index % 8) & 1]
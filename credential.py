@@ -14,10 +14,12 @@ We also avoided the use of classes in this template so that the code more closel
 resembles the original scheme definition. However, you are free to restructure
 the functions provided to resemble a more object-oriented interface.
 """
-from typing import Any
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Optional
 
 from petrelic.bn import Bn
-from petrelic.multiplicative.pairing import G1, G2
+from petrelic.multiplicative.pairing import G1, G2, GT, G1Element, G2Element
 
 from credential_utils import *
 from zkp_utils import *
@@ -27,11 +29,21 @@ from zkp_utils import *
 ## SIGNATURE SCHEME ##
 ######################
 
+# minimum number of attributes per worker of the parallel key generation
+KEYGEN_MIN_CHUNK_SIZE = 32
+
 
 def generate_key(
-        attributes: List[str]
+        attributes: List[str],
+        max_workers: int = 1
     ) -> Tuple[SecretKey, PublicKey]:
-    """ Generate signer key pair """
+    """ Generate signer key pair
+
+    With `max_workers` > 1, the exponentiations Y[i] = g^y_i and Y_tilde[i] = g_tilde^y_i
+    are spread over a pool of processes (petrelic holds the GIL), in chunks of at least
+    KEYGEN_MIN_CHUNK_SIZE attributes. The y_i are picked in the parent process and the
+    chunks are reassembled in order, so the result is the same as the sequential mode.
+    """
 
     if len(attributes) == 0:
         raise ValueError("The length of the attribute vector is zero")
@@ -47,18 +59,56 @@ def generate_key(
     g = G1.generator()
     g_tilde = G2.generator()
 
+    # fixed-base tables for g and g_tilde, shared by the L + 1 exponentiations,
+    # only pay off for large keys (otherwise they are built lazily on use)
+    if L >= FIXED_BASE_KEYGEN_MIN_ATTRIBUTES:
+        g_table = FixedBaseTable(g)
+        g_tilde_table = FixedBaseTable(g_tilde)
+        g_power, g_tilde_power = g_table.power, g_tilde_table.power
+    else:
+        g_table = g_tilde_table = None
+        g_power, g_tilde_power = (lambda e: g ** e), (lambda e: g_tilde ** e)
+
     # compute X, X_tilde
-    X = g ** x
-    X_tilde = g_tilde ** x
+    X = g_power(x)
+    X_tilde = g_tilde_power(x)
 
     # compute Y, Y_tilde
-    Y = [g ** y_i for y_i in y]
-    Y_tilde = [g_tilde ** y_i for y_i in y]
+    chunk_size = max((L + max_workers - 1) // max_workers, KEYGEN_MIN_CHUNK_SIZE)
+    if max_workers > 1 and L > chunk_size:
+        chunks = [[y_i.binary() for y_i in y[i:i + chunk_size]] for i in range(0, L, chunk_size)]
+        Y, Y_tilde = [], []
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            for Y_chunk, Y_tilde_chunk in executor.map(_generate_key_chunk, chunks):
+                Y.extend(G1Element.from_binary(Y_i) for Y_i in Y_chunk)
+                Y_tilde.extend(G2Element.from_binary(Y_tilde_i) for Y_tilde_i in Y_tilde_chunk)
+    else:
+        Y = [g_power(y_i) for y_i in y]
+        Y_tilde = [g_tilde_power(y_i) for y_i in y]
     
     attr_idx_dict = {attributes[i]: i for i in range(L)}
 
+    # the public key keeps the tables for the issuance protocol
+    pk = PublicKey(g, Y, g_tilde, X_tilde, Y_tilde, attr_idx_dict)
+    if g_table is not None:
+        pk.fixed_base_cache().add(("g", None), g_table)
+        pk.fixed_base_cache().add(("g_tilde", None), g_tilde_table)
+
     # return the secret and public key
-    return SecretKey(x, X, y), PublicKey(g, Y, g_tilde, X_tilde, Y_tilde, attr_idx_dict)
+    return SecretKey(x, X, y), pk
+
+
+def _generate_key_chunk(
+        y_chunk: List[bytes]
+    ) -> Tuple[List[bytes], List[bytes]]:
+    """ Compute g^y_i and g_tilde^y_i for a chunk of y (runs in a worker process)
+
+    Elements are exchanged in binary form between the processes. The chunks are
+    too small for fixed-base tables to pay off in each worker.
+    """
+    g, g_tilde = G1.generator(), G2.generator()
+    y = [Bn.from_binary(y_i) for y_i in y_chunk]
+    return [(g ** y_i).to_binary() for y_i in y], [(g_tilde ** y_i).to_binary() for y_i in y]
 
 
 def sign(
@@ -112,9 +162,7 @@ def verify(
     m = [bytes_to_Z_p(msg) for msg in msgs]
 
     # compute product X_tilde * Y_tilde[0]^m[0] * ... * Y_tilde[L-1]^m[L-1]
-    product = pk.X_tilde
-    for i in range(len(m)):
-        product *= pk.Y_tilde[i] ** m[i]
+    product = pk.X_tilde * multi_exponentiation(pk.Y_tilde, m)
     
     return signature.sigma_1 != G1.unity() and signature.sigma_1.pair(product) == signature.sigma_2.pair(pk.g_tilde)
 
@@ -139,20 +187,20 @@ def create_issue_request(
     t = G1.order().random()
 
     # compute Pedersen commitment
-    C = pk.g ** t
-    generators = [pk.g]
+    # the attributes are sorted by index so that the proof only needs to carry the index set
+    indices = []
     prover_inputs = [t]
-    for attr in user_attributes:
+    for attr in sorted(user_attributes, key=lambda attr: attr.index):
         prover_input = bytes_to_Z_p(attr.to_bytes()) # TODO: check if it makes sense to convert the whole object to bytes or just the value?
-        generator = pk.Y[attr.index]
-        C *= generator ** prover_input
 
-        generators.append(generator)
+        indices.append(attr.index)
         prover_inputs.append(prover_input)
+    C = _G1_product(pk, indices, prover_inputs)
 
     # compute a non-interactive proof pi
-    c, s = generate_zkp(generators, prover_inputs, C)
-    pi = ZKProof(generators, c, s)
+    # the generators are re-derived by the issuer from the key and the indices, they are not sent
+    c, s = generate_zkp(_issuance_generators(pk, indices), prover_inputs, C)
+    pi = ZKProof(None, c, s, indices=indices)
 
     return IssueRequest(C, pi), t
 
@@ -169,19 +217,58 @@ def sign_issue_request(
     """
 
     # verify the validity of the proof pi with respect to the commitment C and abort if invalid
+    # the generators are always derived from the key: with generators chosen by the user,
+    # the commitment could contain an attribute the issuer signs
     pi = request.pi
-    if not verify_zkp(request.C, pi.generators, pi.c, pi.s):
+    if getattr(pi, "indices", None) is None or not _valid_hidden_indices(pk, pi, issuer_attributes):
+        raise ZKPVerificationError("Invalid attribute indices in the ZKP")
+    if not verify_zkp(request.C, _issuance_generators(pk, pi.indices), pi.c, pi.s):
         raise ZKPVerificationError("ZKP verification failed")
 
     # pick random u from integers modulo p
     u = G1.order().random()
 
     # compute product X * C * Y[i]^attr[i] for all i in I
+    # the issuer signs many requests with the same key: Y[i] and g go through its fixed-base tables
     product = sk.X * request.C
-    for attr in issuer_attributes:
-        product *= pk.Y[attr.index] ** bytes_to_Z_p(attr.to_bytes())
+    if len(issuer_attributes) > 0:
+        product *= _G1_product(pk, [attr.index for attr in issuer_attributes],
+                               [bytes_to_Z_p(attr.to_bytes()) for attr in issuer_attributes], with_g=False)
+
+    return BlindSignature(pk.g_power(u), product ** u)
 
-    return BlindSignature(pk.g ** u, product ** u)
+
+def _issuance_generators(
+        pk: PublicKey,
+        indices: List[int]
+    ) -> List[G1Element]:
+    """ Generators of the issuance proof for the user attributes at the given indices """
+    return [pk.g] + [pk.Y[idx] for idx in indices]
+
+
+def _G1_product(
+        pk: PublicKey,
+        indices: List[int],
+        exponents: List[Bn],
+        with_g: bool = True
+    ) -> G1Element:
+    """ Compute g^e_0 * prod Y[indices[i]]^e_(i+1) (without g^e_0 if not `with_g`)
+
+    The bases go through the fixed-base tables of the key when they all have one
+    (or are used often enough to get one, see FixedBaseCache); otherwise, e.g. on
+    a freshly deserialized key, a single multi-exponentiation is cheaper.
+    """
+    keys = ([("g", None)] if with_g else []) + [("Y", idx) for idx in indices]
+    bases = ([pk.g] if with_g else []) + [pk.Y[idx] for idx in indices]
+    cache = pk.fixed_base_cache()
+    if all(cache.uses_table(key) for key in keys):
+        product = G1.unity()
+        for key, base, exponent in zip(keys, bases, exponents):
+            product *= cache.power(key, base, exponent)
+        return product
+    for key in keys:
+        cache.count_use(key)
+    return multi_exponentiation(bases, exponents)
 
 
 def obtain_credential(
@@ -202,27 +289,36 @@ def create_disclosure_proof(
         pk: PublicKey,
         credential: AnonymousCredential,
         hidden_attributes: List[Attribute],
-        message: bytes
+        message: bytes,
+        folded: bool = False
     ) -> DisclosureProof:
-    """ Create a disclosure proof """
+    """ Create a disclosure proof
 
-    # compute Pedersen commitment (RHS)
-    C = credential.sigma_1.pair(pk.g_tilde) ** credential.t
-    generators = [credential.sigma_1.pair(pk.g_tilde)]
-    prover_inputs = [credential.t]
+    `pk` can be a PreparedPublicKey, in which case the Pedersen commitment is
+    computed with a single pairing against the cached G2 product
 
-    for hidden_attr in hidden_attributes:
-        idx = hidden_attr.index
-        generator = credential.sigma_1.pair(pk.Y_tilde[idx])
-        prover_input = bytes_to_Z_p(hidden_attr.to_bytes())
-        C *= generator ** prover_input
+    If `folded` is set, the proof is computed in G2 before pairing (see
+    "FOLDED SHOWING PROTOCOL" below) and does not contain the GT generators
+    """
+    if folded:
+        return _create_folded_disclosure_proof(pk, credential, hidden_attributes, message)
 
-        generators.append(generator)
-        prover_inputs.append(prover_input)
+    # compute Pedersen commitment (RHS)
+    # the hidden attributes are sorted by index (the verifier accepts the generators in any order)
+    hidden_attributes = sorted(hidden_attributes, key=lambda attr: attr.index)
+    generators = _disclosure_generators(pk, credential, [attr.index for attr in hidden_attributes])
+    prover_inputs = [credential.t] + [bytes_to_Z_p(attr.to_bytes()) for attr in hidden_attributes]
+
+    if isinstance(pk, PreparedPublicKey):
+        # C = e(sigma_1, g_tilde^t * prod Y_tilde[i]^m_i)
+        C = credential.sigma_1.pair(pk.g_tilde ** credential.t * pk.Y_tilde_product(hidden_attributes))
+    else:
+        C = multi_exponentiation(generators, prover_inputs)
     
     # compute a non-interactive proof pi
-    c, s = generate_zkp(generators, prover_inputs, C, message)
-    pi = ZKProof(generators, c, s)
+    # C and R are shipped along so that the verifier can batch-verify the proof
+    c, s, R = generate_zkp_with_commitment(generators, prover_inputs, C, message)
+    pi = ZKProof(generators, c, s, C, R)
 
     return DisclosureProof(pi, credential)
 
@@ -237,22 +333,352 @@ def verify_disclosure_proof(
     """ Verify the disclosure proof
 
     Hint: The verifier may also want to retrieve the disclosed attributes
+
+    `pk` can be a PreparedPublicKey, in which case the Pedersen commitment is
+    computed with two pairings, whatever the number of disclosed attributes
     """
     # disclosure proof
     credential = disclosure_proof.credential_showed
     pi = disclosure_proof.pi
 
+    if getattr(pi, "indices", None) is not None:
+        return _verify_folded_disclosure_proof(pk, disclosure_proof, message, disclosed_attributes)
+
+    # the generators sent with the proof must be those derived from the key for the
+    # attributes that are not disclosed (otherwise a disclosed attribute could be listed
+    # as hidden, and its disclosed value would not be bound to the signature). They are
+    # accepted in any order, as the proofs of existing clients do not sort them.
+    hidden_indices = _undisclosed_indices(pk, disclosed_attributes)
+    if hidden_indices is None or len(pi.s) != len(hidden_indices) + 1:
+        return False
+    if not _is_permutation(pi.generators, _disclosure_generators(pk, credential, hidden_indices)):
+        return False
+
     # compute Pedersen commitment (LHS)
     # the user does not send the Pedersen commitment, the verifier can compute it from the disclosed attributes
-    # numerator
-    numerator = credential.sigma_2.pair(pk.g_tilde)
-    for disclosed_attr in disclosed_attributes:
-        idx = disclosed_attr.index
-        numerator *= credential.sigma_1.pair(pk.Y_tilde[idx]) ** (bytes_to_Z_p(disclosed_attr.to_bytes()).int_neg())
-    # denominator
-    denominator = credential.sigma_1.pair(pk.X_tilde)
-    # Pedersen commitment
-    C = numerator / denominator
+    if isinstance(pk, PreparedPublicKey):
+        # C = e(sigma_2, g_tilde) / e(sigma_1, X_tilde * prod Y_tilde[i]^m_i)
+        C = credential.sigma_2.pair(pk.g_tilde) / credential.sigma_1.pair(pk.Y_tilde_product(disclosed_attributes, with_X_tilde=True))
+    else:
+        # numerator
+        numerator = credential.sigma_2.pair(pk.g_tilde)
+        for disclosed_attr in disclosed_attributes:
+            idx = disclosed_attr.index
+            numerator *= credential.sigma_1.pair(pk.Y_tilde[idx]) ** (bytes_to_Z_p(disclosed_attr.to_bytes()).int_neg())
+        # denominator
+        denominator = credential.sigma_1.pair(pk.X_tilde)
+        # Pedersen commitment
+        C = numerator / denominator
 
     # verify ZKP
     return credential.sigma_1 != G1.unity() and verify_zkp(C, pi.generators, pi.c, pi.s, message)
+
+
+def _disclosure_generators(
+        pk: PublicKey,
+        credential: AnonymousCredential,
+        indices: List[int]
+    ) -> List[Any]:
+    """ GT generators of a disclosure proof hiding the attributes at the given indices """
+    return [credential.sigma_1.pair(pk.g_tilde)] + [credential.sigma_1.pair(pk.Y_tilde[idx]) for idx in indices]
+
+
+def _is_permutation(
+        generators: Any,
+        expected: List[Any]
+    ) -> bool:
+    """ Whether the generators of a proof are the expected generators, in any order """
+    if not isinstance(generators, list) or len(generators) != len(expected):
+        return False
+    try:
+        return sorted(generator.to_binary() for generator in generators) == sorted(generator.to_binary() for generator in expected)
+    except (AttributeError, TypeError):
+        return False
+
+
+def _undisclosed_indices(
+        pk: PublicKey,
+        disclosed_attributes: List[Attribute]
+    ) -> Optional[List[int]]:
+    """ Sorted indices of the attributes that are not disclosed, None if an attribute
+    is disclosed twice or is not an attribute of the key """
+    disclosed_indices = {attr.index for attr in disclosed_attributes}
+    if len(disclosed_indices) != len(disclosed_attributes) or not disclosed_indices <= set(range(len(pk.Y_tilde))):
+        return None
+    return [idx for idx in range(len(pk.Y_tilde)) if idx not in disclosed_indices]
+
+
+## FOLDED SHOWING PROTOCOL ##
+
+# All the GT generators of a disclosure proof share sigma_1:
+#     e(sigma_1, g_tilde)^a_0 * prod e(sigma_1, Y_tilde[i])^a_i = e(sigma_1, g_tilde^a_0 * prod Y_tilde[i]^a_i)
+# so the exponentiations can be done in G2 before pairing. The folded proof does
+# not contain the generators but the (sorted) indices of the hidden attributes:
+# - prover: C = e(sigma_1, g_tilde^t * prod Y_tilde[i]^m_i), R = e(sigma_1, g_tilde^r_0 * prod Y_tilde[i]^r_i)
+# - verifier: C = e(sigma_2, g_tilde) / e(sigma_1, X_tilde * prod_{disclosed} Y_tilde[i]^m_i),
+#             R' = C^c * e(sigma_1, g_tilde^s_0 * prod_{hidden} Y_tilde[i]^s_i)
+# The challenge is bound to sigma_1, sigma_2 and the Y_tilde[i] of the hidden
+# attributes. Both sides need O(1) pairings, whatever the number of attributes.
+
+
+def _create_folded_disclosure_proof(
+        pk: PublicKey,
+        credential: AnonymousCredential,
+        hidden_attributes: List[Attribute],
+        message: bytes
+    ) -> DisclosureProof:
+    """ Create a disclosure proof in the folded format """
+    return create_disclosure_proof_from_coupon(pk, create_disclosure_coupon(pk, credential, hidden_attributes), message)
+
+
+def create_disclosure_coupon(
+        pk: PublicKey,
+        credential: AnonymousCredential,
+        hidden_attributes: List[Attribute]
+    ) -> DisclosureCoupon:
+    """ Precompute the message-independent part of a folded disclosure proof
+
+    This contains all the group operations of the showing; it can be done ahead
+    of time (e.g. when the client is idle) for the attributes it will hide.
+    """
+    hidden_attributes = sorted(hidden_attributes, key=lambda attr: attr.index)
+    indices = [attr.index for attr in hidden_attributes]
+    prover_inputs = [credential.t] + [bytes_to_Z_p(attr.to_bytes()) for attr in hidden_attributes]
+
+    # compute Pedersen commitment (RHS)
+    if isinstance(pk, PreparedPublicKey):
+        C = credential.sigma_1.pair(pk.g_tilde ** credential.t * pk.Y_tilde_product(hidden_attributes))
+    else:
+        C = credential.sigma_1.pair(_G2_product(pk, indices, prover_inputs))
+
+    # commitment of the non-interactive proof
+    randoms = [G1.order().random() for _ in prover_inputs]
+    R = credential.sigma_1.pair(_G2_product(pk, indices, randoms))
+
+    return DisclosureCoupon(credential, hidden_attributes, prover_inputs, randoms, C, R)
+
+
+def create_disclosure_proof_from_coupon(
+        pk: PublicKey,
+        coupon: DisclosureCoupon,
+        message: bytes
+    ) -> DisclosureProof:
+    """ Create a folded disclosure proof for the message from a precomputed coupon
+
+    Only the challenge and the responses are computed. A coupon can only be used once.
+    """
+    if coupon.used:
+        raise ValueError("The disclosure coupon was already used")
+    coupon.used = True
+
+    credential = coupon.credential
+    c = get_zkp_challenge(_folded_statement(pk, credential, coupon.indices), coupon.C, coupon.R, message)
+    s = get_zkp_response(coupon.randoms, c, coupon.prover_inputs)
+    pi = ZKProof(None, c, s, coupon.C, coupon.R, coupon.indices)
+
+    return DisclosureProof(pi, credential)
+
+
+def _verify_folded_disclosure_proof(
+        pk: PublicKey,
+        disclosure_proof: DisclosureProof,
+        message: bytes,
+        disclosed_attributes: List[Attribute]
+    ) -> bool:
+    """ Verify a disclosure proof in the folded format """
+    credential = disclosure_proof.credential_showed
+    pi = disclosure_proof.pi
+    if credential.sigma_1 == G1.unity() or not _valid_hidden_indices(pk, pi, disclosed_attributes):
+        return False
+
+    # compute Pedersen commitment (LHS)
+    C = credential.sigma_2.pair(pk.g_tilde) / credential.sigma_1.pair(_disclosed_G2_product(pk, disclosed_attributes))
+    # generate R'
+    R_prime = C ** pi.c * credential.sigma_1.pair(_G2_product(pk, pi.indices, pi.s))
+    # generate c' and accept if and only if c == c'
+    return pi.c == get_zkp_challenge(_folded_statement(pk, credential, pi.indices), C, R_prime, message)
+
+
+def _valid_hidden_indices(
+        pk: PublicKey,
+        pi: ZKProof,
+        disclosed_attributes: List[Attribute]
+    ) -> bool:
+    """ Check that the hidden attributes of the proof and the given attributes partition the attributes of the key
+
+    Every attribute has to be either hidden or given exactly once: in particular, an
+    attribute disclosed twice (e.g. a request that repeats a type) is rejected, as it
+    would be counted twice in the commitment. """
+    indices = pi.indices
+    if len(pi.s) != len(indices) + 1 or any(indices[i] >= indices[i + 1] for i in range(len(indices) - 1)):
+        return False
+    all_indices = sorted(list(indices) + [attr.index for attr in disclosed_attributes])
+    return all_indices == list(range(len(pk.Y_tilde)))
+
+
+def _folded_statement(
+        pk: PublicKey,
+        credential: AnonymousCredential,
+        indices: List[int]
+    ) -> List[Any]:
+    """ Elements the challenge of a folded proof is bound to """
+    return [credential.sigma_1, credential.sigma_2] + [pk.Y_tilde[idx] for idx in indices]
+
+
+def _G2_product(
+        pk: PublicKey,
+        indices: List[int],
+        exponents: List[Bn]
+    ):
+    """ Compute g_tilde^e_0 * prod Y_tilde[indices[i]]^e_(i+1) """
+    return multi_exponentiation([pk.g_tilde] + [pk.Y_tilde[idx] for idx in indices], exponents)
+
+
+def _disclosed_G2_product(
+        pk: PublicKey,
+        disclosed_attributes: List[Attribute]
+    ):
+    """ Compute X_tilde * prod Y_tilde[i]^m_i over the disclosed attributes """
+    if isinstance(pk, PreparedPublicKey):
+        return pk.Y_tilde_product(disclosed_attributes, with_X_tilde=True)
+    if len(disclosed_attributes) == 0:
+        return pk.X_tilde
+    return pk.X_tilde * multi_exponentiation([pk.Y_tilde[attr.index] for attr in disclosed_attributes],
+                                             [bytes_to_Z_p(attr.to_bytes()) for attr in disclosed_attributes])
+
+
+## BATCH VERIFICATION ##
+
+# bit length of the random exponents used to combine the proofs of a batch
+BATCH_EXPONENT_BITS = 128
+
+
+def verify_disclosure_proofs_batch(
+        pk: PublicKey,
+        requests: List[Tuple[DisclosureProof, bytes, List[Attribute]]]
+    ) -> List[bool]:
+    """ Verify many disclosure proofs at once
+
+    Each request is a tuple (disclosure_proof, message, disclosed_attributes),
+    as passed to `verify_disclosure_proof`. Returns one verdict per request, in
+    the same order.
+
+    For every proof k the verifier has to check
+        (1) C_k == e(sigma_2, g_tilde) / e(sigma_1, X_tilde * prod Y_tilde[i]^m_i)
+        (2) R_k == C_k^c_k * prod generators[j]^s_j
+        (3) c_k == H(generators || C_k || R_k || message)
+    Equations (1) and (2) of all proofs are raised to small random exponents and
+    multiplied together, so that the pairings on the same G2 element are merged:
+    the whole batch costs 2 + |union of disclosed indices| pairings instead of
+    2 + |disclosed| pairings per proof (folded proofs also pair on the Y_tilde[i]
+    of their hidden indices, so at most 2 + L pairings in total). If the batch equation does not hold, the
+    batch is split in halves until the invalid proofs are pinpointed.
+
+    Only folded proofs are batched: the GT generators of the other format have to be
+    re-derived with one pairing each, so these proofs (and those that do not carry C
+    and R) are verified one by one.
+    """
+    verdicts = [False] * len(requests)
+    batchable = []
+    for k, (disclosure_proof, message, disclosed_attributes) in enumerate(requests):
+        if _is_batchable(pk, disclosure_proof, message, disclosed_attributes):
+            batchable.append(k)
+        else:
+            verdicts[k] = verify_disclosure_proof(pk, disclosure_proof, message, disclosed_attributes)
+
+    _verify_batch_or_bisect(pk, requests, batchable, verdicts)
+    return verdicts
+
+
+def _is_batchable(
+        pk: PublicKey,
+        disclosure_proof: DisclosureProof,
+        message: bytes,
+        disclosed_attributes: List[Attribute]
+    ) -> bool:
+    """ Check the per-proof (pairing-free) conditions of the batch verification """
+    credential = disclosure_proof.credential_showed
+    pi = disclosure_proof.pi
+    if getattr(pi, "indices", None) is None or getattr(pi, "com", None) is None or getattr(pi, "R", None) is None:
+        return False
+    if credential.sigma_1 == G1.unity():
+        return False
+    if not _valid_hidden_indices(pk, pi, disclosed_attributes):
+        return False
+    # equation (3): the challenge has to be bound to the shipped C and R
+    return pi.c == get_zkp_challenge(_folded_statement(pk, credential, pi.indices), pi.com, pi.R, message)
+
+
+def _verify_batch_or_bisect(
+        pk: PublicKey,
+        requests: List[Tuple[DisclosureProof, bytes, List[Attribute]]],
+        indices: List[int],
+        verdicts: List[bool]
+    ):
+    """ Verify the requests at `indices` as one batch, bisect on failure """
+    if len(indices) == 0:
+        return
+    if len(indices) == 1:
+        # a single proof is verified directly, this also pinpoints the bad proof
+        disclosure_proof, message, disclosed_attributes = requests[indices[0]]
+        verdicts[indices[0]] = verify_disclosure_proof(pk, disclosure_proof, message, disclosed_attributes)
+        return
+    if _check_batch_equation(pk, [requests[k] for k in indices]):
+        for k in indices:
+            verdicts[k] = True
+        return
+    middle = len(indices) // 2
+    _verify_batch_or_bisect(pk, requests, indices[:middle], verdicts)
+    _verify_batch_or_bisect(pk, requests, indices[middle:], verdicts)
+
+
+def batch_random_exponent() -> Bn:
+    """ Pick a small random exponent for combining the proofs of a batch """
+    return Bn.from_binary(os.urandom(BATCH_EXPONENT_BITS // 8))
+
+
+def _check_batch_equation(
+        pk: PublicKey,
+        requests: List[Tuple[DisclosureProof, bytes, List[Attribute]]]
+    ) -> bool:
+    """ Check the randomized product of equations (1) and (2) over all requests """
+    p = G1.order()
+
+    # GT side of the equation, as bases and exponents of a multi-exponentiation
+    gt_bases, gt_exponents = [], []
+    # G1 side of the equation, grouped by the G2 element it is paired with
+    # (key "g_tilde", "X_tilde" or the index i of Y_tilde[i])
+    g1_terms = {}
+
+    def add_g1_term(key, base, exponent):
+        bases, exponents = g1_terms.setdefault(key, ([], []))
+        bases.append(base)
+        exponents.append(exponent.mod(p))
+
+    for disclosure_proof, _, disclosed_attributes in requests:
+        credential = disclosure_proof.credential_showed
+        pi = disclosure_proof.pi
+        # random exponents for equation (1) and (2)
+        delta, epsilon = batch_random_exponent(), batch_random_exponent()
+
+        # equation (2): (C^c * prod generators[j]^s_j / R)^delta
+        # with prod generators[j]^s_j = e(sigma_1, g_tilde^s_0 * prod Y_tilde[i]^s_i) (folded proofs)
+        gt_bases += [pi.com, pi.R]
+        gt_exponents += [(pi.c * delta - epsilon).mod(p), delta.int_neg().mod(p)]
+        add_g1_term("g_tilde", credential.sigma_1, pi.s[0] * delta)
+        for idx, resp in zip(pi.indices, pi.s[1:]):
+            add_g1_term(idx, credential.sigma_1, resp * delta)
+
+        # equation (1): (e(sigma_2, g_tilde) / (e(sigma_1, X_tilde * prod Y_tilde[i]^m_i) * C))^epsilon
+        add_g1_term("g_tilde", credential.sigma_2, epsilon)
+        add_g1_term("X_tilde", credential.sigma_1, epsilon.int_neg())
+        for disclosed_attr in disclosed_attributes:
+            add_g1_term(disclosed_attr.index, credential.sigma_1, (bytes_to_Z_p(disclosed_attr.to_bytes()) * epsilon).int_neg())
+
+    gt_product = multi_exponentiation(gt_bases, gt_exponents)
+    for key, (bases, exponents) in g1_terms.items():
+        g2_element = pk.g_tilde if key == "g_tilde" else pk.X_tilde if key == "X_tilde" else pk.Y_tilde[key]
+        gt_product *= multi_exponentiation(bases, exponents).pair(g2_element)
+
+    return gt_product == GT.unity()
+
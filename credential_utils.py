@@ -1,7 +1,9 @@
 import hashlib
 import os
+import threading
+from collections import OrderedDict
 from petrelic.bn import Bn
-from petrelic.multiplicative.pairing import G1
+from petrelic.multiplicative.pairing import G1, G2
 from typing import List, Any
 
 
@@ -20,8 +22,121 @@ class Attribute:
     def __repr__(self):
         return "[{}]: {},{}".format(str(self.index), self.key, self.value)
 
+# window size (in bits) of the fixed-base tables
+FIXED_BASE_WINDOW_BITS = 4
+# a table is only built for a base that has been exponentiated this many times
+FIXED_BASE_MIN_USES = 2
+# generate_key builds the tables of g and g_tilde from this many attributes on
+# (a table costs about as much as 3 exponentiations)
+FIXED_BASE_KEYGEN_MIN_ATTRIBUTES = 8
+# default maximum number of precomputed group elements per key (~32 tables)
+DEFAULT_PRECOMPUTATION_BUDGET = 32 * 64 * 15
+
+
+class FixedBaseTable:
+    """ Precomputed powers of a fixed base for the windowed fixed-base exponentiation
+
+    table[j][d] = base^(d * 2^(w*j)), so base^e is the product of one entry per
+    w-bit window of e: no squaring is needed at exponentiation time."""
+    def __init__(self, base, window_bits: int = FIXED_BASE_WINDOW_BITS):
+        self.window_bits = window_bits
+        self.mask = (1 << window_bits) - 1
+        num_windows = (G1.order().int().bit_length() + window_bits - 1) // window_bits
+
+        self.table = []
+        window_base = base
+        for _ in range(num_windows):
+            row = [None, window_base]
+            for _ in range(2, self.mask + 1):
+                row.append(row[-1] * window_base)
+            self.table.append(row)
+            window_base = row[-1] * window_base
+
+    @staticmethod
+    def num_elements(window_bits: int = FIXED_BASE_WINDOW_BITS) -> int:
+        """ Number of group elements stored in a table """
+        num_windows = (G1.order().int().bit_length() + window_bits - 1) // window_bits
+        return num_windows * ((1 << window_bits) - 1)
+
+    def power(self, exponent: Bn):
+        """ Return base^exponent """
+        e = exponent.mod(G1.order()).int()
+        result = None
+        for row in self.table:
+            digit = e & self.mask
+            if digit:
+                result = row[digit] if result is None else result * row[digit]
+            e >>= self.window_bits
+        # exponent = 0 mod p
+        return result if result is not None else self.table[0][1] ** exponent
+
+    def powers(self, exponents: List[Bn]) -> List[Any]:
+        """ Return [base^e for e in exponents] """
+        return [self.power(exponent) for exponent in exponents]
+
+class FixedBaseCache:
+    """ Fixed-base tables for the bases of a key, within a memory budget
+
+    The budget is the maximum number of precomputed group elements. Tables are built
+    for the bases that are used repeatedly, until the budget is exhausted; the other
+    bases are exponentiated directly.
+
+    The cache can be used by several threads (e.g. a key shared through the
+    server's KeyCache): the bookkeeping is done under a lock, the tables are
+    built outside of it and are read-only once stored."""
+    def __init__(self, budget: int = DEFAULT_PRECOMPUTATION_BUDGET, min_uses: int = FIXED_BASE_MIN_USES):
+        self.budget = budget
+        self.min_uses = min_uses
+        self.size = 0
+        self.tables = {}
+        self.uses = {}
+        self.lock = threading.Lock()
+
+    def add(self, key, table: FixedBaseTable) -> bool:
+        """ Store a table if it fits in the budget, returns whether it was stored """
+        table_size = len(table.table) * table.mask
+        with self.lock:
+            if key in self.tables or self.size + table_size > self.budget:
+                return False
+            self.tables[key] = table
+            self.size += table_size
+            return True
+
+    def uses_table(self, key) -> bool:
+        """ Return whether the next `power` of this base goes through a table (existing or built then) """
+        with self.lock:
+            if key in self.tables:
+                return True
+            return self.uses.get(key, 0) + 1 >= self.min_uses and self.size + FixedBaseTable.num_elements() <= self.budget
+
+    def count_use(self, key):
+        """ Count a use of a base exponentiated without the cache (e.g. in a multi-exponentiation) """
+        with self.lock:
+            self.uses[key] = self.uses.get(key, 0) + 1
+
+    def power(self, key, base, exponent: Bn):
+        """ Return base^exponent, `key` identifies the base in the cache """
+        with self.lock:
+            table = self.tables.get(key)
+            if table is None:
+                self.uses[key] = self.uses.get(key, 0) + 1
+                build = self.uses[key] >= self.min_uses and self.size + FixedBaseTable.num_elements() <= self.budget
+        if table is not None:
+            return table.power(exponent)
+        if not build:
+            return base ** exponent
+        table = FixedBaseTable(base)
+        if not self.add(key, table):
+            # another thread may have stored a table for the base meanwhile
+            table = self.tables.get(key, table)
+        return table.power(exponent)
+
 class PublicKey:
-    """ Public key of the signer/issuer"""
+    """ Public key of the signer/issuer
+
+    Exponentiations of the fixed bases g, Y[i] and g_tilde can go through
+    `g_power`, `Y_power` and `g_tilde_power`, which use fixed-base tables cached on
+    the key (see `set_precomputation_budget`). The tables are never serialized."""
     def __init__(self, g, Y, g_tilde, X_tilde, Y_tilde, attr_indices_dict: dict[str, int]):
         self.g = g
         self.Y = Y
@@ -30,9 +145,103 @@ class PublicKey:
         self.Y_tilde = Y_tilde
         self.attr_indices_dict = attr_indices_dict
 
+    def fixed_base_cache(self) -> FixedBaseCache:
+        """ Return the fixed-base tables of the key, created on first use """
+        cache = self.__dict__.get("_fixed_base_cache")
+        if cache is None:
+            # setdefault keeps a single cache if several threads use the key for the first time
+            cache = self.__dict__.setdefault("_fixed_base_cache", FixedBaseCache())
+        return cache
+
+    def set_precomputation_budget(self, budget: int):
+        """ Set the maximum number of precomputed group elements kept for this key """
+        self.fixed_base_cache().budget = budget
+
+    def g_power(self, exponent: Bn):
+        return self.fixed_base_cache().power(("g", None), self.g, exponent)
+
+    def Y_power(self, index: int, exponent: Bn):
+        return self.fixed_base_cache().power(("Y", index), self.Y[index], exponent)
+
+    def g_tilde_power(self, exponent: Bn):
+        return self.fixed_base_cache().power(("g_tilde", None), self.g_tilde, exponent)
+
+    def __getstate__(self):
+        # precomputations are local to the process and are never serialized
+        state = self.__dict__.copy()
+        state.pop("_fixed_base_cache", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
     def __repr__(self):
         return "g: {}, Y: {}, g_tilde: {}, X_tilde: {}, Y_tilde: {}, attr_indices_dict: {}".format(self.g, self.Y, self.g_tilde, self.X_tilde, self.Y_tilde, self.attr_indices_dict)
 
+class PreparedPublicKey(PublicKey):
+    """ Public key of the signer/issuer with cached G2-side precomputations
+
+    The G2 elements of the key (g_tilde, X_tilde, Y_tilde) are fixed for its whole
+    lifetime, and so are the attribute values a client hides or a verifier expects
+    ("key:true", "key:false", ...). The products X_tilde * prod Y_tilde[i]^m_i and
+    prod Y_tilde[i]^m_i only depend on these, so they are computed once and cached;
+    a showing then needs a single pairing against the cached product instead of one
+    pairing per attribute. Build it once per key and pass it wherever a PublicKey
+    is expected; it can be shared by several threads (the caches are updated
+    under a lock, the products are computed outside of it)."""
+    def __init__(self, pk: PublicKey, cache_size: int = 256):
+        super().__init__(pk.g, pk.Y, pk.g_tilde, pk.X_tilde, pk.Y_tilde, pk.attr_indices_dict)
+        # share the fixed-base tables of the original key
+        self._fixed_base_cache = pk.fixed_base_cache()
+        self.cache_size = cache_size
+        self._scalars = {}
+        self._products = OrderedDict()
+        self._lock = threading.Lock()
+
+    def attribute_to_Z_p(self, attribute: Attribute) -> Bn:
+        """ Return the (cached) scalar of an attribute """
+        attr_bytes = attribute.to_bytes()
+        with self._lock:
+            scalar = self._scalars.get(attr_bytes)
+        if scalar is None:
+            scalar = bytes_to_Z_p(attr_bytes)
+            with self._lock:
+                self._scalars[attr_bytes] = scalar
+        return scalar
+
+    def Y_tilde_product(self, attributes: List[Attribute], with_X_tilde: bool = False):
+        """ Return prod Y_tilde[i]^m_i over the attributes (times X_tilde if requested) """
+        key = (with_X_tilde, tuple(sorted((attr.index, attr.to_bytes()) for attr in attributes)))
+        with self._lock:
+            if key in self._products:
+                self._products.move_to_end(key)
+                return self._products[key]
+
+        product = self.X_tilde if with_X_tilde else G2.unity()
+        for attr in attributes:
+            product *= self.Y_tilde[attr.index] ** self.attribute_to_Z_p(attr)
+
+        with self._lock:
+            self._products[key] = product
+            self._products.move_to_end(key)
+            if len(self._products) > self.cache_size:
+                self._products.popitem(last=False)
+        return product
+
+    def __getstate__(self):
+        # caches are local to the process and are never serialized
+        state = super().__getstate__()
+        state["_scalars"] = {}
+        state["_products"] = OrderedDict()
+        state.pop("_lock", None)
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._scalars = {}
+        self._products = OrderedDict()
+        self._lock = threading.Lock()
+
 class SecretKey:
     """ Secret key of the signer/issuer"""
     def __init__(self, x, X, y):
@@ -66,10 +275,21 @@ class BlindSignature:
         self.sigma_2 = sigma_2
 
 class ZKProof:
-    def __init__(self, generators, c, s):
+    """ Non-interactive proof of knowledge (Option 1 in zkp_utils)
+
+    com and R are optional: they are not needed to verify a single proof,
+    but are required to verify many proofs at once (batch verification)
+
+    Issuance proofs and folded disclosure proofs do not contain the generators
+    (None) but the indices of the hidden attributes, from which the verifier
+    derives them"""
+    def __init__(self, generators, c, s, com=None, R=None, indices=None):
         self.generators = generators
         self.c = c
         self.s = s
+        self.com = com
+        self.R = R
+        self.indices = indices
 
 class IssueRequest:
     def __init__(self, C, pi):
@@ -87,6 +307,25 @@ class State:
     def __init__(self, t: Bn):
         self.t = t
 
+class DisclosureCoupon:
+    """ Message-independent part of a folded disclosure proof
+
+    Holds the anonymized credential, the hidden attributes (sorted by index), the
+    prover inputs and randoms of the ZKP and its commitments C and R. Only the
+    challenge and the responses remain to be computed for a message. The randoms
+    are secret and a coupon must be used for a single proof: two responses
+    with the same randoms reveal the hidden attributes."""
+    def __init__(self, credential: AnonymousCredential, hidden_attributes: List[Attribute],
+                 prover_inputs: List[Bn], randoms: List[Bn], C, R):
+        self.credential = credential
+        self.hidden_attributes = hidden_attributes
+        self.indices = [attr.index for attr in hidden_attributes]
+        self.prover_inputs = prover_inputs
+        self.randoms = randoms
+        self.C = C
+        self.R = R
+        self.used = False
+
 #######################################
 ## CREDENTIAL SCHEME HELPER FUNCTIONS##
 #######################################
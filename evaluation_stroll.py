@@ -5,6 +5,7 @@ import pytest
 from timeit import default_timer as timer
 from typing import List, Any, Tuple
 
+import compact_serialization
 from credential_utils import PublicKey
 from serialization_utils import serialize_to_bytes, from_bytes_deserialize
 from stroll import Server, Client
@@ -17,15 +18,30 @@ NUM_EXECUTIONS_SD = 30
 """ Evaluation utilities """
 
 
-def measure_communication_cost(items: List[Any]) -> float:
+def measure_communication_cost(items: List[Any], compact: bool = False) -> float:
     """ Utility for measuring communication cost """
     """ Returns result in kilobytes """
+    """ With compact, items serialized by the client/server (bytes) are re-encoded
+    with the compact binary codec, the other items are measured as before """
     total_bytes = 0
     for item in items:
-        total_bytes += len(serialize_to_bytes(item))
+        if compact and isinstance(item, bytes):
+            total_bytes += len(to_compact_bytes(item))
+        else:
+            total_bytes += len(serialize_to_bytes(item))
     return convert_bytes_to_kb(total_bytes)
 
 
+def to_compact_bytes(item: bytes) -> bytes:
+    """ Re-encode a serialized object with the compact binary codec """
+    """ Plain bytes (e.g. the message) are returned unchanged """
+    try:
+        obj = from_bytes_deserialize(item)
+    except Exception:
+        return item
+    return compact_serialization.encode(obj) if compact_serialization.can_encode(obj) else item
+
+
 def convert_bytes_to_kb(num_bytes: int) -> float:
     """ Utility for converting bytes to kilobytes """
     return num_bytes / float(1024)
@@ -49,7 +65,7 @@ def test_evaluation(num_attributes, write_header):
     """ The integration test for the evaluation """
     
     if write_header:
-        write_result("num_attributes,generation_comp,generation_comm,issuance_comp,issuance_comm,showing_comp,showing_comm,verification_comp,verification_comm")
+        write_result("num_attributes,generation_comp,generation_comm,issuance_comp,issuance_comm,showing_comp,showing_comm,verification_comp,verification_comm,issuance_comm_compact,showing_comm_compact")
     
     for _ in range(NUM_EXECUTIONS_SD):
         ### KEY GENERATION ###
@@ -83,7 +99,8 @@ def test_evaluation(num_attributes, write_header):
         issuance_comp_cost = timer() - start_issuance
     
         issuance_comm_cost = measure_communication_cost([issue_request, subscriptions, signature])
-        print("Issuance: {}s,{}kb".format(issuance_comp_cost, issuance_comm_cost))
+        issuance_comm_cost_compact = measure_communication_cost([issue_request, subscriptions, signature], compact=True)
+        print("Issuance: {}s,{}kb ({}kb compact)".format(issuance_comp_cost, issuance_comm_cost, issuance_comm_cost_compact))
     
         ### SHOWING CREDENTIAL ###
         # setup
@@ -97,7 +114,8 @@ def test_evaluation(num_attributes, write_header):
         disclosure_comp_cost = timer() - start_disclosure
     
         disclosure_comm_cost = measure_communication_cost([message, types, disclosure_proof])
-        print("Showing: {}s,{}kb".format(disclosure_comp_cost, disclosure_comm_cost))
+        disclosure_comm_cost_compact = measure_communication_cost([message, types, disclosure_proof], compact=True)
+        print("Showing: {}s,{}kb ({}kb compact)".format(disclosure_comp_cost, disclosure_comm_cost, disclosure_comm_cost_compact))
     
         ### VERIFYING CREDENTIAL ###
         # operation
@@ -109,7 +127,7 @@ def test_evaluation(num_attributes, write_header):
         verification_comm_cost = measure_communication_cost([])
         print("Verifying: {}s,{}kb".format(verification_comp_cost, verification_comm_cost))
     
-        write_result("{},{},{},{},{},{},{},{},{}".format(str(num_attributes), str(generation_comp_cost), str(generation_comm_cost), str(issuance_comp_cost), str(issuance_comm_cost), str(disclosure_comp_cost), str(disclosure_comm_cost), str(verification_comp_cost), str(verification_comm_cost)))
+        write_result("{},{},{},{},{},{},{},{},{},{},{}".format(str(num_attributes), str(generation_comp_cost), str(generation_comm_cost), str(issuance_comp_cost), str(issuance_comm_cost), str(disclosure_comp_cost), str(disclosure_comm_cost), str(verification_comp_cost), str(verification_comm_cost), str(issuance_comm_cost_compact), str(disclosure_comm_cost_compact)))
 
 
 """ Utility tests """
@@ -1,13 +1,48 @@
+import argparse
+from collections import deque
+import glob
+import os
 import sys
+import time
 
 import numpy as np
 import pandas as pd
 import sklearn.metrics
+import joblib
+from joblib import Parallel, delayed
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import StratifiedKFold
-
-
-def classify(train_features, train_labels, test_features, test_labels):
+from sklearn.inspection import permutation_importance
+from sklearn.model_selection import StratifiedKFold, train_test_split
+
+FEATURES_FILE = 'part_3/features.csv'
+
+# Default parameters of the random forest
+N_ESTIMATORS = 300
+MAX_DEPTH = None
+
+# Default parameters of the online model
+ONLINE_MODEL_FILE = 'part_3/online_model.joblib'
+TREES_PER_BATCH = 50
+MAX_FORESTS = 20
+BATCH_SIZE = 500
+ROLLING_WINDOW = 1000
+ROLLING_TOP_K = (1, 2, 3, 5)
+
+# Default parameters of the exported model and of the batch inference
+FOREST_FILE = 'part_3/forest.npz'
+INFERENCE_TOP_K = 5
+
+# Default parameters of the feature selection
+SELECTION_FILE = 'part_3/feature_selection.csv'
+SELECTED_FEATURES_FILE = 'part_3/features_selected.csv'
+SELECTED_COLUMNS_FILE = 'part_3/selected_columns.txt'
+PERMUTATION_REPEATS = 5
+HOLDOUT_SIZE = 0.2
+ACCURACY_TOLERANCE = 0.01
+
+
+def classify(train_features, train_labels, test_features, test_labels,
+             n_estimators=N_ESTIMATORS, max_depth=MAX_DEPTH, n_jobs=None, random_state=None):
     """Function to perform classification, using a
     Random Forest. 
 
@@ -18,30 +53,63 @@ def classify(train_features, train_labels, test_features, test_labels):
         train_labels (numpy array): list of labels used to train the classifier
         test_features (numpy array): list of features used to test the classifier
         test_labels (numpy array): list of labels (ground truth) of the test dataset
+        n_estimators (int): number of trees of the forest
+        max_depth (int): maximum depth of the trees (None: unlimited)
+        n_jobs (int): number of jobs to fit and evaluate the trees in parallel
+        random_state (int): seed of the forest
 
     Returns:
         predictions: list of labels predicted by the classifier for test_features
+        predictions_prob: class probabilities for test_features (columns in the order of classes)
+        feature_importances: importance of each feature
+        score: accuracy on the test dataset
+        classes: labels of the columns of predictions_prob
 
     Note: You are free to make changes the parameters of the RandomForestClassifier().
     """
 
     # Initialize a random forest classifier. Change parameters if desired.
-    clf = RandomForestClassifier(n_estimators=300)
+    clf = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, n_jobs=n_jobs, random_state=random_state)
     # Train the classifier using the training features and labels.
     clf.fit(train_features, train_labels)
     # Use the classifier to make predictions on the test features.
-    predictions = clf.predict(test_features)
+    # predict() and score() would evaluate the forest again: both are derived from the probabilities
     predictions_prob = clf.predict_proba(test_features)
+    predictions = clf.classes_[np.argmax(predictions_prob, axis=1)]
+    score = sklearn.metrics.accuracy_score(test_labels, predictions)
+
+    return predictions, predictions_prob, clf.feature_importances_, score, clf.classes_
 
-    return predictions, predictions_prob, clf.feature_importances_, clf.score(test_features, test_labels)
 
+def evaluate_fold(X_train, y_train, X_test, y_test, n_estimators=N_ESTIMATORS, max_depth=MAX_DEPTH, n_jobs=None,
+                  random_state=None):
+    """Train and evaluate the classifier on one fold.
 
-def perform_crossval(features, labels, folds=10):
+    Returns:
+        accuracy, f1, top 2, top 3 and top 5 accuracies, feature importances
+    """
+    predictions, predictions_prob, importance, score, classes = classify(X_train, y_train, X_test, y_test,
+                                                                        n_estimators, max_depth, n_jobs, random_state)
+    return (score,
+            sklearn.metrics.f1_score(y_test, predictions, average='weighted'),
+            sklearn.metrics.top_k_accuracy_score(y_test, predictions_prob, k=2, labels=classes),
+            sklearn.metrics.top_k_accuracy_score(y_test, predictions_prob, k=3, labels=classes),
+            sklearn.metrics.top_k_accuracy_score(y_test, predictions_prob, k=5, labels=classes),
+            importance)
+
+
+def perform_crossval(features, labels, folds=10, n_estimators=N_ESTIMATORS, max_depth=MAX_DEPTH, n_jobs=1,
+                     fold_jobs=-1, random_state=None):
     """Function to perform cross-validation.
     Args:
         features (list): list of features
         labels (list): list of labels
         folds (int): number of fold for cross-validation (default=10)
+        n_estimators (int): number of trees of the forests
+        max_depth (int): maximum depth of the trees (None: unlimited)
+        n_jobs (int): number of jobs used by each forest
+        fold_jobs (int): number of folds evaluated in parallel (-1: one per core)
+        random_state (int): seed of the forests
     Returns:
         You can modify this as you like.
     
@@ -57,41 +125,33 @@ def perform_crossval(features, labels, folds=10):
     labels = np.array(labels)
     features = np.array(features)
 
+    # the folds are independent: they are trained and evaluated in parallel
+    fold_results = Parallel(n_jobs=fold_jobs)(
+        delayed(evaluate_fold)(features[train_index], labels[train_index], features[test_index], labels[test_index],
+                               n_estimators, max_depth, n_jobs, random_state)
+        for train_index, test_index in kf.split(features, labels))
+
     # Scores
-    accuracy = []
-    f1 = []
-    top_2_accuracy = []
-    top_3_accuracy = []
-    top_5_accuracy = []
+    accuracy, f1, top_2_accuracy, top_3_accuracy, top_5_accuracy, importances = (list(scores) for scores in zip(*fold_results))
 
     feature_importance_list = []
     for i in range(num_features):
-        feature_importance_list.append([])
-
-    for train_index, test_index in kf.split(features, labels):
-        X_train, X_test = features[train_index], features[test_index]
-        y_train, y_test = labels[train_index], labels[test_index]
-        predictions, predictions_prob, importance, score = classify(X_train, y_train, X_test, y_test)
-        # Evaluate performance
-        accuracy.append(sklearn.metrics.accuracy_score(y_test, predictions))
-        f1.append(sklearn.metrics.f1_score(y_test, predictions, average='weighted'))
-        top_2_accuracy.append(sklearn.metrics.top_k_accuracy_score(y_test, predictions_prob))
-        top_3_accuracy.append(sklearn.metrics.top_k_accuracy_score(y_test, predictions_prob, k=3))
-        top_5_accuracy.append(sklearn.metrics.top_k_accuracy_score(y_test, predictions_prob, k=5))
-        for i in range(num_features):
-            feature_importance_list[i].append(importance[i])
+        feature_importance_list.append([importance[i] for importance in importances])
 
     return accuracy, f1, top_2_accuracy, top_3_accuracy, top_5_accuracy, feature_importance_list
 
 
-def load_data():
+def load_data(path=FEATURES_FILE, use_cache=True):
     """Function to load data that will be used for classification.
 
     Args:
-        You can provide the args you want.
+        path (str): CSV file with one row per trace: label, features... (no header)
+        use_cache (bool): whether to load the table from (and save it to) a .npy
+            file next to the CSV, which is memory-mapped instead of parsed; it is
+            rebuilt when the CSV is newer
     Returns:
-        features (list): the list of features you extract from every trace
-        labels (list): the list of identifiers for each trace
+        features (numpy array): the features you extract from every trace (one row per trace)
+        labels (numpy array): the identifiers for each trace
     
     An example: Assume you have traces (trace1...traceN) for cells with IDs in the
     range 1-N.  
@@ -111,31 +171,421 @@ def load_data():
     feature extraction on your own.
     """
 
-    features = []
-    labels = []
+    cache_path = os.path.splitext(path)[0] + '.npy'
+    if use_cache and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        table = np.load(cache_path, mmap_mode='r')
+    else:
+        table = pd.read_csv(path, header=None).to_numpy(dtype=np.float64)
+        if use_cache:
+            # written under another name first, so that a concurrent reader never sees a partial file
+            tmp_path = cache_path[:-len('.npy')] + '.tmp.npy'
+            np.save(tmp_path, table)
+            os.replace(tmp_path, cache_path)
+
+    return table[:, 1:], table[:, 0].astype(int)
+
+
+class OnlineForest:
+    """Random forest grown batch by batch, for traces that arrive continuously.
+
+    Every call to partial_fit trains a new forest of trees_per_batch trees on the
+    new traces only; the model averages the class probabilities of its forests
+    (weighted by their number of trees), over the union of the cells they know.
+    Only the max_forests most recent forests are kept, so the model follows the
+    changes of the traffic. update() evaluates the model on a new batch before
+    training on it (prequential evaluation), which gives rolling accuracy and
+    top-k accuracy over the last `window` traces.
+    """
 
-    df = pd.read_csv('part_3/features.csv')
-    for row in df.iterrows():
-        features_list = row[1][1:].tolist()
-        features.append([float(feature) for feature in features_list])
-        labels.append(int(row[1][0]))
+    def __init__(self, trees_per_batch=TREES_PER_BATCH, max_forests=MAX_FORESTS, max_depth=MAX_DEPTH, n_jobs=None,
+                 window=ROLLING_WINDOW, random_state=None):
+        self.trees_per_batch = trees_per_batch
+        self.max_forests = max_forests
+        self.max_depth = max_depth
+        self.n_jobs = n_jobs
+        self.random_state = np.random.RandomState(random_state)
+        self.forests = []
+        self.classes_ = np.empty(0, dtype=int)
+        self.n_seen = 0
+        # whether each of the last traces had its cell in the k most probable cells
+        self.hits = {k: deque(maxlen=window) for k in ROLLING_TOP_K}
+
+    def partial_fit(self, features, labels):
+        """Train a new forest on the traces."""
+        forest = RandomForestClassifier(n_estimators=self.trees_per_batch, max_depth=self.max_depth, n_jobs=self.n_jobs,
+                                        random_state=self.random_state.randint(np.iinfo(np.int32).max))
+        forest.fit(features, labels)
+        self.forests.append(forest)
+        # max_forests may have been lowered since the last update (see run_online)
+        while len(self.forests) > self.max_forests:
+            self.forests.pop(0)
+        self.classes_ = np.unique(np.concatenate([forest.classes_ for forest in self.forests]))
+        self.n_seen += len(labels)
+        return self
+
+    def predict_proba(self, features):
+        if not self.forests:
+            raise ValueError("The model is not trained")
+        predictions_prob = np.zeros((len(features), len(self.classes_)))
+        for forest in self.forests:
+            columns = np.searchsorted(self.classes_, forest.classes_)
+            predictions_prob[:, columns] += forest.predict_proba(features) * forest.n_estimators
+        return predictions_prob / sum(forest.n_estimators for forest in self.forests)
+
+    def predict(self, features):
+        return self.classes_[np.argmax(self.predict_proba(features), axis=1)]
+
+    @property
+    def feature_importances_(self):
+        return np.average([forest.feature_importances_ for forest in self.forests], axis=0,
+                          weights=[forest.n_estimators for forest in self.forests])
+
+    def update(self, features, labels):
+        """Evaluate the model on new traces, then train on them. Returns the rolling metrics."""
+        labels = np.asarray(labels)
+        if self.forests:
+            ranked = self.classes_[np.argsort(-self.predict_proba(features), axis=1, kind='stable')]
+            for k, hits in self.hits.items():
+                hits.extend(np.any(ranked[:, :k] == labels[:, None], axis=1).tolist())
+        self.partial_fit(features, labels)
+        return self.rolling_metrics()
+
+    def rolling_metrics(self):
+        """Accuracy and top-k accuracies over the last evaluated traces (NaN before the first evaluation)."""
+        metrics = {'traces_seen': self.n_seen, 'traces_evaluated': len(self.hits[1])}
+        for k, hits in self.hits.items():
+            metrics['accuracy' if k == 1 else f'top_{k}_accuracy'] = np.mean(hits) if hits else np.nan
+        return metrics
+
+    def save(self, path):
+        # the state is stored as a dict of standard and sklearn objects, so that the
+        # file does not depend on the module the class was pickled from (e.g. __main__)
+        state = dict(self.__dict__)
+        state['hits'] = {k: (list(hits), hits.maxlen) for k, hits in self.hits.items()}
+        joblib.dump(state, path, compress=3)
+
+    @staticmethod
+    def load(path):
+        state = joblib.load(path)
+        state['hits'] = {k: deque(hits, maxlen=maxlen) for k, (hits, maxlen) in state['hits'].items()}
+        model = OnlineForest()
+        model.__dict__.update(state)
+        return model
+
+
+def classify_online(model, train_features, train_labels, test_features, test_labels):
+    """Same as classify(), with an OnlineForest that is trained incrementally on train_features."""
+    model.partial_fit(train_features, train_labels)
+    predictions_prob = model.predict_proba(test_features)
+    predictions = model.classes_[np.argmax(predictions_prob, axis=1)]
+    score = sklearn.metrics.accuracy_score(test_labels, predictions)
+
+    return predictions, predictions_prob, model.feature_importances_, score, model.classes_
+
+
+class CompactForest:
+    """Random forest exported to flat NumPy arrays, with its own inference.
+
+    All the nodes of all the trees are stored in the same arrays (feature,
+    threshold, children), and the leaves keep their class probabilities as
+    float32. It is saved with np.savez_compressed, loads without sklearn (nor
+    pickle), and evaluates a whole batch of traces per tree level. Splits are
+    evaluated as in sklearn (features cast to float32, go left if <= threshold).
+
+    The forest keeps the columns of the extracted features it was trained on
+    (e.g. after feature selection) and their total number: the traces to
+    classify always have all the extracted features, the forest picks its own.
+    """
 
-    return features, labels
+    def __init__(self, classes, roots, feature, threshold, left, right, leaf_index, leaf_values, columns, n_features):
+        self.classes_ = classes
+        # columns of the extracted features used by the trees (feature i of the trees is column columns[i])
+        self.columns = columns
+        # number of extracted features of a trace
+        self.n_features = int(n_features)
+        # node of the root of every tree
+        self.roots = roots
+        # split feature (-1 for the leaves), threshold, and children of every node
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        # row of every leaf in leaf_values (class probabilities)
+        self.leaf_index = leaf_index
+        self.leaf_values = leaf_values
+
+    @staticmethod
+    def from_forests(forests, classes=None, columns=None, n_features=None):
+        """Export the trees of sklearn forests (e.g. a RandomForestClassifier or the forests of an OnlineForest).
+
+        columns are the columns of the extracted features the forests were trained on
+        (default: all of them), n_features the number of extracted features.
+        """
+        if columns is None:
+            columns = np.arange(forests[0].n_features_in_)
+        if n_features is None:
+            n_features = len(columns)
+        if classes is None:
+            classes = np.unique(np.concatenate([forest.classes_ for forest in forests]))
+        roots, feature, threshold, left, right, leaf_index, leaf_values = [], [], [], [], [], [], []
+        n_nodes = 0
+        n_leaves = 0
+        for forest in forests:
+            class_columns = np.searchsorted(classes, forest.classes_)
+            for estimator in forest.estimators_:
+                tree = estimator.tree_
+                is_leaf = tree.children_left == -1
+                roots.append(n_nodes)
+                feature.append(np.where(is_leaf, -1, tree.feature))
+                threshold.append(tree.threshold)
+                left.append(np.where(is_leaf, -1, tree.children_left + n_nodes))
+                right.append(np.where(is_leaf, -1, tree.children_right + n_nodes))
+                leaf_index.append(np.where(is_leaf, n_leaves + np.cumsum(is_leaf) - 1, -1))
+                counts = tree.value[is_leaf, 0, :]
+                values = np.zeros((len(counts), len(classes)))
+                values[:, class_columns] = counts / counts.sum(axis=1, keepdims=True)
+                leaf_values.append(values)
+                n_nodes += tree.node_count
+                n_leaves += len(counts)
+        return CompactForest(np.asarray(classes), np.asarray(roots, dtype=np.int32),
+                             np.concatenate(feature).astype(np.int32), np.concatenate(threshold),
+                             np.concatenate(left).astype(np.int32), np.concatenate(right).astype(np.int32),
+                             np.concatenate(leaf_index).astype(np.int32), np.concatenate(leaf_values).astype(np.float32),
+                             np.asarray(columns, dtype=np.int32), n_features)
+
+    def save(self, path):
+        arrays = dict(self.__dict__)
+        arrays['classes'] = arrays.pop('classes_')
+        np.savez_compressed(path, **arrays)
+
+    @staticmethod
+    def load(path):
+        with np.load(path, allow_pickle=False) as arrays:
+            return CompactForest(**{name: arrays[name] for name in arrays.files})
+
+    def predict_proba(self, features):
+        features = np.asarray(features, dtype=np.float32)
+        if features.ndim != 2 or features.shape[1] != self.n_features:
+            raise ValueError("Expected traces with %d features, got an array of shape %s"
+                             % (self.n_features, features.shape))
+        features = features[:, self.columns]
+        rows = np.arange(len(features))
+        predictions_prob = np.zeros((len(features), len(self.classes_)))
+        for root in self.roots:
+            nodes = np.full(len(features), root, dtype=np.int32)
+            active = self.feature[nodes] >= 0
+            while active.any():
+                current = nodes[active]
+                go_left = features[rows[active], self.feature[current]] <= self.threshold[current]
+                nodes[active] = np.where(go_left, self.left[current], self.right[current])
+                active = self.feature[nodes] >= 0
+            predictions_prob += self.leaf_values[self.leaf_index[nodes]]
+        return predictions_prob / len(self.roots)
+
+    def predict(self, features):
+        return self.classes_[np.argmax(self.predict_proba(features), axis=1)]
+
+
+def export_model(model, path=FOREST_FILE, columns=None, n_features=None):
+    """Export a RandomForestClassifier or an OnlineForest as a CompactForest file.
+
+    columns and n_features are those of CompactForest.from_forests, for a model
+    trained on a selection of the extracted features.
+    """
+    forests = model.forests if isinstance(model, OnlineForest) else [model]
+    CompactForest.from_forests(forests, model.classes_, columns, n_features).save(path)
 
 
-def main():
-    """Please complete this skeleton to implement cell fingerprinting.
-    This skeleton provides the code to perform classification 
-    using a Random Forest classifier. You are free to modify the 
-    provided functions as you wish.
+def import_model(path=FOREST_FILE):
+    return CompactForest.load(path)
 
-    Read about random forests: https://towardsdatascience.com/understanding-random-forest-58381e0602d2
+
+def classify_batch(model, features, k=INFERENCE_TOP_K):
+    """Top-k cells of every trace with a pre-loaded model.
+
+    Returns:
+        top_k_cells (numpy array): the k most probable cells of every trace, most probable first
+        top_k_prob (numpy array): their probabilities
+    """
+    predictions_prob = model.predict_proba(features)
+    order = np.argsort(-predictions_prob, axis=1, kind='stable')[:, :k]
+    return model.classes_[order], np.take_along_axis(predictions_prob, order, axis=1)
+
+
+def run_export(namespace):
+    """Train a random forest on namespace.data (restricted to the columns of namespace.columns, if any) and export it."""
+    features, labels = load_data(namespace.data)
+    n_features = features.shape[1]
+    columns = None
+    if namespace.columns is not None:
+        columns = np.loadtxt(namespace.columns, dtype=int, ndmin=1)
+        features = features[:, columns]
+    clf = RandomForestClassifier(n_estimators=namespace.trees, max_depth=namespace.max_depth, n_jobs=namespace.n_jobs,
+                                 random_state=namespace.seed)
+    clf.fit(features, labels)
+    export_model(clf, namespace.forest, columns, n_features)
+
+
+def run_inference(namespace):
+    """Classify the traces of the feature files (features.csv format) of namespace.input with an exported model."""
+    model = import_model(namespace.forest)
+    files = sorted(glob.glob(os.path.join(namespace.input, '*.csv')))
+
+    rows = []
+    n_traces = 0
+    inference_time = 0
+    for filename in files:
+        features, labels = load_data(filename, use_cache=False)
+        start = time.perf_counter()
+        top_k_cells, top_k_prob = classify_batch(model, features, namespace.top_k)
+        inference_time += time.perf_counter() - start
+        n_traces += len(labels)
+        for i in range(len(labels)):
+            row = {'file': os.path.basename(filename), 'row': i, 'label': labels[i]}
+            for rank in range(top_k_cells.shape[1]):
+                row[f'cell_{rank + 1}'] = top_k_cells[i, rank]
+                row[f'prob_{rank + 1}'] = round(float(top_k_prob[i, rank]), 4)
+            rows.append(row)
+
+    pd.DataFrame(rows).to_csv(namespace.output, index=False)
+    if n_traces > 0:
+        correct = sum(row['label'] == row['cell_1'] for row in rows)
+        print("Classified %d traces in %0.3f s (%0.0f traces/s), accuracy %0.2f"
+              % (n_traces, inference_time, n_traces / max(inference_time, 1e-9), correct / n_traces))
+
+
+def run_online(namespace):
+    """Absorb the traces of namespace.data into the persisted online model, batch by batch.
+
+    The forest parameters of the command line also apply to a saved model, for the forests trained from now on.
+    """
+    if os.path.exists(namespace.model):
+        model = OnlineForest.load(namespace.model)
+        for name in ['trees_per_batch', 'max_forests', 'max_depth', 'n_jobs']:
+            if getattr(model, name) != getattr(namespace, name):
+                print("%s: %s (saved model: %s)" % (name, getattr(namespace, name), getattr(model, name)))
+                setattr(model, name, getattr(namespace, name))
+    else:
+        model = OnlineForest(trees_per_batch=namespace.trees_per_batch, max_forests=namespace.max_forests,
+                             max_depth=namespace.max_depth, n_jobs=namespace.n_jobs, random_state=namespace.seed)
+
+    features, labels = load_data(namespace.data, use_cache=False)
+    for start in range(0, len(labels), namespace.batch_size):
+        metrics = model.update(features[start:start + namespace.batch_size], labels[start:start + namespace.batch_size])
+        print(", ".join(f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}"
+                        for name, value in metrics.items()))
+    model.save(namespace.model)
+
+
+def rank_features(features, labels, importances=None, n_estimators=N_ESTIMATORS, max_depth=MAX_DEPTH, n_jobs=1,
+                  permutation_jobs=-1, n_repeats=PERMUTATION_REPEATS, random_state=None):
+    """Rank the features by the mean of their impurity and permutation importances.
+
+    Args:
+        importances (list): impurity importances of every feature over the folds,
+            as returned by perform_crossval on the same features (default: those
+            of the forest fitted for the permutation importance)
+        permutation_jobs (int): number of features permuted in parallel (-1: one per core)
+        n_repeats (int): number of permutations of every feature
+    Returns:
+        order: indices of the features, most important first
+        ranking: DataFrame with the impurity, permutation and combined importance of every feature
+
+    The permutation importance is the loss of accuracy on a held-out split of the
+    given traces when a feature is shuffled. Both importances are normalized to sum
+    to 1 before they are averaged (negative permutation importances count as 0).
     """
+    X_train, X_test, y_train, y_test = train_test_split(features, labels, test_size=HOLDOUT_SIZE, stratify=labels,
+                                                        random_state=random_state)
+    clf = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, n_jobs=n_jobs, random_state=random_state)
+    clf.fit(X_train, y_train)
+    permutation = permutation_importance(clf, X_test, y_test, n_repeats=n_repeats, n_jobs=permutation_jobs,
+                                         random_state=random_state)
+
+    if importances is None:
+        impurity = clf.feature_importances_
+    else:
+        impurity = np.array([np.mean(importance) for importance in importances])
+    permutation_mean = np.clip(permutation.importances_mean, 0, None)
+    combined = (impurity / max(impurity.sum(), 1e-12) + permutation_mean / max(permutation_mean.sum(), 1e-12)) / 2
+
+    order = np.argsort(-combined, kind='stable')
+    ranking = pd.DataFrame({'feature': np.arange(len(combined)), 'impurity': impurity,
+                            'permutation': permutation.importances_mean, 'permutation_std': permutation.importances_std,
+                            'combined': combined}).iloc[order].reset_index(drop=True)
+    return order, ranking
+
+
+def feature_counts(num_features):
+    """Numbers of features evaluated: all of them, then halved down to 1."""
+    counts = []
+    count = num_features
+    while count >= 1:
+        counts.append(count)
+        count //= 2
+    return counts
+
+
+def evaluate_feature_counts(features, labels, counts, folds=10, n_estimators=N_ESTIMATORS, max_depth=MAX_DEPTH,
+                            n_jobs=1, permutation_jobs=-1, n_repeats=PERMUTATION_REPEATS, random_state=None):
+    """Accuracy and training/inference times of forests on the best features, per number of features.
+
+    The features are ranked (rank_features) inside each cross-validation fold,
+    on its training traces only, so that the test traces of the fold play no
+    part in the selection and the accuracies are not biased by it. The times
+    are those of the fit on the training traces and of the prediction of the
+    test traces of the folds (the folds run one after the other, so that they
+    do not compete for the cores).
 
-    features, labels = load_data()
-    accuracy, f1, top_2_accuracy, top_3_accuracy, top_5_accuracy, feature_importance_list = perform_crossval(features,
-                                                                                                             labels,
-                                                                                                             folds=10)
+    Returns:
+        DataFrame with one row per number of features: mean (and std of the)
+        accuracy, f1, top 2, 3, 5 accuracies, training time and inference time per trace
+    """
+    rows = []
+    kf = StratifiedKFold(n_splits=folds)
+    for fold, (train_index, test_index) in enumerate(kf.split(features, labels)):
+        X_train, y_train = features[train_index], labels[train_index]
+        X_test, y_test = features[test_index], labels[test_index]
+        order, _ = rank_features(X_train, y_train, n_estimators=n_estimators, max_depth=max_depth, n_jobs=n_jobs,
+                                 permutation_jobs=permutation_jobs, n_repeats=n_repeats, random_state=random_state)
+        for count in counts:
+            columns = np.sort(order[:count])
+            clf = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, n_jobs=n_jobs,
+                                         random_state=random_state)
+            start = time.perf_counter()
+            clf.fit(X_train[:, columns], y_train)
+            training_time = time.perf_counter() - start
+            start = time.perf_counter()
+            predictions_prob = clf.predict_proba(X_test[:, columns])
+            inference_time = time.perf_counter() - start
+            predictions = clf.classes_[np.argmax(predictions_prob, axis=1)]
+            rows.append({'fold': fold, 'n_features': count,
+                         'accuracy': sklearn.metrics.accuracy_score(y_test, predictions),
+                         'f1': sklearn.metrics.f1_score(y_test, predictions, average='weighted'),
+                         'top_2': sklearn.metrics.top_k_accuracy_score(y_test, predictions_prob, k=2, labels=clf.classes_),
+                         'top_3': sklearn.metrics.top_k_accuracy_score(y_test, predictions_prob, k=3, labels=clf.classes_),
+                         'top_5': sklearn.metrics.top_k_accuracy_score(y_test, predictions_prob, k=5, labels=clf.classes_),
+                         'training_time': training_time,
+                         'inference_time_per_trace': inference_time / len(test_index)})
+
+    per_fold = pd.DataFrame(rows).drop(columns='fold').groupby('n_features', sort=False)
+    curve = per_fold.mean()
+    curve.insert(1, 'accuracy_std', per_fold['accuracy'].std(ddof=0))
+    return curve.reset_index()
+
+
+def select_features(curve, tolerance=ACCURACY_TOLERANCE):
+    """Smallest number of features whose accuracy is within tolerance of the best accuracy of the curve."""
+    eligible = curve[curve['accuracy'] >= curve['accuracy'].max() - tolerance]
+    return int(eligible['n_features'].min())
+
+
+def run_crossval(namespace):
+    """Cross-validate a random forest on namespace.data and write the results."""
+    features, labels = load_data(namespace.data)
+    accuracy, f1, top_2_accuracy, top_3_accuracy, top_5_accuracy, feature_importance_list = perform_crossval(
+        features, labels, folds=namespace.folds, n_estimators=namespace.trees, max_depth=namespace.max_depth,
+        n_jobs=namespace.n_jobs, fold_jobs=namespace.fold_jobs, random_state=namespace.seed)
 
     accuracy_mean = np.mean(accuracy)
     accuracy_std = np.std(accuracy)
@@ -164,8 +614,98 @@ def main():
              importance_means_result])
 
 
+def run_select(namespace):
+    """Evaluate forests on the best features of namespace.data, and write the pruned features.
+
+    The number of features is chosen on the cross-validated curve (features
+    ranked within each fold); the features kept are then ranked on all the traces,
+    with the impurity importances of a cross-validation and permutation importances.
+    """
+    features, labels = load_data(namespace.data)
+    features = np.asarray(features)
+
+    curve = evaluate_feature_counts(features, labels, feature_counts(features.shape[1]), folds=namespace.folds,
+                                    n_estimators=namespace.trees, max_depth=namespace.max_depth, n_jobs=namespace.n_jobs,
+                                    permutation_jobs=namespace.fold_jobs, n_repeats=namespace.permutation_repeats,
+                                    random_state=namespace.seed)
+    count = select_features(curve, namespace.tolerance)
+
+    *_, feature_importance_list = perform_crossval(
+        features, labels, folds=namespace.folds, n_estimators=namespace.trees, max_depth=namespace.max_depth,
+        n_jobs=namespace.n_jobs, fold_jobs=namespace.fold_jobs, random_state=namespace.seed)
+    order, ranking = rank_features(features, labels, feature_importance_list, n_estimators=namespace.trees,
+                                   max_depth=namespace.max_depth, n_jobs=namespace.n_jobs,
+                                   permutation_jobs=namespace.fold_jobs, n_repeats=namespace.permutation_repeats,
+                                   random_state=namespace.seed)
+    columns = np.sort(order[:count])
+    ranking['selected'] = ranking['feature'].isin(columns)
+
+    curve.to_csv(namespace.selection, index=False)
+    ranking.to_csv(os.path.splitext(namespace.selection)[0] + '_ranking.csv', index=False)
+    # same format as features.csv, to cross-validate forests on the selected features
+    pd.DataFrame(np.column_stack((labels, features[:, columns]))).to_csv(namespace.selected, header=False, index=False)
+    # columns of the selected features in features.csv, to export a forest that classifies extracted features
+    np.savetxt(namespace.columns or SELECTED_COLUMNS_FILE, columns, fmt='%d')
+    print(curve.to_string(index=False))
+    print("Selected %d of %d features: %s" % (count, features.shape[1], columns.tolist()))
+
+
+def main(args=None):
+    """Please complete this skeleton to implement cell fingerprinting.
+    This skeleton provides the code to perform classification 
+    using a Random Forest classifier. You are free to modify the 
+    provided functions as you wish.
+
+    Read about random forests: https://towardsdatascience.com/understanding-random-forest-58381e0602d2
+    """
+
+    parser = argparse.ArgumentParser(description="Cell fingerprinting with a random forest.")
+    parser.add_argument("mode", nargs="?", default="crossval", choices=["crossval", "online", "export", "infer", "select"],
+                        help="crossval: cross-validate a forest on the data; online: update the online model with the data; "
+                             "export: train a forest on the data and export it; infer: classify the traces of the input "
+                             "directory with the exported forest; select: prune the least important features.")
+    parser.add_argument("--data", default=FEATURES_FILE, type=str, help="Features of the traces (CSV).")
+    parser.add_argument("--folds", default=10, type=int, help="Number of cross-validation folds.")
+    parser.add_argument("--trees", default=N_ESTIMATORS, type=int, help="Number of trees of the forests.")
+    parser.add_argument("--max-depth", default=MAX_DEPTH, type=int, help="Maximum depth of the trees.")
+    parser.add_argument("--n-jobs", default=1, type=int, help="Number of jobs of each forest.")
+    parser.add_argument("--fold-jobs", default=-1, type=int, help="Number of folds run in parallel (-1: all cores).")
+    parser.add_argument("--seed", default=None, type=int, help="Seed of the forests.")
+    parser.add_argument("--model", default=ONLINE_MODEL_FILE, type=str, help="File of the online model.")
+    parser.add_argument("--batch-size", default=BATCH_SIZE, type=int, help="Traces per online update.")
+    parser.add_argument("--trees-per-batch", default=TREES_PER_BATCH, type=int, help="Trees trained per online update.")
+    parser.add_argument("--max-forests", default=MAX_FORESTS, type=int, help="Number of online updates kept in the model.")
+    parser.add_argument("--forest", default=FOREST_FILE, type=str, help="File of the exported forest.")
+    parser.add_argument("--input", default="part_3/new_traces", type=str, help="Directory of the feature files to classify.")
+    parser.add_argument("--output", default="part_3/predictions.csv", type=str, help="Predictions of the traces.")
+    parser.add_argument("--top-k", default=INFERENCE_TOP_K, type=int, help="Number of predicted cells per trace.")
+    parser.add_argument("--permutation-repeats", default=PERMUTATION_REPEATS, type=int,
+                        help="Number of permutations of every feature.")
+    parser.add_argument("--tolerance", default=ACCURACY_TOLERANCE, type=float,
+                        help="Accuracy that may be lost by pruning features.")
+    parser.add_argument("--selection", default=SELECTION_FILE, type=str,
+                        help="Accuracy and times per number of features (CSV).")
+    parser.add_argument("--selected", default=SELECTED_FEATURES_FILE, type=str,
+                        help="Features of the traces restricted to the selected features (CSV).")
+    parser.add_argument("--columns", default=None, type=str,
+                        help="Columns of the selected features, written by select (default: %s) and read by export "
+                             "(default: all the features)." % SELECTED_COLUMNS_FILE)
+    namespace = parser.parse_args(args)
+
+    if namespace.mode == "online":
+        run_online(namespace)
+    elif namespace.mode == "export":
+        run_export(namespace)
+    elif namespace.mode == "infer":
+        run_inference(namespace)
+    elif namespace.mode == "select":
+        run_select(namespace)
+    else:
+        run_crossval(namespace)
+
+
 if __name__ == "__main__":
     try:
-        main()
+        main(sys.argv[1:])
     except KeyboardInterrupt:
         sys.exit(0)
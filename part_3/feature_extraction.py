@@ -0,0 +1,379 @@
+"""
+Feature extraction from the captured traces.
+
+Streaming version of `feature_extraction.ipynb`: every pcap file is read once,
+packet by packet, into a TraceStatistics accumulator whose size does not depend
+on the number of packets. The features of `features.csv` (same columns, same
+order, no header) are then derived from the accumulators; the packet sizes that
+are the most frequent over the whole dataset are computed from the per-trace
+size histograms, so no second pass over the files is needed.
+
+The pcap files are parsed by `pcap_reader` (no scapy dissection) by blocks of
+packets, and the statistics of a block are computed with array operations.
+Files that it does not support (e.g. pcapng) are read with scapy.
+
+The traces are read in parallel, and their statistics are cached (see
+FeatureCache) so that a re-run only reads the new or modified captures.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import glob
+import json
+import math
+import os
+from os import path
+import re
+import sys
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from pcap_reader import PacketArrays, PcapFormatError, iter_pcap_blocks
+
+# Globals
+# number of most frequent packet sizes (over the dataset) whose counts are features
+K = 2
+# number of biggest packet sizes (of the trace) whose counts are features
+SIZED_PACKETS_NUM = 3
+# the client is in the 172.16.0.0/12 docker network
+CLIENT_IP_PREFIX = "172."
+CLIENT_IP_FIRST_OCTET = 172
+DATA_PATH = path.join(path.dirname(__file__), "data", "*.pcap")
+FEATURES_FILE = path.join(path.dirname(__file__), "features.csv")
+CACHE_FILE = path.join(path.dirname(__file__), "features_cache.json")
+
+
+class Moments:
+    """ Running mean, maximum and central moments (up to the 4th) of a sequence """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.m3 = 0.0
+        self.m4 = 0.0
+        self.max = -math.inf
+
+    def add(self, x: float):
+        n1 = self.n
+        self.n += 1
+        delta = x - self.mean
+        delta_n = delta / self.n
+        delta_n2 = delta_n * delta_n
+        term1 = delta * delta_n * n1
+        self.mean += delta_n
+        self.m4 += term1 * delta_n2 * (self.n * self.n - 3 * self.n + 3) + 6 * delta_n2 * self.m2 - 4 * delta_n * self.m3
+        self.m3 += term1 * delta_n * (self.n - 2) - 3 * delta_n * self.m2
+        self.m2 += term1
+        self.max = max(self.max, x)
+
+    def add_array(self, x: np.ndarray):
+        """ Add all the values of an array """
+        if len(x) == 0:
+            return
+        block = Moments()
+        block.n = len(x)
+        block.mean = float(x.mean())
+        deviations = x - block.mean
+        block.m2 = float(np.sum(deviations ** 2))
+        block.m3 = float(np.sum(deviations ** 3))
+        block.m4 = float(np.sum(deviations ** 4))
+        block.max = float(x.max())
+        self.merge(block)
+
+    def merge(self, other: "Moments"):
+        """ Add the values summarized by other (pairwise update formulas of the central moments) """
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.__dict__.update(other.__dict__)
+            return
+        na, nb = self.n, other.n
+        n = na + nb
+        delta = other.mean - self.mean
+        m2 = self.m2 + other.m2 + delta ** 2 * na * nb / n
+        m3 = (self.m3 + other.m3 + delta ** 3 * na * nb * (na - nb) / n ** 2
+              + 3 * delta * (na * other.m2 - nb * self.m2) / n)
+        m4 = (self.m4 + other.m4 + delta ** 4 * na * nb * (na * na - na * nb + nb * nb) / n ** 3
+              + 6 * delta ** 2 * (na * na * other.m2 + nb * nb * self.m2) / n ** 2
+              + 4 * delta * (na * other.m3 - nb * self.m3) / n)
+        self.n = n
+        self.mean += delta * nb / n
+        self.m2, self.m3, self.m4 = m2, m3, m4
+        self.max = max(self.max, other.max)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+    @staticmethod
+    def from_dict(state: Dict[str, Any]) -> "Moments":
+        moments = Moments()
+        moments.__dict__.update(state)
+        return moments
+
+    def std(self) -> float:
+        """ Population standard deviation (as np.std) """
+        return math.sqrt(self.m2 / self.n) if self.n > 0 else math.nan
+
+    def skew(self) -> float:
+        """ Biased sample skewness (as scipy.stats.skew) """
+        return math.sqrt(self.n) * self.m3 / self.m2 ** 1.5 if self.m2 > 0 else math.nan
+
+    def kurtosis(self) -> float:
+        """ Biased Fisher kurtosis (as scipy.stats.kurtosis) """
+        return self.n * self.m4 / (self.m2 * self.m2) - 3 if self.m2 > 0 else math.nan
+
+
+class TraceStatistics:
+    """ Single-pass accumulator of the statistics of a trace """
+
+    def __init__(self):
+        self.number_of_packets = 0
+        self.total_traffic_volume = 0
+        self.packets_sent_by_client = 0
+        self.packets_sent_to_client = 0
+        self.min_time = math.inf
+        self.max_time = -math.inf
+        self.last_time = None
+        # packet size -> number of packets
+        self.size_counts = Counter()
+        self.inter_arrival_times = Moments()
+
+    def add_packet(self, timestamp: float, length: int, src: str, dst: str):
+        self.number_of_packets += 1
+        self.total_traffic_volume += length
+        self.packets_sent_by_client += src.startswith(CLIENT_IP_PREFIX)
+        self.packets_sent_to_client += dst.startswith(CLIENT_IP_PREFIX)
+        self.min_time = min(self.min_time, timestamp)
+        self.max_time = max(self.max_time, timestamp)
+        if self.last_time is not None:
+            self.inter_arrival_times.add(timestamp - self.last_time)
+        self.last_time = timestamp
+        self.size_counts[length] += 1
+
+    def add_packets(self, packets: PacketArrays):
+        """ Add a block of packets """
+        if number_of_packets(packets.lengths) == 0:
+            return
+        timestamps = packets.timestamps
+        self.number_of_packets += number_of_packets(packets.lengths)
+        self.total_traffic_volume += total_traffic_volume(packets.lengths)
+        self.packets_sent_by_client += count_packets_sent_by_client(packets.src)
+        self.packets_sent_to_client += count_packets_sent_to_client(packets.dst)
+        self.min_time = min(self.min_time, float(timestamps.min()))
+        self.max_time = max(self.max_time, float(timestamps.max()))
+        previous = [] if self.last_time is None else [self.last_time]
+        self.inter_arrival_times.add_array(inter_arrival_times(np.concatenate((previous, timestamps))))
+        self.last_time = float(timestamps[-1])
+        self.size_counts.update(packet_size_counts(packets.lengths))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ JSON-serializable state """
+        state = dict(self.__dict__)
+        state["size_counts"] = [[size, count] for size, count in self.size_counts.items()]
+        state["inter_arrival_times"] = self.inter_arrival_times.to_dict()
+        return state
+
+    @staticmethod
+    def from_dict(state: Dict[str, Any]) -> "TraceStatistics":
+        statistics = TraceStatistics()
+        statistics.__dict__.update(state)
+        statistics.size_counts = Counter({size: count for size, count in state["size_counts"]})
+        statistics.inter_arrival_times = Moments.from_dict(state["inter_arrival_times"])
+        return statistics
+
+
+""" Feature functions on packet arrays """
+def number_of_packets(lengths: np.ndarray) -> int:
+    return len(lengths)
+
+def time_duration(timestamps: np.ndarray) -> float:
+    return float(timestamps.max() - timestamps.min())
+
+def total_traffic_volume(lengths: np.ndarray) -> int:
+    return int(lengths.sum())
+
+def count_packets_sent_by_client(src: np.ndarray) -> int:
+    return int(np.count_nonzero(src >> 24 == CLIENT_IP_FIRST_OCTET))
+
+def count_packets_sent_to_client(dst: np.ndarray) -> int:
+    return int(np.count_nonzero(dst >> 24 == CLIENT_IP_FIRST_OCTET))
+
+def inter_arrival_times(timestamps: np.ndarray) -> np.ndarray:
+    return np.diff(timestamps)
+
+def packet_size_counts(lengths: np.ndarray) -> Counter:
+    sizes, counts = np.unique(lengths, return_counts=True)
+    return Counter(dict(zip(sizes.tolist(), counts.tolist())))
+
+
+def read_trace_statistics(filename: str) -> TraceStatistics:
+    """ Stream the packets of a pcap file into its statistics """
+    statistics = TraceStatistics()
+    try:
+        for packets in iter_pcap_blocks(filename):
+            statistics.add_packets(packets)
+    except PcapFormatError:
+        statistics = read_trace_statistics_with_scapy(filename)
+    return statistics
+
+
+def read_trace_statistics_with_scapy(filename: str) -> TraceStatistics:
+    """ Stream the packets of a capture file in any format supported by scapy into its statistics """
+    from scapy.all import PcapReader
+
+    statistics = TraceStatistics()
+    with PcapReader(filename) as reader:
+        for packet in reader:
+            network_layer = packet[0][1]
+            statistics.add_packet(float(packet.time), len(packet), network_layer.src, network_layer.dst)
+    return statistics
+
+
+class FeatureCache:
+    """ Statistics of the traces already processed, stored as JSON
+
+    An entry is keyed by the absolute path of the pcap file and is only valid
+    for the size and modification time the file had when it was processed, so
+    that only new or changed captures are read again. """
+
+    def __init__(self, cache_path: str = CACHE_FILE):
+        self.cache_path = cache_path
+        self.entries = {}
+        if path.exists(cache_path):
+            with open(cache_path) as cache_file:
+                self.entries = json.load(cache_file)
+
+    @staticmethod
+    def _key(filename: str):
+        stat = os.stat(filename)
+        return path.abspath(filename), stat.st_size, stat.st_mtime_ns
+
+    def lookup(self, filename: str) -> Optional[TraceStatistics]:
+        key, size, mtime_ns = self._key(filename)
+        entry = self.entries.get(key)
+        if entry is None or entry["size"] != size or entry["mtime_ns"] != mtime_ns:
+            return None
+        return TraceStatistics.from_dict(entry["statistics"])
+
+    def store(self, filename: str, statistics: TraceStatistics):
+        key, size, mtime_ns = self._key(filename)
+        self.entries[key] = {"size": size, "mtime_ns": mtime_ns, "statistics": statistics.to_dict()}
+
+    def retain(self, files: Sequence[str]):
+        """ Drop the entries of the files that are not in `files` (e.g. deleted captures) """
+        keys = {path.abspath(filename) for filename in files}
+        self.entries = {key: entry for key, entry in self.entries.items() if key in keys}
+
+    def save(self):
+        # write to a temporary file first, so that an interrupted run does not corrupt the cache
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w") as cache_file:
+            json.dump(self.entries, cache_file)
+        os.replace(tmp_path, self.cache_path)
+
+
+def read_all_trace_statistics(
+        files: Sequence[str],
+        workers: Optional[int] = None,
+        cache: Optional[FeatureCache] = None
+    ) -> List[TraceStatistics]:
+    """ Statistics of all the traces, the files missing from the cache are read in parallel """
+    statistics = [cache.lookup(filename) if cache is not None else None for filename in files]
+    missing = [i for i, trace_statistics in enumerate(statistics) if trace_statistics is None]
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for i, trace_statistics in zip(missing, executor.map(read_trace_statistics, [files[i] for i in missing])):
+                statistics[i] = trace_statistics
+                if cache is not None:
+                    cache.store(files[i], trace_statistics)
+    return statistics
+
+
+def extract_label_from_filename(filename: str) -> int:
+    return int(re.search(r'grid_(\d+).+', filename).group(1))
+
+
+def top_k_sizes(statistics: Sequence[TraceStatistics], k: int = K) -> List[int]:
+    """ The k most frequent packet sizes over all the traces """
+    size_counts = Counter()
+    for trace_statistics in statistics:
+        size_counts.update(trace_statistics.size_counts)
+    # ties are broken by ascending size: the per-trace counts come from np.unique, so the
+    # order of first occurrence of the packets is not known (and would depend on the file order)
+    return [size for size, _ in sorted(size_counts.items(), key=lambda item: (-item[1], item[0]))[:k]]
+
+
+def count_K_packets(size_counts: Dict[int, int], K: int) -> List[int]:
+    """ Number of packets of each of the K biggest packet sizes of the trace (padded with 0) """
+    biggest_list = [size_counts[size] for size in sorted(size_counts, reverse=True)[:K]]
+    return biggest_list + [0] * (K - len(biggest_list))
+
+
+def trace_features(label: int, statistics: TraceStatistics, top_k_indices: Sequence[int]) -> Dict[str, Any]:
+    """ Features of a trace, in the column order of features.csv """
+    features = {}
+    features['label'] = label
+    features['number_of_packets'] = statistics.number_of_packets
+    features['time_duration'] = int(statistics.max_time - statistics.min_time)
+    features['total_traffic_volume'] = statistics.total_traffic_volume
+    features['count_packets_sent_by_client'] = statistics.packets_sent_by_client
+    features['count_packets_sent_to_client'] = statistics.packets_sent_to_client
+    for index in top_k_indices:
+        features[f'count_packets_with_length_{index}'] = statistics.size_counts.get(index, 0)
+    for index, count in enumerate(count_K_packets(statistics.size_counts, SIZED_PACKETS_NUM)):
+        features[f'biggest_packets_{index}'] = count
+    inter_arrival_times = statistics.inter_arrival_times
+    features['avg_packet_size'] = round(statistics.total_traffic_volume / statistics.number_of_packets, 2)
+    features['max_inter_arrival_time'] = round(inter_arrival_times.max, 2)
+    features['avg_inter_arrival_time'] = round(inter_arrival_times.mean, 2)
+    features['std_inter_arrival_time'] = round(inter_arrival_times.std(), 2)
+    features['skew_inter_arrival_time'] = round(inter_arrival_times.skew(), 2)
+    features['kurt_inter_arrival_time'] = round(inter_arrival_times.kurtosis(), 2)
+    return features
+
+
+def extract_features(
+        files: Sequence[str],
+        workers: Optional[int] = None,
+        cache: Optional[FeatureCache] = None
+    ) -> List[Dict[str, Any]]:
+    """ Features of all the traces, each file is read once (or not at all if it is cached)
+
+    The features of every trace depend on the packet sizes that are the most
+    frequent over all the traces, so they are always recomputed from the statistics. """
+    statistics = read_all_trace_statistics(files, workers, cache)
+    top_k_indices = top_k_sizes(statistics)
+    return [trace_features(extract_label_from_filename(filename), trace_statistics, top_k_indices)
+            for filename, trace_statistics in zip(files, statistics)]
+
+
+def write_features(feature_list: List[Dict[str, Any]], output_path: str = FEATURES_FILE):
+    """ Write the features as features.csv (no header) """
+    with open(output_path, 'w', newline='') as output_file:
+        writer = csv.writer(output_file)
+        writer.writerows(features.values() for features in feature_list)
+
+
+def main(args: List[str]):
+    parser = argparse.ArgumentParser(description="Extract the features of the captured traces.")
+    parser.add_argument("-d", "--data", default=DATA_PATH, type=str, help="Glob of the pcap files.")
+    parser.add_argument("-o", "--output", default=FEATURES_FILE, type=str)
+    parser.add_argument("-w", "--workers", default=None, type=int, help="Number of processes (default: one per core).")
+    parser.add_argument("-c", "--cache", default=CACHE_FILE, type=str, help="Cache of the processed traces.")
+    parser.add_argument("--no-cache", action="store_true", help="Process all the traces again.")
+    namespace = parser.parse_args(args)
+
+    files = sorted(glob.glob(namespace.data))
+    cache = None if namespace.no_cache else FeatureCache(namespace.cache)
+    write_features(extract_features(files, namespace.workers, cache), namespace.output)
+    if cache is not None:
+        cache.retain(files)
+        cache.save()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,145 @@
+"""
+Minimal reader for libpcap capture files.
+
+The features only need the timestamp, the captured length and the IPv4 source
+and destination of every packet, so the packets are not dissected: the record
+headers are parsed with `struct` over a memory map of the file, and the
+addresses are gathered for all the packets of a block at once with NumPy.
+Only the classic pcap format is supported (not pcapng), as written by tcpdump.
+"""
+
+import mmap
+import struct
+from typing import Iterator, NamedTuple
+
+import numpy as np
+
+# Globals
+PCAP_MAGIC_MICROSECONDS = 0xa1b2c3d4
+PCAP_MAGIC_NANOSECONDS = 0xa1b23c4d
+PCAP_GLOBAL_HEADER_LENGTH = 24
+PCAP_RECORD_HEADER_LENGTH = 16
+# supported link-layer header types
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = 0x8100
+DEFAULT_BLOCK_SIZE = 1 << 16
+
+
+class PcapFormatError(ValueError):
+    """ Exception raised when a file is not in the (supported) pcap format """
+    pass
+
+
+class PacketArrays(NamedTuple):
+    """ Fields of a sequence of packets, one array element per packet """
+    # seconds since the epoch
+    timestamps: np.ndarray
+    # captured length in bytes (as len() of a scapy packet)
+    lengths: np.ndarray
+    # IPv4 addresses as big-endian integers, 0 if the packet is not IPv4
+    src: np.ndarray
+    dst: np.ndarray
+
+
+def iter_pcap_blocks(filename: str, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[PacketArrays]:
+    """ Stream the packets of a pcap file by blocks of at most block_size packets """
+    with open(filename, "rb") as pcap_file:
+        header = pcap_file.read(PCAP_GLOBAL_HEADER_LENGTH)
+        if len(header) < PCAP_GLOBAL_HEADER_LENGTH:
+            raise PcapFormatError("Truncated pcap header in {}".format(filename))
+        endianness, time_unit = _parse_magic(header)
+        linktype = struct.unpack_from(endianness + "I", header, 20)[0] & 0x0fffffff
+        if linktype not in (LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_LINUX_SLL, LINKTYPE_IPV4):
+            raise PcapFormatError("Unsupported link type {} in {}".format(linktype, filename))
+
+        pcap_file.seek(0, 2)
+        if pcap_file.tell() == PCAP_GLOBAL_HEADER_LENGTH:
+            return
+        with mmap.mmap(pcap_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # the arrays built from the buffer are copies, it must be released before the map is closed
+            buffer = np.frombuffer(data, dtype=np.uint8)
+            try:
+                record_header = struct.Struct(endianness + "IIII")
+                offset = PCAP_GLOBAL_HEADER_LENGTH
+                while offset + PCAP_RECORD_HEADER_LENGTH <= len(data):
+                    seconds, fractions, lengths, data_offsets = [], [], [], []
+                    while len(lengths) < block_size and offset + PCAP_RECORD_HEADER_LENGTH <= len(data):
+                        ts_sec, ts_frac, incl_len, _ = record_header.unpack_from(data, offset)
+                        offset += PCAP_RECORD_HEADER_LENGTH
+                        if offset + incl_len > len(data):
+                            # the capture was interrupted in the middle of a packet
+                            offset = len(data)
+                            break
+                        seconds.append(ts_sec)
+                        fractions.append(ts_frac)
+                        lengths.append(incl_len)
+                        data_offsets.append(offset)
+                        offset += incl_len
+                    if lengths:
+                        yield _packet_arrays(buffer, linktype, time_unit, seconds, fractions, lengths, data_offsets)
+            finally:
+                del buffer
+
+
+def read_pcap_arrays(filename: str) -> PacketArrays:
+    """ All the packets of a pcap file """
+    blocks = list(iter_pcap_blocks(filename))
+    if not blocks:
+        return PacketArrays(np.empty(0), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint32))
+    return PacketArrays(*(np.concatenate(field) for field in zip(*blocks)))
+
+
+def _parse_magic(header: bytes):
+    """ Byte order and timestamp resolution of the file """
+    for endianness in ("<", ">"):
+        magic = struct.unpack_from(endianness + "I", header, 0)[0]
+        if magic == PCAP_MAGIC_MICROSECONDS:
+            return endianness, 1e-6
+        if magic == PCAP_MAGIC_NANOSECONDS:
+            return endianness, 1e-9
+    raise PcapFormatError("Not a pcap file (magic number {})".format(header[:4].hex()))
+
+
+def _packet_arrays(buffer: np.ndarray, linktype: int, time_unit: float, seconds, fractions, lengths, data_offsets) -> PacketArrays:
+    timestamps = np.asarray(seconds, dtype=np.float64) + np.asarray(fractions, dtype=np.float64) * time_unit
+    lengths = np.asarray(lengths, dtype=np.int64)
+    data_offsets = np.asarray(data_offsets, dtype=np.int64)
+    ends = data_offsets + lengths
+
+    # offset of the network layer and whether it is IPv4
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype = _read_uint16(buffer, data_offsets + 12, ends)
+        vlan = ethertype == ETHERTYPE_VLAN
+        ethertype = np.where(vlan, _read_uint16(buffer, data_offsets + 16, ends), ethertype)
+        ip_offsets = data_offsets + np.where(vlan, 18, 14)
+        is_ipv4 = ethertype == ETHERTYPE_IPV4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        ip_offsets = data_offsets + 16
+        is_ipv4 = _read_uint16(buffer, data_offsets + 14, ends) == ETHERTYPE_IPV4
+    else:
+        ip_offsets = data_offsets
+        is_ipv4 = np.ones(len(lengths), dtype=bool)
+    is_ipv4 &= ip_offsets + 20 <= ends
+    is_ipv4 &= _read_uint8(buffer, ip_offsets, ends) >> 4 == 4
+
+    src = np.where(is_ipv4, _read_uint32(buffer, ip_offsets + 12, ends), 0).astype(np.uint32)
+    dst = np.where(is_ipv4, _read_uint32(buffer, ip_offsets + 16, ends), 0).astype(np.uint32)
+    return PacketArrays(timestamps, lengths, src, dst)
+
+
+def _read_uint8(buffer: np.ndarray, offsets: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """ Byte at every offset (0 where it is past the end of its packet) """
+    valid = offsets < ends
+    return np.where(valid, buffer[np.where(valid, offsets, 0)], 0).astype(np.uint32)
+
+
+def _read_uint16(buffer: np.ndarray, offsets: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    return _read_uint8(buffer, offsets, ends) << 8 | _read_uint8(buffer, offsets + 1, ends)
+
+
+def _read_uint32(buffer: np.ndarray, offsets: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    return _read_uint16(buffer, offsets, ends) << 16 | _read_uint16(buffer, offsets + 2, ends)
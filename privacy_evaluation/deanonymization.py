@@ -0,0 +1,115 @@
+import argparse
+import sys
+from os import path
+from typing import List, Optional
+
+import pandas as pd
+
+from time_features import TIME_BUCKET_COLUMNS, read_queries
+
+# Globals
+LOCATION_KEYS = ["ip_address", "lat", "lon"]
+# buckets in which a user is usually at home / at work
+HOME_BUCKETS = ["night_00_08", "mon_fri_17_00"]
+WORK_BUCKETS = ["mon_fri_08_17"]
+
+
+class PartialAggregates:
+    """ Aggregates of a chunk of queries that can be combined with those of other chunks """
+
+    def __init__(self, locations: pd.DataFrame, location_days: pd.DataFrame, poi_types: pd.DataFrame):
+        # (ip, lat, lon) -> number of queries and of queries per time bucket
+        self.locations = locations
+        # distinct (ip, lat, lon, day)
+        self.location_days = location_days
+        # (ip, poi type) -> number of queries
+        self.poi_types = poi_types
+
+    @staticmethod
+    def of(queries: pd.DataFrame) -> "PartialAggregates":
+        locations = queries.groupby(LOCATION_KEYS)[TIME_BUCKET_COLUMNS].sum()
+        locations["n_queries"] = queries.groupby(LOCATION_KEYS).size()
+        location_days = queries[LOCATION_KEYS + ["days_from_start"]].drop_duplicates()
+        poi_types = queries.groupby(["ip_address", "poi_type_query"]).size().rename("n_queries").to_frame()
+        return PartialAggregates(locations, location_days, poi_types)
+
+    def combine(self, other: "PartialAggregates") -> "PartialAggregates":
+        locations = pd.concat([self.locations, other.locations]).groupby(level=LOCATION_KEYS).sum()
+        location_days = pd.concat([self.location_days, other.location_days]).drop_duplicates()
+        poi_types = pd.concat([self.poi_types, other.poi_types]).groupby(level=["ip_address", "poi_type_query"]).sum()
+        return PartialAggregates(locations, location_days, poi_types)
+
+
+def location_profiles(aggregates: PartialAggregates) -> pd.DataFrame:
+    """ One row per (ip, lat, lon): number of days, of queries and of queries per time bucket """
+    locations = aggregates.locations.copy()
+    locations["n_days"] = aggregates.location_days.groupby(LOCATION_KEYS)["days_from_start"].nunique()
+    return locations.reset_index()
+
+
+def _top_location(locations: pd.DataFrame, score_columns: List[str], prefix: str) -> pd.DataFrame:
+    """ Location with the highest score (ties broken by number of days) of every ip, if the score is positive """
+    locations = locations.assign(score=locations[score_columns].sum(axis=1))
+    locations = locations[locations["score"] > 0]
+    top = locations.sort_values(["ip_address", "score", "n_days"], ascending=[True, False, False]).groupby("ip_address").head(1)
+    top = top.set_index("ip_address")[["lat", "lon", "score"]]
+    return top.rename(columns={"lat": prefix + "_lat", "lon": prefix + "_lon", "score": prefix + "_queries"})
+
+
+def user_table(aggregates: PartialAggregates) -> pd.DataFrame:
+    """ One row per ip: inferred home and work locations, queries per time bucket and per POI type
+
+    The home is the location most queried at night and in weekday evenings, the
+    work the other location most queried during weekday working hours. """
+    locations = location_profiles(aggregates)
+
+    users = locations.groupby("ip_address")[["n_queries"] + TIME_BUCKET_COLUMNS].sum()
+    users.insert(1, "n_days", aggregates.location_days.groupby("ip_address")["days_from_start"].nunique())
+    users.insert(2, "n_locations", locations.groupby("ip_address").size())
+
+    home = _top_location(locations, HOME_BUCKETS, "home")
+    # the work location is another location than the home
+    is_home = locations.merge(home, left_on="ip_address", right_index=True, how="left")
+    is_home = (is_home["lat"] == is_home["home_lat"]).to_numpy() & (is_home["lon"] == is_home["home_lon"]).to_numpy()
+    work = _top_location(locations[~is_home], WORK_BUCKETS, "work")
+
+    poi_types = aggregates.poi_types["n_queries"].unstack(fill_value=0)
+    poi_types.columns = ["poi_" + str(poi_type) for poi_type in poi_types.columns]
+
+    return users.join(home).join(work).join(poi_types).reset_index()
+
+
+def analyse_queries(queries_path: str, chunksize: Optional[int] = None) -> pd.DataFrame:
+    """ Compute the user table of a queries.csv-format file, optionally by chunks of chunksize rows """
+    if chunksize is None:
+        return user_table(PartialAggregates.of(read_queries(queries_path, day_and_hour=False)))
+
+    aggregates = None
+    for chunk in read_queries(queries_path, chunksize, day_and_hour=False):
+        part = PartialAggregates.of(chunk)
+        aggregates = part if aggregates is None else aggregates.combine(part)
+    if aggregates is None:
+        raise ValueError("No queries in {}".format(queries_path))
+    return user_table(aggregates)
+
+
+def write_table(table: pd.DataFrame, output_path: str):
+    """ Write the table as Parquet (.parquet extension, requires pyarrow or fastparquet) or CSV """
+    if path.splitext(output_path)[1] == ".parquet":
+        table.to_parquet(output_path, index=False)
+    else:
+        table.to_csv(output_path, index=False)
+
+
+def main(args: List[str]):
+    parser = argparse.ArgumentParser(description="De-anonymization analysis of all the users of a query log.")
+    parser.add_argument("-q", "--queries", default=path.join(path.dirname(__file__), "queries.csv"), type=str)
+    parser.add_argument("-o", "--output", default="users.csv", type=str, help="Output table (.csv or .parquet).")
+    parser.add_argument("-c", "--chunksize", default=None, type=int, help="Rows read at once (default: whole file).")
+    namespace = parser.parse_args(args)
+
+    write_table(analyse_queries(namespace.queries, namespace.chunksize), namespace.output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,139 @@
+import argparse
+import itertools
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from query import POI_IDS, get_nearby_poi_pairs
+
+# Globals
+# length of a degree of latitude, and of longitude at the equator
+METERS_PER_DEGREE = 111_320.0
+
+
+""" Parameters of the geo-indistinguishability (see the privacy evaluation notebook) """
+def get_epsilon_star(p_epsilon_star):
+    return np.log(1/p_epsilon_star - 1)
+
+def get_epsilon(epsilon_star, r_star):
+    return epsilon_star/r_star
+
+def get_r_bar(epsilon):
+    # average loss (utility)
+    return 2/epsilon
+
+def get_r_95(r_bar):
+    return 2.37*r_bar
+
+
+def planar_laplace_noise(locs: np.ndarray, epsilon, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """ Add planar Laplace noise to an (n, 2) array of (lat, lon) locations in degrees
+
+    epsilon is in 1/meters, a scalar or one value per location. The noise is drawn
+    in polar coordinates: a uniform angle and a distance r with density
+    epsilon^2 r exp(-epsilon r), i.e. Gamma(2, 1/epsilon). It is converted from
+    meters to degrees at the latitude of each location. """
+    rng = np.random.default_rng() if rng is None else rng
+    locs = np.asarray(locs, dtype=float).reshape(-1, 2)
+    theta = rng.uniform(0, 2 * np.pi, len(locs))
+    r = rng.gamma(2, 1 / np.broadcast_to(np.asarray(epsilon, dtype=float), len(locs)))
+    d_lat = r * np.sin(theta) / METERS_PER_DEGREE
+    d_lon = r * np.cos(theta) / (METERS_PER_DEGREE * np.cos(np.radians(locs[:, 0])))
+    return locs + np.column_stack((d_lat, d_lon))
+
+
+def precision_recall(locs: np.ndarray, noisy_locs: np.ndarray, types: Sequence[str]):
+    """ Precision and recall of the POIs retrieved for the noisy locations, per query
+
+    The relevant POIs are the POIs of the requested type near the real location.
+    The precision is NaN if no POI is retrieved, the recall if none is relevant. """
+    n = len(types)
+    q_true, p_true = get_nearby_poi_pairs(locs, types)
+    q_noisy, p_noisy = get_nearby_poi_pairs(noisy_locs, types)
+    # a retrieved POI is a true positive if the pair is also a relevant pair
+    true_keys = q_true * len(POI_IDS) + p_true
+    noisy_keys = q_noisy * len(POI_IDS) + p_noisy
+    true_positives = np.bincount(q_noisy[np.isin(noisy_keys, true_keys)], minlength=n).astype(float)
+    retrieved = np.bincount(q_noisy, minlength=n)
+    relevant = np.bincount(q_true, minlength=n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(retrieved > 0, true_positives / retrieved, np.nan)
+        recall = np.where(relevant > 0, true_positives / relevant, np.nan)
+    return precision, recall
+
+
+def evaluate(locs: np.ndarray, types: Sequence[str], p_epsilon_star: float, r_star: float,
+             repetitions: int = 1, rng: Optional[np.random.Generator] = None) -> dict:
+    """ Mean precision and recall of the queries with noise of parameters p_epsilon_star and r_star (meters) """
+    rng = np.random.default_rng() if rng is None else rng
+    epsilon = get_epsilon(get_epsilon_star(p_epsilon_star), r_star)
+    locs = np.asarray(locs, dtype=float).reshape(-1, 2)
+    # the repetitions are evaluated as one batch of repeated queries
+    all_locs = np.tile(locs, (repetitions, 1))
+    all_types = np.tile(np.asarray(types, dtype=object), repetitions)
+    precision, recall = precision_recall(all_locs, planar_laplace_noise(all_locs, epsilon, rng), all_types)
+    return {
+        "p_epsilon_star": p_epsilon_star,
+        "r_star": r_star,
+        "epsilon": epsilon,
+        "r_bar": get_r_bar(epsilon),
+        "r_95": get_r_95(get_r_bar(epsilon)),
+        "precision": np.nanmean(precision),
+        "recall": np.nanmean(recall),
+    }
+
+
+# queries of a sweep worker process
+_SWEEP_LOCS = None
+_SWEEP_TYPES = None
+
+
+def _init_sweep_worker(locs: np.ndarray, types: np.ndarray):
+    global _SWEEP_LOCS, _SWEEP_TYPES
+    _SWEEP_LOCS = locs
+    _SWEEP_TYPES = types
+
+
+def _evaluate_in_worker(p_epsilon_star: float, r_star: float, repetitions: int, seed: np.random.SeedSequence) -> dict:
+    return evaluate(_SWEEP_LOCS, _SWEEP_TYPES, p_epsilon_star, r_star, repetitions, np.random.default_rng(seed))
+
+
+def sweep(locs: np.ndarray, types: Sequence[str], p_epsilon_stars: Sequence[float], r_stars: Sequence[float],
+          repetitions: int = 1, workers: Optional[int] = None, seed: Optional[int] = None) -> pd.DataFrame:
+    """ Evaluate all the combinations of p_epsilon_star and r_star, in parallel over a process pool
+
+    Returns one row per setting with its epsilon, r_bar, r_95, mean precision and recall """
+    settings = list(itertools.product(p_epsilon_stars, r_stars))
+    seeds = np.random.SeedSequence(seed).spawn(len(settings))
+    locs = np.asarray(locs, dtype=float).reshape(-1, 2)
+    types = np.asarray(types, dtype=object)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker, initargs=(locs, types)) as executor:
+        futures = [executor.submit(_evaluate_in_worker, p_epsilon_star, r_star, repetitions, setting_seed)
+                   for (p_epsilon_star, r_star), setting_seed in zip(settings, seeds)]
+        return pd.DataFrame([future.result() for future in futures])
+
+
+def main(args: List[str]):
+    parser = argparse.ArgumentParser(description="Privacy/utility trade-off of the geo-indistinguishability defence.")
+    parser.add_argument("-q", "--queries", default=path.join(path.dirname(__file__), "queries.csv"), type=str)
+    parser.add_argument("-p", "--p-epsilon-star", default=[0.4], type=float, nargs="+")
+    parser.add_argument("-r", "--r-star", default=[200], type=float, nargs="+", help="Radius in meters.")
+    parser.add_argument("-n", "--repetitions", default=1, type=int)
+    parser.add_argument("-w", "--workers", default=None, type=int)
+    parser.add_argument("-s", "--seed", default=None, type=int)
+    parser.add_argument("-o", "--output", default="utility.csv", type=str)
+    namespace = parser.parse_args(args)
+
+    queries = pd.read_csv(namespace.queries, sep=" ")
+    results = sweep(queries[["lat", "lon"]].to_numpy(), queries["poi_type_query"].to_numpy(),
+                    namespace.p_epsilon_star, namespace.r_star, namespace.repetitions, namespace.workers, namespace.seed)
+    results.to_csv(namespace.output, index=False)
+    print(results.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
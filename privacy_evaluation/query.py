@@ -1,8 +1,11 @@
 import numpy as np
 from os import path
+from typing import Dict, List, Sequence
 
 # Globals
 DIST_THRESH = 0.01
+# stride between the x and y cell coordinates in the combined cell keys
+CELL_KEY_STRIDE = 1 << 32
 
 
 def load_poi_data():
@@ -15,19 +18,105 @@ def load_poi_data():
     return poi_ids, poi_type, poi_loc
 
 
+class PoiGridIndex:
+    """ Uniform grid over the POIs of one type
+
+    The cells are squares of side DIST_THRESH, so the POIs within DIST_THRESH of
+    a location are in its cell or one of the 8 neighbouring cells. The POIs are
+    sorted by cell key and each cell is a contiguous range of this order. """
+
+    def __init__(self, poi_positions: np.ndarray, poi_locs: np.ndarray, cell_size: float = DIST_THRESH):
+        self.cell_size = cell_size
+        keys = self.cell_keys(poi_locs, 0, 0)
+        order = np.argsort(keys, kind="stable")
+        # positions of the POIs in POI_IDS/POI_LOCS, in cell key order
+        self.poi_positions = poi_positions[order]
+        self.poi_locs = poi_locs[order]
+        self.keys, self.starts, self.counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+    def cell_keys(self, locs: np.ndarray, dx: int, dy: int) -> np.ndarray:
+        cells = np.floor(locs / self.cell_size).astype(np.int64)
+        return (cells[:, 0] + dx) * CELL_KEY_STRIDE + (cells[:, 1] + dy)
+
+    def query(self, locs: np.ndarray, dist_thresh: float = DIST_THRESH):
+        """ Returns the pairs (query index, POI position) within dist_thresh of each other """
+        query_indices = []
+        poi_positions = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                keys = self.cell_keys(locs, dx, dy)
+                pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+                found = self.keys[pos] == keys
+                counts = np.where(found, self.counts[pos], 0)
+                total = counts.sum()
+                if total == 0:
+                    continue
+                # expand every query into the range of POIs of the cell
+                q = np.repeat(np.arange(len(locs)), counts)
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                p = self.starts[pos][q] + offsets
+                diff = locs[q] - self.poi_locs[p]
+                close = np.sqrt((diff * diff).sum(axis=1)) <= dist_thresh
+                query_indices.append(q[close])
+                poi_positions.append(self.poi_positions[p[close]])
+
+        if not query_indices:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(query_indices), np.concatenate(poi_positions)
+
+
+def build_poi_index(poi_types: np.ndarray, poi_locs: np.ndarray) -> Dict[str, PoiGridIndex]:
+    """ Builds one grid per POI type """
+    return {poi_type: PoiGridIndex(np.flatnonzero(poi_types == poi_type), poi_locs[poi_types == poi_type])
+            for poi_type in np.unique(poi_types)}
+
+
 POI_IDS, POI_TYPES, POI_LOCS = load_poi_data()
+POI_INDEX = build_poi_index(POI_TYPES, POI_LOCS)
 
 
 def get_nearby_pois(loc: np.ndarray, poi_type: str):
     """ Find nearby POIs of the specified type """
-    poi_ids = []
+    return get_nearby_pois_batch(np.asarray(loc, dtype=float).reshape(1, 2), [poi_type])[0]
+
+
+def get_nearby_poi_pairs(locs: np.ndarray, types: Sequence[str]):
+    """ Find nearby POIs of the specified type for many locations at once
+
+    locs is an (n, 2) array of locations and types the n requested POI types.
+    Returns the arrays (query index, POI position in POI_IDS) of all the pairs of
+    a location and a nearby POI, sorted by query index and POI position. """
+    locs = np.asarray(locs, dtype=float).reshape(-1, 2)
+    types = np.asarray(types, dtype=object)
+    if len(types) != len(locs):
+        raise ValueError("The number of locations and of types differ")
+
+    query_indices = []
+    poi_positions = []
+    for poi_type in np.unique(types):
+        if poi_type not in POI_INDEX:
+            continue
+        rows = np.flatnonzero(types == poi_type)
+        q, p = POI_INDEX[poi_type].query(locs[rows])
+        query_indices.append(rows[q])
+        poi_positions.append(p)
 
-    for i, poi_loc in enumerate(POI_LOCS):
-        if POI_TYPES[i] == poi_type:
-            d = np.linalg.norm(loc - poi_loc)
+    if not query_indices:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    query_indices = np.concatenate(query_indices)
+    poi_positions = np.concatenate(poi_positions)
+    order = np.lexsort((poi_positions, query_indices))
+    return query_indices[order], poi_positions[order]
 
-            if d <= DIST_THRESH:
-                poi_ids.append(POI_IDS[i])
 
-    return poi_ids
+def get_nearby_pois_batch(locs: np.ndarray, types: Sequence[str]) -> List[List[int]]:
+    """ Find nearby POIs of the specified type for many locations at once
 
+    Returns the list of nearby POI ids of every location, in the order of
+    POI_IDS (as `get_nearby_pois`). """
+    n = len(np.asarray(locs, dtype=float).reshape(-1, 2))
+    if n == 0:
+        return []
+    query_indices, poi_positions = get_nearby_poi_pairs(locs, types)
+    counts = np.bincount(query_indices, minlength=n)
+    return [list(ids) for ids in np.split(POI_IDS[poi_positions], np.cumsum(counts)[:-1])]
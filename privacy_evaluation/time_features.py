@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+from typing import Iterator, Optional
+
+# Globals
+QUERIES_SEP = " "
+DEFAULT_CHUNKSIZE = 1_000_000
+TIME_BUCKET_COLUMNS = ["mon_fri_08_17", "mon_fri_17_00", "sat_sun_08_00", "night_00_08"]
+DAY_NAMES = np.array(["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"], dtype=object)
+HOUR_LABELS = np.array([f"{hour:02d}:00" for hour in range(24)], dtype=object)
+
+
+def add_time_features(queries: pd.DataFrame, day_and_hour: bool = True) -> pd.DataFrame:
+    """ Add the time-bucket columns to queries (timestamps in hours from the start, day 0 is a Monday)
+
+    mon_fri_08_17, mon_fri_17_00, sat_sun_08_00, night_00_08 -- 1 if the query is in the bucket, 0 otherwise
+    days_from_start -- day of the query
+    day_and_hour -- (day of the week, "HH:00") of the timestamp rounded to the hour, if requested
+    """
+    timestamps = queries["timestamp"].to_numpy(dtype=float)
+    hour_of_day = timestamps % 24
+    days_from_start = np.trunc(timestamps / 24).astype(np.int64)
+    weekday = days_from_start % 7 < 5
+
+    queries["mon_fri_08_17"] = ((8 <= hour_of_day) & (hour_of_day < 17) & weekday).astype(np.int64)
+    queries["mon_fri_17_00"] = ((17 <= hour_of_day) & (hour_of_day <= 23) & weekday).astype(np.int64)
+    queries["sat_sun_08_00"] = ((8 <= hour_of_day) & (hour_of_day <= 23) & ~weekday).astype(np.int64)
+    queries["night_00_08"] = ((0 <= hour_of_day) & (hour_of_day < 8)).astype(np.int64)
+    queries["days_from_start"] = days_from_start
+
+    if day_and_hour:
+        # round half to even, as the built-in round
+        hours = np.round(timestamps).astype(np.int64)
+        queries["day_and_hour"] = list(zip(DAY_NAMES[(hours // 24) % 7], HOUR_LABELS[hours % 24]))
+
+    return queries
+
+
+def read_queries(path: str, chunksize: Optional[int] = None, day_and_hour: bool = True):
+    """ Read a queries.csv-format file with the time-bucket columns
+
+    With a chunksize, returns an iterator over DataFrames of at most chunksize rows,
+    so that files larger than memory can be processed """
+    if chunksize is None:
+        return add_time_features(pd.read_csv(path, sep=QUERIES_SEP), day_and_hour)
+    return _read_queries_chunks(path, chunksize, day_and_hour)
+
+
+def _read_queries_chunks(path: str, chunksize: int, day_and_hour: bool) -> Iterator[pd.DataFrame]:
+    with pd.read_csv(path, sep=QUERIES_SEP, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield add_time_features(chunk, day_and_hour)
+
+
+def write_time_features(path: str, output_path: str, chunksize: int = DEFAULT_CHUNKSIZE):
+    """ Stream a queries.csv-format file into output_path with the time-bucket columns
+
+    day_and_hour is not written, it is derived from the timestamp """
+    for i, chunk in enumerate(read_queries(path, chunksize, day_and_hour=False)):
+        chunk.to_csv(output_path, sep=QUERIES_SEP, index=False, mode="w" if i == 0 else "a", header=i == 0)
@@ -0,0 +1,277 @@
+"""
+Production server entrypoint.
+
+Serves the endpoints of `server.py` with a threaded HTTP front (I/O-bound
+requests such as `/public-key` and `/poi` never wait for a verification) and
+offloads the CPU-bound credential operations (registration, request signature
+verification) to a pool of worker processes, with a limit on the number of
+operations in flight.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+from pathlib import Path
+import sys
+import threading
+from typing import Any, Callable, List, Optional
+
+from werkzeug.serving import make_server
+
+import server
+from stroll import Server
+
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8080
+
+# state of a worker process
+_WORKER_SERVER = None
+_WORKER_SECRET_KEY = None
+_WORKER_PUBLIC_KEY = None
+
+
+def _init_worker(secret_key: bytes, public_key: bytes, compact: bool) -> None:
+    """Load the keys once per worker process."""
+
+    # pylint: disable=global-statement
+    global _WORKER_SERVER
+    global _WORKER_SECRET_KEY
+    global _WORKER_PUBLIC_KEY
+
+    _WORKER_SERVER = Server(compact)
+    _WORKER_SECRET_KEY = secret_key
+    _WORKER_PUBLIC_KEY = public_key
+    # decode (and prepare) the keys before the first request
+    _WORKER_SERVER.load_secret_key(secret_key)
+    _WORKER_SERVER.load_public_key(public_key)
+
+
+def _ping() -> bool:
+    """Task run at startup, so that the workers exist before the first request."""
+    return True
+
+
+def _process_registration(
+        server_sk: Optional[bytes],
+        server_pk: Optional[bytes],
+        issuance_request: bytes,
+        username: str,
+        subscriptions: List[str]
+    ) -> bytes:
+    """Registration in a worker process (keys are the worker's if None)."""
+    return _WORKER_SERVER.process_registration(
+        server_sk if server_sk is not None else _WORKER_SECRET_KEY,
+        server_pk if server_pk is not None else _WORKER_PUBLIC_KEY,
+        issuance_request,
+        username,
+        subscriptions
+    )
+
+
+def _check_request_signature(
+        server_pk: Optional[bytes],
+        message: bytes,
+        revealed_attributes: List[str],
+        signature: bytes
+    ) -> bool:
+    """Signature verification in a worker process (key is the worker's if None)."""
+    return _WORKER_SERVER.check_request_signature(
+        server_pk if server_pk is not None else _WORKER_PUBLIC_KEY,
+        message,
+        revealed_attributes,
+        signature
+    )
+
+
+class PooledServer(Server):
+    """Server whose registrations and verifications run in a process pool
+
+    The keys the workers are started with are not sent with every call; calls
+    with other keys still work but ship them to the worker.
+
+    The workers are spawned (not forked: the pool may start workers from the
+    threads of the HTTP server, and forking a multithreaded process can deadlock
+    on locks held by other threads) and started before serving. If a worker dies,
+    the call fails and the pool is replaced by a new one."""
+
+    def __init__(
+            self,
+            secret_key: bytes,
+            public_key: bytes,
+            workers: int,
+            max_concurrent: int,
+            compact: bool = False
+        ):
+        """
+        Args:
+            secret_key: the server's secret key (serialized)
+            public_key: the server's public key (serialized)
+            workers: number of worker processes
+            max_concurrent: maximum number of operations submitted to the
+                workers at the same time, further requests wait for a slot
+            compact: whether responses use the compact binary format
+        """
+        super().__init__(compact)
+        self.worker_secret_key = secret_key
+        self.worker_public_key = public_key
+        self.workers = workers
+        self.executor_lock = threading.Lock()
+        self.executor = self._create_executor()
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        """Start a pool of workers with the keys loaded."""
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.worker_secret_key, self.worker_public_key, self.compact)
+        )
+        # one task per worker: the workers are started (and the keys checked) now
+        for future in [executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def _replace_executor(self, broken: ProcessPoolExecutor) -> None:
+        """Replace a broken pool, unless another thread already did."""
+        with self.executor_lock:
+            if self.executor is broken:
+                broken.shutdown(wait=False)
+                self.executor = self._create_executor()
+
+    def process_registration(
+            self,
+            server_sk: bytes,
+            server_pk: bytes,
+            issuance_request: bytes,
+            username: str,
+            subscriptions: List[str]
+        ) -> bytes:
+        return self._run(
+            _process_registration,
+            None if server_sk == self.worker_secret_key else server_sk,
+            None if server_pk == self.worker_public_key else server_pk,
+            issuance_request,
+            username,
+            subscriptions
+        )
+
+    def check_request_signature(
+            self,
+            server_pk: bytes,
+            message: bytes,
+            revealed_attributes: List[str],
+            signature: bytes
+        ) -> bool:
+        return self._run(
+            _check_request_signature,
+            None if server_pk == self.worker_public_key else server_pk,
+            message,
+            revealed_attributes,
+            signature
+        )
+
+    def _run(self, function: Callable[..., Any], *args: Any) -> Any:
+        """Run the function in a worker, waiting for a free slot."""
+        with self.slots:
+            executor = self.executor
+            try:
+                return executor.submit(function, *args).result()
+            except BrokenProcessPool:
+                # a worker died (the call that crashed it is not retried),
+                # later calls go to a new pool
+                self._replace_executor(executor)
+                raise
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+        with self.executor_lock:
+            self.executor.shutdown(wait=True)
+
+
+def main(args: List[str]) -> None:
+    """Parse the arguments given to the server, and run it."""
+
+    cpu_count = os.cpu_count() or 1
+
+    parser = argparse.ArgumentParser(description="Production server for CS-523 project 2.")
+    parser.add_argument(
+        "-D",
+        "--database",
+        help="Path to the PoI database.",
+        default=Path("fingerprint.db"),
+        type=Path
+    )
+    parser.add_argument(
+        "-p",
+        "--pub",
+        help="Name of the file containing the public key.",
+        default="key.pub",
+        type=argparse.FileType("rb")
+    )
+    parser.add_argument(
+        "-s",
+        "--sec",
+        help="Name of the file containing the secret key.",
+        default="key.sec",
+        type=argparse.FileType("rb")
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of worker processes for the credential operations.",
+        default=cpu_count,
+        type=int
+    )
+    parser.add_argument(
+        "-c",
+        "--max-concurrent",
+        help="Maximum number of credential operations in flight.",
+        default=2 * cpu_count,
+        type=int
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST, type=str)
+    parser.add_argument("--port", default=DEFAULT_PORT, type=int)
+
+    server_run(parser.parse_args(args))
+
+
+def server_run(args: argparse.Namespace) -> None:
+    """Load the keys and the database, and serve the endpoints of `server.py`."""
+
+    try:
+        public_key = args.pub.read()
+        secret_key = args.sec.read()
+
+    finally:
+        args.pub.close()
+        args.sec.close()
+
+    if args.workers < 1 or args.max_concurrent < 1:
+        raise ValueError("The number of workers and the concurrency limit must be positive")
+
+    # the endpoints of server.py read these globals
+    server.PUBLIC_KEY = public_key
+    server.SECRET_KEY = secret_key
+
+    db_path = args.database.resolve()
+    server.APP.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    server.APP.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    server.DB.init_app(server.APP)
+
+    pooled_server = PooledServer(secret_key, public_key, args.workers, args.max_concurrent)
+    server.SERVER = pooled_server
+
+    http_server = make_server(args.host, args.port, server.APP, threaded=True)
+    try:
+        http_server.serve_forever()
+
+    finally:
+        pooled_server.shutdown()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
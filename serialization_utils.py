@@ -1,4 +1,5 @@
 from serialization import jsonpickle
+import compact_serialization
 
 
 def serialize(obj):
@@ -9,9 +10,15 @@ def deserialize(obj):
     return jsonpickle.decode(obj)
 
 
-def serialize_to_bytes(obj):
+def serialize_to_bytes(obj, compact: bool = False):
+    """ Serialize with jsonpickle, or with the binary codec of compact_serialization if `compact` is set """
+    if compact:
+        return compact_serialization.encode(obj)
     return serialize(obj).encode("utf-8")
 
 
 def from_bytes_deserialize(obj):
+    """ Deserialize bytes produced by serialize_to_bytes, the format is detected automatically """
+    if compact_serialization.is_compact(obj):
+        return compact_serialization.decode(obj)
     return deserialize(obj.decode("utf-8"))
@@ -2,7 +2,19 @@
 Classes that you need to complete.
 """
 
-from typing import Any, Dict, List, Union, Tuple
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Union, Tuple
+
+from petrelic.bn import Bn
+from petrelic.multiplicative.pairing import G1Element, GTElement
 
 from serialization_utils import *
 from credential import *
@@ -12,16 +24,47 @@ from stroll_utils import *
 class Server:
     """Server"""
 
-    def __init__(self):
+    def __init__(self, compact: bool = False, prepared_keys: bool = True):
         """
         Server constructor.
+
+        Args:
+            compact: whether responses are serialized with the compact binary
+                codec instead of jsonpickle (requests are accepted in both formats)
+            prepared_keys: whether decoded public keys are wrapped in a
+                PreparedPublicKey, which caches the G2 products of the showings
         """
         self.secret_key = None
         self.public_key = None
+        self.compact = compact
+        self.prepared_keys = prepared_keys
+        # decoded keys, so that they are not deserialized on every request
+        self.key_cache = KeyCache()
+
+    def load_secret_key(self, server_sk: bytes) -> SecretKey:
+        """ Returns the decoded secret key (cached) """
+        return self.key_cache.get(server_sk, from_bytes_deserialize)
+
+    def load_public_key(self, server_pk: bytes) -> PublicKey:
+        """ Returns the decoded public key (cached) """
+        return self.key_cache.get(server_pk, self._decode_public_key)
+
+    def invalidate_keys(self, *serialized_keys: bytes):
+        """ Drops the given keys from the cache (all keys if none is given),
+        to be called when the keys are rotated """
+        if not serialized_keys:
+            self.key_cache.invalidate()
+        for serialized_key in serialized_keys:
+            self.key_cache.invalidate(serialized_key)
+
+    def _decode_public_key(self, server_pk: bytes) -> PublicKey:
+        pk: PublicKey = from_bytes_deserialize(server_pk)
+        return PreparedPublicKey(pk) if self.prepared_keys else pk
 
     @staticmethod
     def generate_ca(
-            subscriptions: List[str]
+            subscriptions: List[str],
+            compact: bool = False
         ) -> Tuple[bytes, bytes]:
         """Initializes the credential system. Runs exactly once in the
         beginning. Decides on schemes public parameters and choses a secret key
@@ -30,6 +73,8 @@ class Server:
         Args:
             subscriptions: a list of all valid attributes. Users cannot get a
                 credential with a attribute which is not included here.
+            compact: whether the public key is serialized with the compact
+                binary codec instead of jsonpickle
 
         Returns:
             tuple containing:
@@ -41,8 +86,11 @@ class Server:
         """Should be called with all subscriptions attribute keys, since username
         is already added in server.py and secret key is added here automatically"""
         subscriptions.append(ATTR_SECRET_KEY)
-        (sk, pk) = generate_key(subscriptions)
-        return serialize_to_bytes(sk), serialize_to_bytes(pk)
+        # large attribute sets are generated in parallel, one worker per core
+        max_workers = (os.cpu_count() or 1) if len(subscriptions) >= PARALLEL_KEY_GENERATION_MIN_ATTRIBUTES else 1
+        (sk, pk) = generate_key(subscriptions, max_workers)
+        # the secret key never leaves the server, it is kept in the jsonpickle format
+        return serialize_to_bytes(sk), serialize_to_bytes(pk, compact)
 
     def process_registration(
             self,
@@ -74,8 +122,8 @@ class Server:
         We are not using the username here, as we do not want to reveal it
         at any moment.
         """
-        sk: SecretKey = from_bytes_deserialize(server_sk)
-        pk: PublicKey = from_bytes_deserialize(server_pk)
+        sk = self.load_secret_key(server_sk)
+        pk = self.load_public_key(server_pk)
         issue_req: IssueRequest = from_bytes_deserialize(issuance_request)
         
         # add subscribed attributes first
@@ -91,7 +139,7 @@ class Server:
         
         issuer_attributes.extend([Attribute(pk.attr_indices_dict[attr_key], attr_key, "false") for attr_key in missing_subs_keys])
         
-        return serialize_to_bytes(sign_issue_request(sk, pk, issue_req, issuer_attributes))
+        return serialize_to_bytes(sign_issue_request(sk, pk, issue_req, issuer_attributes), self.compact)
 
     def check_request_signature(
         self,
@@ -118,8 +166,10 @@ class Server:
         
         Assuming signature is the DisclosureProof model
         """
-        pk: PublicKey = from_bytes_deserialize(server_pk)
+        pk = self.load_public_key(server_pk)
         disclosure: DisclosureProof = from_bytes_deserialize(signature)
+        if not is_well_formed_disclosure(disclosure):
+            return False
         try:
             attributes = [Attribute(pk.attr_indices_dict[attr_key], attr_key, "true") for attr_key in revealed_attributes]
         except:
@@ -128,14 +178,279 @@ class Server:
         
         return verify_disclosure_proof(pk, disclosure, message, attributes)
 
+    def check_request_signatures(
+        self,
+        server_pk: bytes,
+        requests: List[Tuple[bytes, List[str], bytes]]
+        ) -> List[bool]:
+        """ Verify the signatures of many location requests at once
+
+        Args:
+            server_pk: the server's public key (serialized)
+            requests: tuples (message, revealed_attributes, signature) as passed
+                to `check_request_signature`
+
+        Returns:
+            whether each signature is valid, in the order of the requests
+
+        A malformed request only invalidates itself: the signatures are
+        type-checked before they are batched, and if the batch verification
+        still fails, each request is verified on its own.
+        """
+        pk = self.load_public_key(server_pk)
+        verdicts = [False] * len(requests)
+        positions = []
+        batch = []
+        for k, (message, revealed_attributes, signature) in enumerate(requests):
+            try:
+                disclosure: DisclosureProof = from_bytes_deserialize(signature)
+                if not isinstance(message, bytes) or not is_well_formed_disclosure(disclosure):
+                    continue
+                attributes = [Attribute(pk.attr_indices_dict[attr_key], attr_key, "true") for attr_key in revealed_attributes]
+            except Exception:
+                continue
+            positions.append(k)
+            batch.append((disclosure, message, attributes))
+
+        try:
+            batch_verdicts = verify_disclosure_proofs_batch(pk, batch)
+        except Exception:
+            batch_verdicts = [self._verify_alone(pk, request) for request in batch]
+        for k, valid in zip(positions, batch_verdicts):
+            verdicts[k] = valid
+        return verdicts
+
+    @staticmethod
+    def _verify_alone(pk: PublicKey, request: Tuple[DisclosureProof, bytes, List[Attribute]]) -> bool:
+        """ Verify a single decoded request, an error makes it invalid """
+        try:
+            return verify_disclosure_proof(pk, *request)
+        except Exception:
+            return False
+
+
+def is_well_formed_disclosure(disclosure: Any) -> bool:
+    """ Whether a deserialized signature has the types and shapes of a disclosure proof
+
+    Deserialization turns the bytes of a client into any object (e.g. None or
+    another class with jsonpickle), this is checked before it is verified. Both
+    formats are accepted: folded proofs (indices of the hidden attributes) and
+    unfolded proofs (GT generators, checked against the key by the verifier). """
+    if not isinstance(disclosure, DisclosureProof):
+        return False
+    pi = getattr(disclosure, "pi", None)
+    credential = getattr(disclosure, "credential_showed", None)
+    if not isinstance(pi, ZKProof) or not isinstance(credential, AnonymousCredential):
+        return False
+    if not isinstance(getattr(credential, "sigma_1", None), G1Element) or not isinstance(getattr(credential, "sigma_2", None), G1Element):
+        return False
+    c, s, indices = getattr(pi, "c", None), getattr(pi, "s", None), getattr(pi, "indices", None)
+    if not isinstance(c, Bn) or not isinstance(s, list) or not all(isinstance(s_i, Bn) for s_i in s):
+        return False
+    if indices is None:
+        generators = getattr(pi, "generators", None)
+        if not isinstance(generators, list) or not all(isinstance(g, GTElement) for g in generators) or len(s) != len(generators):
+            return False
+    elif not isinstance(indices, list) or not all(type(idx) is int for idx in indices) or len(s) != len(indices) + 1:
+        return False
+    return all(element is None or isinstance(element, GTElement) for element in (getattr(pi, "com", None), getattr(pi, "R", None)))
+
+
+# server of a verification worker process
+_VERIFICATION_WORKER_SERVER = None
+
+
+def _check_request_signatures_in_worker(
+        server_pk: bytes,
+        requests: List[Tuple[bytes, List[str], bytes]]
+    ) -> List[bool]:
+    """ Batch verification in a worker process, which keeps its decoded keys between batches """
+    # pylint: disable=global-statement
+    global _VERIFICATION_WORKER_SERVER
+    if _VERIFICATION_WORKER_SERVER is None:
+        _VERIFICATION_WORKER_SERVER = Server()
+    return _VERIFICATION_WORKER_SERVER.check_request_signatures(server_pk, requests)
+
+
+class VerificationService:
+    """Asynchronous verification of location request signatures
+
+    Requests are queued by `submit`, which returns a future. A dispatcher thread
+    coalesces the requests arriving within `window` seconds (at most `max_batch`)
+    into a batch, splits it across a process pool (petrelic holds the GIL) and
+    verifies each part with batch verification (`Server.check_request_signatures`).
+    If a part fails, each of its requests is verified on its own, so that a request
+    cannot make the others fail. If a worker dies, the pool is broken for good: it
+    is replaced by a new one, on which the requests are verified again (a request
+    alone in a part is retried once). With `workers=0` the batches are verified in
+    the dispatcher thread.
+
+    The workers are spawned: the pool starts them from the dispatcher thread, and
+    forking a multithreaded process can deadlock."""
+
+    def __init__(
+            self,
+            server_pk: bytes,
+            workers: Optional[int] = None,
+            window: float = VERIFICATION_WINDOW,
+            max_batch: int = VERIFICATION_MAX_BATCH
+        ):
+        """
+        Args:
+            server_pk: the server's public key (serialized)
+            workers: number of worker processes (default: one per core)
+            window: time (in seconds) requests are coalesced for after the first one
+            max_batch: maximum number of requests in a batch
+        """
+        self.server_pk = server_pk
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.window = window
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        self.executor_lock = threading.Lock()
+        self.executor = self._create_executor() if self.workers > 0 else None
+        self.server = Server() if self.workers == 0 else None
+        self.closed = False
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def submit(
+            self,
+            message: bytes,
+            revealed_attributes: List[str],
+            signature: bytes
+        ) -> Future:
+        """ Queue a request (see `Server.check_request_signature`), the future resolves to its validity """
+        if self.closed:
+            raise RuntimeError("The verification service is closed")
+        future = Future()
+        self.requests.put(((message, revealed_attributes, signature), future))
+        return future
+
+    def close(self):
+        """ Verify the queued requests and stop the service """
+        if self.closed:
+            return
+        self.closed = True
+        self.requests.put(None)
+        self.dispatcher.join()
+        # the requests of a broken pool are retried on a new pool while the old one shuts down
+        while self.executor is not None:
+            with self.executor_lock:
+                executor = self.executor
+            executor.shutdown(wait=True)
+            with self.executor_lock:
+                if self.executor is executor:
+                    break
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _replace_executor(self, broken: ProcessPoolExecutor):
+        """ Replace a broken pool, unless another part already did """
+        with self.executor_lock:
+            if self.executor is broken:
+                broken.shutdown(wait=False)
+                self.executor = self._create_executor()
+
+    def _dispatch(self):
+        stop = False
+        while not stop:
+            item = self.requests.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._verify(batch)
+
+    def _verify(self, batch: List[Tuple[Tuple[bytes, List[str], bytes], Future]]):
+        if self.executor is None:
+            self._verify_in_thread(batch)
+            return
+        # one part per worker, each part is still batch-verified
+        part_size = math.ceil(len(batch) / self.workers)
+        for start in range(0, len(batch), part_size):
+            self._submit(batch[start:start + part_size])
+
+    def _verify_in_thread(self, batch: List[Tuple[Tuple[bytes, List[str], bytes], Future]]):
+        self._resolve(batch, lambda: self.server.check_request_signatures(self.server_pk, [request for request, _ in batch]))
+
+    def _submit(self, part: List[Tuple[Tuple[bytes, List[str], bytes], Future]], retry: bool = True):
+        executor = self.executor
+        try:
+            verdicts = executor.submit(_check_request_signatures_in_worker, self.server_pk, [request for request, _ in part])
+        except Exception as e:
+            # e.g. a worker died since the last part was submitted, or the pool is shut down
+            self._fail(part, e, executor, retry)
+            return
+        verdicts.add_done_callback(lambda verdicts, part=part: self._resolve(part, verdicts.result, executor, retry))
+
+    def _resolve(
+            self,
+            batch: List[Tuple[Tuple[bytes, List[str], bytes], Future]],
+            get_verdicts,
+            executor: Optional[ProcessPoolExecutor] = None,
+            retry: bool = True
+        ):
+        try:
+            verdicts = get_verdicts()
+        except Exception as e:
+            self._fail(batch, e, executor, retry)
+            return
+        for (_, future), valid in zip(batch, verdicts):
+            future.set_result(valid)
+
+    def _fail(
+            self,
+            batch: List[Tuple[Tuple[bytes, List[str], bytes], Future]],
+            error: Exception,
+            executor: Optional[ProcessPoolExecutor],
+            retry: bool
+        ):
+        """ Verify the requests of a failed part again, each on its own: only the faulty one fails """
+        broken = isinstance(error, BrokenProcessPool)
+        if broken:
+            # a worker died, every later submission to its pool would fail
+            self._replace_executor(executor)
+        if len(batch) > 1:
+            for item in batch:
+                if self.executor is None:
+                    self._verify_in_thread([item])
+                else:
+                    self._submit([item])
+        elif broken and retry:
+            # the request may only have been in the pool of the one that killed the worker
+            self._submit(batch, retry=False)
+        else:
+            batch[0][1].set_exception(error)
+
 
 class Client:
     """Client"""
 
-    def __init__(self):
+    def __init__(self, compact: bool = False):
         """
         Client constructor.
+
+        Args:
+            compact: whether requests are serialized with the compact binary
+                codec instead of jsonpickle
         """
+        self.compact = compact
+        # session of the last (server_pk, credentials) pair used to sign
+        self.session = None
 
     def prepare_registration(
             self,
@@ -167,6 +482,8 @@ class Client:
         persist_secret_key()
         persist_username(username)
         persist_subscriptions(subscriptions)
+        # the persisted state changed, a new session is needed
+        self.close_session()
                 
         pk: PublicKey = from_bytes_deserialize(server_pk)
         # user attributes that go into the Pedersen commitment
@@ -174,7 +491,7 @@ class Client:
         comm_attributes = self.get_sk_username_attributes(pk)
         # create client's issuance request
         issue_request, t = create_issue_request(pk, comm_attributes)
-        return serialize_to_bytes(issue_request), State(t)
+        return serialize_to_bytes(issue_request, self.compact), State(t)
 
     def process_registration_response(
             self,
@@ -197,7 +514,7 @@ class Client:
         blind_signature: BlindSignature = from_bytes_deserialize(server_response)
         
         # client computes the credential - not anonymized
-        return serialize_to_bytes(obtain_credential(pk, blind_signature, private_state.t))
+        return serialize_to_bytes(obtain_credential(pk, blind_signature, private_state.t), self.compact)
 
     def sign_request(
             self,
@@ -221,19 +538,20 @@ class Client:
         """ The client computes anonymous credential as well as disclosure proof
         at this step 
         Assuming types to be the list of requested location types in the request """
-        
-        pk: PublicKey = from_bytes_deserialize(server_pk)
-        credential: Signature = from_bytes_deserialize(credentials)
-        anonymized_cred = credential.anonymize()
-        
-        # client hides everything except for the requested location types
-        all_attr_keys = get_all_attribute_keys(pk)
-        # collect subscription hidden attributes
-        hidden_subs_keys = list(filter(lambda x: x not in types and x not in [ATTR_SECRET_KEY, ATTR_USERNAME], all_attr_keys))
-        hidden_subs_attrs = [Attribute(pk.attr_indices_dict[key], key, "true" if self.is_subscribed_to_type(key) else "false") for key in hidden_subs_keys]
-        # add secret key and username to hidden attributes
-        hidden_subs_attrs.extend(self.get_sk_username_attributes(pk))
-        return serialize_to_bytes(create_disclosure_proof(pk, anonymized_cred, hidden_subs_attrs, message))
+        return self.get_session(server_pk, credentials).sign_request(message, types)
+
+    def get_session(self, server_pk: bytes, credentials: bytes) -> "ClientSession":
+        """ Returns the session for the key and credential, reusing the last one if they did not change """
+        if self.session is None or not self.session.matches(server_pk, credentials):
+            self.close_session()
+            self.session = ClientSession(server_pk, credentials, self.compact)
+        return self.session
+
+    def close_session(self):
+        """ Closes the current session (stopping its background precomputation), if any """
+        if self.session is not None:
+            self.session.close()
+            self.session = None
 
     def is_subscribed_to_type(self, a_type: str) -> bool:
         """ Returns whether the client is subscribed to the provided type of location """
@@ -246,3 +564,96 @@ class Client:
     
     def get_secret_key(self):
         return read_secret_key()
+
+
+class ClientSession:
+    """In-memory state of a registered client
+
+    Decodes the server's public key and the client's credential, and reads the
+    secret key, username and subscriptions from disk once, so that many requests
+    can be signed without any deserialization or I/O.
+
+    Disclosure coupons (the message-independent part of a showing, see
+    create_disclosure_coupon) can be precomputed for the types the client expects
+    to request; sign_request then only hashes the message and computes the
+    responses. Precomputation is opt-in (`precompute`, `precompute_in_background`).
+    The background thread holds the GIL during the group operations (petrelic does
+    not release it), so it competes with sign_request for the CPU: it should only
+    be started when the client is idle."""
+
+    def __init__(self, server_pk: bytes, credentials: bytes, compact: bool = False):
+        """
+        Args:
+            server_pk: a server's public key (serialized)
+            credentials: client's credential (serialized)
+            compact: whether signatures are serialized with the compact binary codec
+        """
+        self.server_pk = server_pk
+        self.credentials = credentials
+        self.compact = compact
+        self.pk: PublicKey = from_bytes_deserialize(server_pk)
+        self.credential: Signature = from_bytes_deserialize(credentials)
+        self.subscriptions = set(read_subscriptions())
+        self.sk_username_attributes = [Attribute(self.pk.attr_indices_dict[ATTR_SECRET_KEY], ATTR_SECRET_KEY, read_secret_key()),
+                                       Attribute(self.pk.attr_indices_dict[ATTR_USERNAME], ATTR_USERNAME, read_username())]
+        # precomputed coupons, by requested types (each coupon is used once)
+        self.coupons: Dict[Tuple[str, ...], deque] = {}
+        self.executor = None
+
+    def matches(self, server_pk: bytes, credentials: bytes) -> bool:
+        """ Returns whether the session was created for this key and credential """
+        return self.server_pk == server_pk and self.credentials == credentials
+
+    def hidden_attributes(self, types: List[str]) -> List[Attribute]:
+        """ Returns the attributes hidden when requesting the given types """
+        # client hides everything except for the requested location types
+        hidden_subs_keys = [key for key in get_all_attribute_keys(self.pk)
+                            if key not in types and key not in [ATTR_SECRET_KEY, ATTR_USERNAME]]
+        hidden_subs_attrs = [Attribute(self.pk.attr_indices_dict[key], key, "true" if key in self.subscriptions else "false")
+                             for key in hidden_subs_keys]
+        # add secret key and username to hidden attributes
+        return hidden_subs_attrs + self.sk_username_attributes
+
+    @staticmethod
+    def types_key(types: List[str]) -> Tuple[str, ...]:
+        return tuple(sorted(set(types)))
+
+    def create_coupon(self, types: List[str]) -> DisclosureCoupon:
+        """ Precomputes a coupon for a request of the given types with a fresh anonymized credential """
+        return create_disclosure_coupon(self.pk, self.credential.anonymize(), self.hidden_attributes(types))
+
+    def precompute(self, types: List[str], count: int = 1):
+        """ Adds `count` coupons for the given types to the pool """
+        pool = self.coupons.setdefault(self.types_key(types), deque())
+        for _ in range(count):
+            pool.append(self.create_coupon(types))
+
+    def precompute_in_background(self, types: List[str], count: int = 1) -> Future:
+        """ Adds `count` coupons for the given types to the pool from a background thread
+
+        The thread slows down a concurrent sign_request (see the class docstring). """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        return self.executor.submit(self.precompute, types, count)
+
+    def available_coupons(self, types: List[str]) -> int:
+        """ Returns the number of precomputed coupons for the given types """
+        return len(self.coupons.get(self.types_key(types), ()))
+
+    def close(self):
+        """ Stops the background precomputation """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def sign_request(self, message: bytes, types: List[str]) -> bytes:
+        """ Signs the request with the client's credential (see Client.sign_request)
+
+        A precomputed coupon is used if one is available for the types,
+        otherwise the whole proof is computed now."""
+        try:
+            coupon = self.coupons[self.types_key(types)].popleft()
+        except (KeyError, IndexError):
+            coupon = self.create_coupon(types)
+        disclosure_proof = create_disclosure_proof_from_coupon(self.pk, coupon, message)
+        return serialize_to_bytes(disclosure_proof, self.compact)
@@ -1,15 +1,25 @@
-from typing import List
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
 
 from credential_utils import PublicKey
 
+import hashlib
 import string
 import random
+import threading
 from serialization_utils import serialize, deserialize
 
 # Constants
 ATTR_SECRET_KEY = "secret_key"
 ATTR_USERNAME = "username"
 CLIENT_SK_LENGTH = 128
+# from this number of attributes, the server generates its key in parallel
+PARALLEL_KEY_GENERATION_MIN_ATTRIBUTES = 64
+# number of decoded keys the server keeps in memory
+KEY_CACHE_SIZE = 8
+# requests arriving within this time (in seconds) are verified as one batch
+VERIFICATION_WINDOW = 0.005
+VERIFICATION_MAX_BATCH = 64
 
 # Local persistence file names
 USERNAME_FILE = "username.txt"
@@ -22,6 +32,52 @@ def get_all_attribute_keys(pk: PublicKey) -> List[str]:
     return pk.attr_indices_dict.keys()
 
 
+class KeyCache:
+    """ Decoded keys, indexed by a digest of their serialized bytes
+
+    The server receives its keys serialized on every request; decoding them
+    (base64/binary group elements, attribute dictionary) is only done the first
+    time a given serialization is seen. Old entries are evicted in LRU order,
+    `invalidate` removes them explicitly (e.g. on key rotation).
+
+    The cache can be shared by the threads of a threaded server: the LRU order
+    is only updated under a lock (keys are decoded outside of it). The returned
+    keys are shared as well, their own caches (fixed-base tables, G2 products of
+    a PreparedPublicKey) are also updated under locks."""
+    def __init__(self, max_size: int = KEY_CACHE_SIZE):
+        self.max_size = max_size
+        self.keys = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def digest(data: bytes) -> bytes:
+        return hashlib.sha256(data).digest()
+
+    def get(self, data: bytes, decode: Callable[[bytes], Any]) -> Any:
+        """ Returns the decoded key, decoding it with `decode` on a miss """
+        digest = self.digest(data)
+        with self.lock:
+            if digest in self.keys:
+                self.keys.move_to_end(digest)
+                return self.keys[digest]
+        key = decode(data)
+        with self.lock:
+            # another thread may have decoded the same key meanwhile, keep a single instance
+            key = self.keys.setdefault(digest, key)
+            self.keys.move_to_end(digest)
+            if len(self.keys) > self.max_size:
+                self.keys.popitem(last=False)
+        return key
+
+    def invalidate(self, data: Optional[bytes] = None):
+        """ Removes the key with the given serialization, or all keys """
+        with self.lock:
+            if data is None:
+                self.keys.clear()
+            else:
+                self.keys.pop(self.digest(data), None)
+
+
 def get_random_secret_key(length: int) -> str:
     """ Generates random secret key for the client """
     random_source = string.ascii_letters + string.digits + string.punctuation
@@ -1,6 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 from petrelic.multiplicative.pairing import G1
 
+import credential as credential_module
 from credential import *
 from credential_utils import *
 import string
@@ -91,10 +94,42 @@ def test_failure_issuance_wrong_zkp():
     issuer_attributes = [Attribute(3, "key3", "value3"), Attribute(4, "key4", "value4")]
     issue_request, t = create_issue_request(pk, user_attributes)
     # change pi
-    issue_request.pi.generators.append(G1.generator() ** G1.order().random())
+    issue_request.pi.indices.append(4)
     issue_request.pi.s.append(G1.order().random())
     sign_issue_request(sk, pk, issue_request, issuer_attributes)
 
+@pytest.mark.xfail(raises=ZKPVerificationError)
+def test_failure_issuance_explicit_generators():
+    """ proofs with generators chosen by the user are rejected, even if they are valid """
+    sk, pk = generate_key(["key"] * 5)
+    user_attributes = [Attribute(0, "key0", "value0"), Attribute(1, "key1", "value1"), Attribute(2, "key2", "value2")]
+    issuer_attributes = [Attribute(3, "key3", "value3"), Attribute(4, "key4", "value4")]
+    issue_request, t = create_issue_request(pk, user_attributes)
+    # change pi
+    issue_request.pi.generators = [pk.g] + [pk.Y[idx] for idx in issue_request.pi.indices]
+    issue_request.pi.indices = None
+    sign_issue_request(sk, pk, issue_request, issuer_attributes)
+
+def test_issuance_proof_without_generators():
+    sk, pk = generate_key(["key"] * 3)
+    user_attributes = [Attribute(2, "key2", "value2"), Attribute(0, "key0", "value0")]
+    issuer_attributes = [Attribute(1, "key1", "value1")]
+    issue_request, t = create_issue_request(pk, user_attributes)
+    assert issue_request.pi.generators is None
+    assert issue_request.pi.indices == [0, 2]
+    blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+    credential = obtain_credential(pk, blind_signature, t)
+    assert verify(pk, credential, [attr.to_bytes() for attr in sorted(user_attributes + issuer_attributes, key=lambda attr: attr.index)])
+
+@pytest.mark.xfail(raises=ZKPVerificationError)
+def test_failure_issuance_overlapping_attributes():
+    """ the user commits to an attribute the issuer signs """
+    sk, pk = generate_key(["key"] * 3)
+    user_attributes = [Attribute(0, "key0", "value0"), Attribute(1, "key1", "value1")]
+    issuer_attributes = [Attribute(1, "key1", "value1"), Attribute(2, "key2", "value2")]
+    issue_request, t = create_issue_request(pk, user_attributes)
+    sign_issue_request(sk, pk, issue_request, issuer_attributes)
+
 """ Showing protocol tests """    
 def test_success_disclosure_proof_1():
     """ hidden_attributes = user_attributes, disclosed_attributes = issuer_attributes"""
@@ -235,4 +270,312 @@ def test_failure_disclosure_proof_different_attribute():
     # change false to true
     disclosed_attributes = [Attribute(2, "rest", "true")]
     disclosure_proof = create_disclosure_proof(pk, anonymous_credential, hidden_attributes, b"hello world")
-    assert verify_disclosure_proof(pk, disclosure_proof, b"hello world", disclosed_attributes)  
\ No newline at end of file
+    assert verify_disclosure_proof(pk, disclosure_proof, b"hello world", disclosed_attributes)  
+
+@pytest.mark.xfail(raises=AssertionError)
+def test_failure_disclosure_proof_disclosed_attribute_listed_as_hidden():
+    """ the prover sends a generator for a disclosed attribute, to prove a value it does not have """
+    sk, pk = generate_key(["key"] * 3)
+    user_attributes = [Attribute(0, "secret_key", "value0"), Attribute(1, "username", "value1")]
+    issuer_attributes = [Attribute(2, "rest", "false")]
+    # issuance protocol
+    issue_request, t = create_issue_request(pk, user_attributes)
+    blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+    credential = obtain_credential(pk, blind_signature, t)
+    # showing protocol: C / e(sigma_1, Y_tilde[2])^(m_false - m_true) is the commitment expected for "rest:true"
+    anonymous_credential = credential.anonymize()
+    sigma_1 = anonymous_credential.sigma_1
+    generators = [sigma_1.pair(pk.g_tilde)] + [sigma_1.pair(pk.Y_tilde[idx]) for idx in range(3)]
+    m_false = bytes_to_Z_p(Attribute(2, "rest", "false").to_bytes())
+    m_true = bytes_to_Z_p(Attribute(2, "rest", "true").to_bytes())
+    prover_inputs = [anonymous_credential.t] + [bytes_to_Z_p(attr.to_bytes()) for attr in user_attributes] + [(m_false - m_true).mod(G1.order())]
+    C = multi_exponentiation(generators, prover_inputs)
+    c, s, R = generate_zkp_with_commitment(generators, prover_inputs, C, b"hello world")
+    disclosure_proof = DisclosureProof(ZKProof(generators, c, s, C, R), anonymous_credential)
+    assert verify_disclosure_proof(pk, disclosure_proof, b"hello world", [Attribute(2, "rest", "true")])
+
+def test_success_disclosure_proof_unsorted_generators():
+    """ proofs of existing clients list the hidden attributes in their own order, not by index """
+    sk, pk = generate_key(["key"] * 4)
+    user_attributes = [Attribute(2, "username", "value2"), Attribute(3, "secret_key", "value3")]
+    issuer_attributes = [Attribute(0, "rest", "true"), Attribute(1, "bar", "false")]
+    # issuance protocol
+    issue_request, t = create_issue_request(pk, user_attributes)
+    blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+    credential = obtain_credential(pk, blind_signature, t)
+    # showing protocol, as the original client: subscriptions, then secret key and username
+    anonymous_credential = credential.anonymize()
+    hidden_attributes = [Attribute(1, "bar", "false"), Attribute(3, "secret_key", "value3"), Attribute(2, "username", "value2")]
+    generators = [anonymous_credential.sigma_1.pair(pk.g_tilde)] + [anonymous_credential.sigma_1.pair(pk.Y_tilde[attr.index]) for attr in hidden_attributes]
+    prover_inputs = [anonymous_credential.t] + [bytes_to_Z_p(attr.to_bytes()) for attr in hidden_attributes]
+    c, s = generate_zkp(generators, prover_inputs, multi_exponentiation(generators, prover_inputs), b"hello world")
+    disclosure_proof = DisclosureProof(ZKProof(generators, c, s), anonymous_credential)
+    assert verify_disclosure_proof(pk, disclosure_proof, b"hello world", [Attribute(0, "rest", "true")])
+    # the generators must still be those of the attributes that are not disclosed
+    disclosure_proof.pi.generators = generators[:1] + generators[2:] + generators[2:3]
+    assert not verify_disclosure_proof(pk, disclosure_proof, b"hello world", [Attribute(0, "rest", "true")])
+
+@pytest.mark.parametrize("folded", [False, True])
+def test_failure_disclosure_proof_duplicate_disclosed_attribute(folded):
+    """ an attribute disclosed twice is rejected """
+    sk, pk = generate_key(["key"] * 3)
+    user_attributes = [Attribute(0, "secret_key", "value0"), Attribute(1, "username", "value1")]
+    issuer_attributes = [Attribute(2, "rest", "true")]
+    # issuance protocol
+    issue_request, t = create_issue_request(pk, user_attributes)
+    blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+    credential = obtain_credential(pk, blind_signature, t)
+    # showing protocol
+    disclosure_proof = create_disclosure_proof(pk, credential.anonymize(), user_attributes, b"hello world", folded=folded)
+    assert verify_disclosure_proof(pk, disclosure_proof, b"hello world", issuer_attributes)
+    assert not verify_disclosure_proof(pk, disclosure_proof, b"hello world", issuer_attributes * 2)
+
+""" Batch verification tests """
+def count_batch_equations(monkeypatch):
+    """ Count the calls of the batch equation (a single proof is verified alone) """
+    calls = []
+    check_batch_equation = credential_module._check_batch_equation
+    def counting_check_batch_equation(pk, requests):
+        calls.append(len(requests))
+        return check_batch_equation(pk, requests)
+    monkeypatch.setattr(credential_module, "_check_batch_equation", counting_check_batch_equation)
+    return calls
+
+def test_success_disclosure_proofs_batch(monkeypatch):
+    sk, pk = generate_key(["key"] * 5)
+    user_attributes = [Attribute(0, "secret_key", "value0"), Attribute(1, "username", "value1")]
+    issuer_attributes = [Attribute(2, "rest", "true"), Attribute(3, "dojo", "true"), Attribute(4, "bar", "false")]
+    # issuance protocol
+    issue_request, t = create_issue_request(pk, user_attributes)
+    blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+    credential = obtain_credential(pk, blind_signature, t)
+    # showing protocol, each proof discloses a different set of attributes
+    requests = []
+    for i in range(2, 5):
+        hidden_attributes = user_attributes + [attr for attr in issuer_attributes if attr.index != i]
+        disclosed_attributes = [attr for attr in issuer_attributes if attr.index == i]
+        message = "message {}".format(i).encode()
+        disclosure_proof = create_disclosure_proof(pk, credential.anonymize(), hidden_attributes, message, folded=True)
+        requests.append((disclosure_proof, message, disclosed_attributes))
+    calls = count_batch_equations(monkeypatch)
+    assert verify_disclosure_proofs_batch(pk, requests) == [True, True, True]
+    # the three proofs are checked with a single batch equation
+    assert calls == [3]
+
+def test_failure_disclosure_proofs_batch_pinpoints_invalid_proof(monkeypatch):
+    sk, pk = generate_key(["key"] * 3)
+    user_attributes = [Attribute(0, "secret_key", "value0"), Attribute(1, "username", "value1")]
+    issuer_attributes = [Attribute(2, "rest", "false")]
+    # issuance protocol
+    issue_request, t = create_issue_request(pk, user_attributes)
+    blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+    credential = obtain_credential(pk, blind_signature, t)
+    # showing protocol
+    requests = []
+    for i in range(8):
+        message = "message {}".format(i).encode()
+        disclosure_proof = create_disclosure_proof(pk, credential.anonymize(), user_attributes, message, folded=True)
+        requests.append((disclosure_proof, message, issuer_attributes))
+    # change false to true in the sixth request
+    proof, message, _ = requests[5]
+    requests[5] = (proof, message, [Attribute(2, "rest", "true")])
+    calls = count_batch_equations(monkeypatch)
+    assert verify_disclosure_proofs_batch(pk, requests) == [True] * 5 + [False] + [True] * 2
+    # the batch is split in halves down to the invalid proof: 8, then 4 + 4, then 2 + 2 (the last pair is verified alone)
+    assert calls == [8, 4, 4, 2, 2]
+
+def test_success_disclosure_proofs_batch_without_commitments():
+    """ proofs without C and R are verified one by one """
+    sk, pk = generate_key(["key"] * 2)
+    user_attributes = [Attribute(0, "secret_key", "value0")]
+    issuer_attributes = [Attribute(1, "rest", "true")]
+    # issuance protocol
+    issue_request, t = create_issue_request(pk, user_attributes)
+    blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+    credential = obtain_credential(pk, blind_signature, t)
+    # showing protocol
+    disclosure_proof = create_disclosure_proof(pk, credential.anonymize(), user_attributes, b"hello world")
+    disclosure_proof.pi.com, disclosure_proof.pi.R = None, None
+    assert verify_disclosure_proofs_batch(pk, [(disclosure_proof, b"hello world", issuer_attributes)]) == [True]
+
+""" Prepared public key tests """
+def test_success_prepared_public_key_threads():
+    """ a key can be shared by threads while its caches evict entries """
+    sk, pk = generate_key(["key"] * 3)
+    prepared_pk = PreparedPublicKey(pk, cache_size=2)
+    attributes = [[Attribute(i % 3, "key", "value{}".format(i % 5))] for i in range(15)]
+    expected = [pk.Y_tilde[attrs[0].index] ** bytes_to_Z_p(attrs[0].to_bytes()) for attrs in attributes]
+    def use_key(i):
+        assert prepared_pk.g_power(Bn(i)) == pk.g ** Bn(i)
+        return prepared_pk.Y_tilde_product(attributes[i % 15])
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        products = list(executor.map(use_key, range(300)))
+    assert all(product == expected[i % 15] for i, product in enumerate(products))
+    assert len(prepared_pk._products) == 2
+
+def test_success_disclosure_proof_prepared_public_key():
+    sk, pk = generate_key(["key"] * 5)
+    prepared_pk = PreparedPublicKey(pk)
+    user_attributes = [Attribute(0, "secret_key", "value0"), Attribute(1, "username", "value1")]
+    issuer_attributes = [Attribute(2, "rest", "true"), Attribute(3, "dojo", "true"), Attribute(4, "bar", "false")]
+    # issuance protocol
+    issue_request, t = create_issue_request(prepared_pk, user_attributes)
+    blind_signature = sign_issue_request(sk, prepared_pk, issue_request, issuer_attributes)
+    credential = obtain_credential(prepared_pk, blind_signature, t)
+    # showing protocol
+    hidden_attributes = user_attributes + [Attribute(2, "rest", "true")]
+    disclosed_attributes = [Attribute(3, "dojo", "true"), Attribute(4, "bar", "false")]
+    # the proofs are interchangeable between prepared and plain public keys
+    disclosure_proof = create_disclosure_proof(prepared_pk, credential.anonymize(), hidden_attributes, b"hello world")
+    assert verify_disclosure_proof(prepared_pk, disclosure_proof, b"hello world", disclosed_attributes)
+    assert verify_disclosure_proof(pk, disclosure_proof, b"hello world", disclosed_attributes)
+    disclosure_proof = create_disclosure_proof(pk, credential.anonymize(), hidden_attributes, b"hello world")
+    assert verify_disclosure_proof(prepared_pk, disclosure_proof, b"hello world", disclosed_attributes)
+
+@pytest.mark.xfail(raises=AssertionError)
+def test_failure_disclosure_proof_prepared_public_key_different_attribute():
+    sk, pk = generate_key(["key"] * 3)
+    prepared_pk = PreparedPublicKey(pk)
+    user_attributes = [Attribute(0, "secret_key", "value0"), Attribute(1, "username", "value1")]
+    issuer_attributes = [Attribute(2, "rest", "false")]
+    # issuance protocol
+    issue_request, t = create_issue_request(pk, user_attributes)
+    blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+    credential = obtain_credential(pk, blind_signature, t)
+    # showing protocol
+    disclosure_proof = create_disclosure_proof(prepared_pk, credential.anonymize(), user_attributes, b"hello world")
+    # populate the cache with the right attribute first
+    assert verify_disclosure_proof(prepared_pk, disclosure_proof, b"hello world", issuer_attributes)
+    # change false to true
+    assert verify_disclosure_proof(prepared_pk, disclosure_proof, b"hello world", [Attribute(2, "rest", "true")])
+
+""" Folded showing protocol tests """
+def test_success_folded_disclosure_proof():
+    sk, pk = generate_key(["key"] * 5)
+    user_attributes = [Attribute(0, "secret_key", "value0"), Attribute(1, "username", "value1")]
+    issuer_attributes = [Attribute(2, "rest", "true"), Attribute(3, "dojo", "true"), Attribute(4, "bar", "false")]
+    # issuance protocol
+    issue_request, t = create_issue_request(pk, user_attributes)
+    blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+    credential = obtain_credential(pk, blind_signature, t)
+    # showing protocol, hidden attributes are not sorted by index
+    hidden_attributes = [Attribute(2, "rest", "true"), Attribute(0, "secret_key", "value0"), Attribute(1, "username", "value1")]
+    disclosed_attributes = [Attribute(3, "dojo", "true"), Attribute(4, "bar", "false")]
+    disclosure_proof = create_disclosure_proof(pk, credential.anonymize(), hidden_attributes, b"hello world", folded=True)
+    assert disclosure_proof.pi.generators is None and disclosure_proof.pi.indices == [0, 1, 2]
+    assert verify_disclosure_proof(pk, disclosure_proof, b"hello world", disclosed_attributes)
+    assert verify_disclosure_proof(PreparedPublicKey(pk), disclosure_proof, b"hello world", disclosed_attributes)
+
+def test_success_folded_disclosure_proofs_batch():
+    sk, pk = generate_key(["key"] * 3)
+    user_attributes = [Attribute(0, "secret_key", "value0"), Attribute(1, "username", "value1")]
+    issuer_attributes = [Attribute(2, "rest", "true")]
+    # issuance protocol
+    issue_request, t = create_issue_request(pk, user_attributes)
+    blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+    credential = obtain_credential(pk, blind_signature, t)
+    # showing protocol, the batch mixes both proof formats
+    requests = []
+    for folded in [True, False, True]:
+        disclosure_proof = create_disclosure_proof(pk, credential.anonymize(), user_attributes, b"hello world", folded)
+        requests.append((disclosure_proof, b"hello world", issuer_attributes))
+    assert verify_disclosure_proofs_batch(pk, requests) == [True, True, True]
+
+@pytest.mark.xfail(raises=AssertionError)
+def test_failure_folded_disclosure_proof_different_attribute():
+    sk, pk = generate_key(["key"] * 3)
+    user_attributes = [Attribute(0, "secret_key", "value0"), Attribute(1, "username", "value1")]
+    issuer_attributes = [Attribute(2, "rest", "false")]
+    # issuance protocol
+    issue_request, t = create_issue_request(pk, user_attributes)
+    blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+    credential = obtain_credential(pk, blind_signature, t)
+    # showing protocol
+    disclosure_proof = create_disclosure_proof(pk, credential.anonymize(), user_attributes, b"hello world", folded=True)
+    # change false to true
+    assert verify_disclosure_proof(pk, disclosure_proof, b"hello world", [Attribute(2, "rest", "true")])
+
+@pytest.mark.xfail(raises=AssertionError)
+def test_failure_folded_disclosure_proof_missing_attribute():
+    sk, pk = generate_key(["key"] * 3)
+    user_attributes = [Attribute(0, "secret_key", "value0"), Attribute(1, "username", "value1")]
+    issuer_attributes = [Attribute(2, "rest", "false")]
+    # issuance protocol
+    issue_request, t = create_issue_request(pk, user_attributes)
+    blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+    credential = obtain_credential(pk, blind_signature, t)
+    # showing protocol
+    disclosure_proof = create_disclosure_proof(pk, credential.anonymize(), user_attributes, b"hello world", folded=True)
+    # the attribute at index 2 is neither hidden nor disclosed
+    assert verify_disclosure_proof(pk, disclosure_proof, b"hello world", [])
+
+""" Fixed-base precomputation tests """
+@pytest.mark.parametrize("group", [G1, G2])
+def test_success_fixed_base_table(group):
+    base = group.generator() ** G1.order().random()
+    table = FixedBaseTable(base)
+    for exponent in [G1.order().random(), G1.order().random().int_neg(), G1.order()]:
+        assert table.power(exponent) == base ** exponent
+
+def test_success_fixed_base_cache_budget():
+    sk, pk = generate_key(["key"] * FIXED_BASE_KEYGEN_MIN_ATTRIBUTES)
+    # generate_key leaves the tables of g and g_tilde in the cache
+    assert pk.fixed_base_cache().size == 2 * FixedBaseTable.num_elements()
+    # no room for the table of Y[0]
+    pk.set_precomputation_budget(pk.fixed_base_cache().size)
+    exponent = G1.order().random()
+    for _ in range(FIXED_BASE_MIN_USES + 1):
+        assert pk.Y_power(0, exponent) == pk.Y[0] ** exponent
+    assert ("Y", 0) not in pk.fixed_base_cache().tables
+    # room for the table of Y[0]
+    pk.set_precomputation_budget(DEFAULT_PRECOMPUTATION_BUDGET)
+    assert pk.Y_power(0, exponent) == pk.Y[0] ** exponent
+    assert ("Y", 0) in pk.fixed_base_cache().tables
+
+def test_success_issuance_fixed_base_tables():
+    """ signing several requests with the same key goes through the fixed-base tables """
+    sk, pk = generate_key(["key"] * 5)
+    user_attributes = [Attribute(0, "key0", "value0"), Attribute(1, "key1", "value1"), Attribute(2, "key2", "value2")]
+    issuer_attributes = [Attribute(3, "key3", "value3"), Attribute(4, "key4", "value4")]
+    attributes = [attr.to_bytes() for attr in user_attributes] + [attr.to_bytes() for attr in issuer_attributes]
+    for _ in range(FIXED_BASE_MIN_USES + 1):
+        issue_request, t = create_issue_request(pk, user_attributes)
+        blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+        credential = obtain_credential(pk, blind_signature, t)
+        assert verify(pk, credential, attributes)
+    assert ("Y", 4) in pk.fixed_base_cache().tables
+
+def test_success_issuance_without_fixed_base_tables():
+    """ small keys get no tables, a single issuance uses a multi-exponentiation """
+    sk, pk = generate_key(["key"] * 3)
+    assert len(pk.fixed_base_cache().tables) == 0
+    user_attributes = [Attribute(0, "key0", "value0"), Attribute(1, "key1", "value1")]
+    issuer_attributes = [Attribute(2, "key2", "value2")]
+    issue_request, t = create_issue_request(pk, user_attributes)
+    credential = obtain_credential(pk, sign_issue_request(sk, pk, issue_request, issuer_attributes), t)
+    assert verify(pk, credential, [attr.to_bytes() for attr in user_attributes + issuer_attributes])
+    assert ("Y", 0) not in pk.fixed_base_cache().tables
+
+""" Parallel key generation tests """
+def test_success_generate_key_parallel():
+    # three chunks of at least KEYGEN_MIN_CHUNK_SIZE attributes
+    L = 2 * KEYGEN_MIN_CHUNK_SIZE + 1
+    attributes = ["key{}".format(i) for i in range(L)]
+    sk, pk = generate_key(attributes, max_workers=4)
+    assert len(pk.Y) == len(pk.Y_tilde) == len(sk.y) == L
+    assert all(pk.Y[i] == pk.g ** sk.y[i] and pk.Y_tilde[i] == pk.g_tilde ** sk.y[i] for i in range(L))
+    # the key can be used as a sequentially generated one
+    signature = sign(sk, encode_to_bytes(attributes))
+    assert verify(pk, signature, encode_to_bytes(attributes))
+
+@pytest.mark.xfail(raises=ValueError)
+def test_failure_disclosure_coupon_reused():
+    sk, pk = generate_key(["key"] * 2)
+    user_attributes = [Attribute(0, "secret_key", "value0")]
+    issuer_attributes = [Attribute(1, "rest", "true")]
+    issue_request, t = create_issue_request(pk, user_attributes)
+    credential = obtain_credential(pk, sign_issue_request(sk, pk, issue_request, issuer_attributes), t)
+    coupon = create_disclosure_coupon(pk, credential.anonymize(), user_attributes)
+    disclosure_proof = create_disclosure_proof_from_coupon(pk, coupon, b"message")
+    assert verify_disclosure_proof(pk, disclosure_proof, b"message", issuer_attributes)
+    create_disclosure_proof_from_coupon(pk, coupon, b"other message")
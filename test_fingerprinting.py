@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from fingerprinting import *
+
+""" Exported forest tests """
+
+
+def make_traces(n_traces=200, n_features=10, n_cells=5, seed=0):
+    rng = np.random.RandomState(seed)
+    labels = rng.randint(1, n_cells + 1, size=n_traces)
+    features = rng.normal(size=(n_traces, n_features))
+    # only a few columns depend on the cell
+    features[:, [1, 4, 7]] += labels[:, None]
+    return features, labels
+
+
+def write_traces(path, features, labels):
+    pd.DataFrame(np.column_stack([labels, features])).to_csv(path, header=False, index=False)
+
+
+def test_success_export_all_columns(tmp_path):
+    features, labels = make_traces()
+    clf = RandomForestClassifier(n_estimators=10, random_state=0).fit(features, labels)
+    path = str(tmp_path / "forest.npz")
+    export_model(clf, path)
+    model = import_model(path)
+    assert np.array_equal(model.columns, np.arange(features.shape[1]))
+    assert np.array_equal(model.classes_, clf.classes_)
+    assert np.allclose(model.predict_proba(features), clf.predict_proba(features), atol=1e-6)
+    assert np.array_equal(model.predict(features), clf.predict(features))
+
+
+def test_success_export_column_subset(tmp_path):
+    features, labels = make_traces()
+    columns = np.array([7, 1, 4])
+    clf = RandomForestClassifier(n_estimators=10, random_state=0).fit(features[:, columns], labels)
+    path = str(tmp_path / "forest.npz")
+    export_model(clf, path, columns, features.shape[1])
+    model = import_model(path)
+    assert np.array_equal(model.columns, columns)
+    # the exported forest takes all the extracted features and picks its own columns
+    assert np.allclose(model.predict_proba(features), clf.predict_proba(features[:, columns]), atol=1e-6)
+
+
+def test_success_export_online_forest(tmp_path):
+    features, labels = make_traces()
+    model = OnlineForest(trees_per_batch=5, random_state=0)
+    model.partial_fit(features[:100], labels[:100])
+    # a batch without the last cell
+    model.partial_fit(features[100:][labels[100:] != 5], labels[100:][labels[100:] != 5])
+    path = str(tmp_path / "forest.npz")
+    export_model(model, path)
+    assert np.allclose(import_model(path).predict_proba(features), model.predict_proba(features), atol=1e-6)
+
+
+def test_success_classify_batch_top_k(tmp_path):
+    features, labels = make_traces()
+    clf = RandomForestClassifier(n_estimators=10, random_state=0).fit(features, labels)
+    path = str(tmp_path / "forest.npz")
+    export_model(clf, path)
+    top_k_cells, top_k_prob = classify_batch(import_model(path), features, k=3)
+    predictions_prob = clf.predict_proba(features)
+    assert top_k_cells.shape == (len(labels), 3) and top_k_prob.shape == (len(labels), 3)
+    assert np.array_equal(top_k_cells[:, 0], clf.predict(features))
+    assert np.all(np.diff(top_k_prob, axis=1) <= 0)
+    # the probability of each returned cell is sklearn's
+    assert np.allclose(top_k_prob, np.take_along_axis(predictions_prob, np.searchsorted(clf.classes_, top_k_cells),
+                                                      axis=1), atol=1e-6)
+
+
+def test_failure_predict_wrong_number_of_features(tmp_path):
+    features, labels = make_traces()
+    columns = np.array([1, 4, 7])
+    clf = RandomForestClassifier(n_estimators=5, random_state=0).fit(features[:, columns], labels)
+    path = str(tmp_path / "forest.npz")
+    export_model(clf, path, columns, features.shape[1])
+    with pytest.raises(ValueError):
+        import_model(path).predict_proba(features[:, columns])
+
+
+def test_success_export_and_infer(tmp_path):
+    features, labels = make_traces()
+    write_traces(tmp_path / "features.csv", features, labels)
+    np.savetxt(tmp_path / "columns.txt", [1, 4, 7], fmt='%d')
+    (tmp_path / "new_traces").mkdir()
+    write_traces(tmp_path / "new_traces" / "traces.csv", features[:20], labels[:20])
+    main(["export", "--data", str(tmp_path / "features.csv"), "--columns", str(tmp_path / "columns.txt"),
+          "--trees", "10", "--seed", "0", "--forest", str(tmp_path / "forest.npz")])
+    main(["infer", "--forest", str(tmp_path / "forest.npz"), "--input", str(tmp_path / "new_traces"),
+          "--output", str(tmp_path / "predictions.csv"), "--top-k", "2"])
+    predictions = pd.read_csv(tmp_path / "predictions.csv")
+    assert len(predictions) == 20
+    assert list(predictions.columns) == ['file', 'row', 'label', 'cell_1', 'prob_1', 'cell_2', 'prob_2']
+    assert np.all(predictions['prob_1'] >= predictions['prob_2'])
+
+
+""" Online model tests """
+
+
+def test_success_online_options_apply_to_saved_model(tmp_path):
+    features, labels = make_traces()
+    write_traces(tmp_path / "features.csv", features, labels)
+    arguments = ["online", "--data", str(tmp_path / "features.csv"), "--model", str(tmp_path / "online.joblib"),
+                 "--batch-size", "50", "--seed", "0"]
+    main(arguments + ["--trees-per-batch", "3", "--max-forests", "4"])
+    model = OnlineForest.load(str(tmp_path / "online.joblib"))
+    assert model.trees_per_batch == 3 and len(model.forests) == 4
+    main(arguments + ["--trees-per-batch", "2", "--max-forests", "2", "--max-depth", "5"])
+    model = OnlineForest.load(str(tmp_path / "online.joblib"))
+    assert (model.trees_per_batch, model.max_forests, model.max_depth) == (2, 2, 5)
+    assert len(model.forests) == 2
+    assert all(forest.n_estimators == 2 and forest.max_depth == 5 for forest in model.forests)
@@ -1,3 +1,5 @@
+import pytest
+
 from serialization_utils import *
 from credential_utils import Attribute
 
@@ -12,3 +14,64 @@ def test_serialization_with_custom_type():
     res = serialize_to_bytes(obj)
     obj1: Attribute = from_bytes_deserialize(res)
     assert obj.index == obj1.index and obj.key == obj1.key and obj.value == obj1.value
+
+def test_serialization_public_key_without_precomputations():
+    from credential import generate_key
+    from credential_utils import FIXED_BASE_MIN_USES
+    from petrelic.bn import Bn
+    _, pk = generate_key(["key"] * 2)
+    for _ in range(FIXED_BASE_MIN_USES):
+        pk.g_power(Bn(42))
+    assert len(pk.fixed_base_cache().tables) > 0
+    pk1 = from_bytes_deserialize(serialize_to_bytes(pk))
+    assert "_fixed_base_cache" not in pk1.__dict__
+    assert pk1.g == pk.g and pk1.Y == pk.Y and pk1.attr_indices_dict == pk.attr_indices_dict
+
+""" Compact binary format tests """
+def issue_and_show(folded=False):
+    from credential import generate_key, create_issue_request, sign_issue_request, obtain_credential, create_disclosure_proof
+    sk, pk = generate_key(["key"] * 3)
+    user_attributes = [Attribute(0, "secret_key", "value0"), Attribute(1, "username", "value1")]
+    issuer_attributes = [Attribute(2, "rest", "true")]
+    issue_request, t = create_issue_request(pk, user_attributes)
+    blind_signature = sign_issue_request(sk, pk, issue_request, issuer_attributes)
+    credential = obtain_credential(pk, blind_signature, t)
+    disclosure_proof = create_disclosure_proof(pk, credential.anonymize(), user_attributes, b"hello world", folded)
+    return pk, issue_request, blind_signature, credential, disclosure_proof
+
+def test_compact_serialization_round_trip():
+    pk, issue_request, blind_signature, credential, disclosure_proof = issue_and_show()
+    for obj in [pk, issue_request, blind_signature, credential, disclosure_proof, disclosure_proof.pi]:
+        res = serialize_to_bytes(obj, compact=True)
+        assert compact_serialization.is_compact(res)
+        assert serialize_to_bytes(from_bytes_deserialize(res), compact=True) == res
+
+def test_compact_serialization_disclosure_proof():
+    from credential import verify_disclosure_proof
+    for folded in [False, True]:
+        pk, _, _, _, disclosure_proof = issue_and_show(folded)
+        res = serialize_to_bytes(disclosure_proof, compact=True)
+        assert len(res) < len(serialize_to_bytes(disclosure_proof))
+        disclosure_proof1 = from_bytes_deserialize(res)
+        # the prover's secret t is not sent
+        assert disclosure_proof1.credential_showed.t is None
+        assert verify_disclosure_proof(pk, disclosure_proof1, b"hello world", [Attribute(2, "rest", "true")])
+
+@pytest.mark.xfail(raises=compact_serialization.CompactSerializationError)
+def test_compact_serialization_truncated():
+    _, issue_request, _, _, _ = issue_and_show()
+    from_bytes_deserialize(serialize_to_bytes(issue_request, compact=True)[:-1])
+
+def test_compact_serialization_index_set():
+    for indices in [[], [0], [7], [8], [0, 3, 9, 16, 199]]:
+        writer = compact_serialization.Writer()
+        writer.write_index_set(indices)
+        assert compact_serialization.Reader(writer.to_bytes()).read_index_set() == indices
+
+def test_compact_serialization_issue_request_without_generators():
+    from credential import sign_issue_request, generate_key, create_issue_request
+    sk, pk = generate_key(["key"] * 3)
+    issue_request, _ = create_issue_request(pk, [Attribute(0, "secret_key", "value0")])
+    issue_request1 = from_bytes_deserialize(serialize_to_bytes(issue_request, compact=True))
+    assert issue_request1.pi.generators is None and issue_request1.pi.indices == [0]
+    sign_issue_request(sk, pk, issue_request1, [Attribute(1, "rest", "true"), Attribute(2, "bar", "false")])
@@ -1,3 +1,6 @@
+import os
+import signal
+
 import pytest
 
 from stroll import *
@@ -281,3 +284,184 @@ def test_failure_different_message():
     message_signature = client.sign_request(pk, credential, message, types)
     # server: check request signature
     assert server.check_request_signature(pk, f"{46.5198},{6.6323}".encode(), types, message_signature)
+
+
+def test_success_request_compact():
+    # setup: client and server both use the compact binary format
+    server = Server(compact=True)
+    client = Client(compact=True)
+    # REGISTRATION
+    subscriptions = ["restaurant", "bar", "dojo", "username"]
+    sk, pk = server.generate_ca(subscriptions, compact=True)
+    client_subscriptions = ["restaurant", "bar"]
+    issue_request, state = client.prepare_registration(pk, "username", client_subscriptions)
+    blind_signature = server.process_registration(sk, pk, issue_request, "username", client_subscriptions)
+    credential = client.process_registration_response(pk, blind_signature, state)
+    # REQUEST
+    message = f"{46.5197},{6.6323}".encode()
+    types = ["restaurant"]
+    message_signature = client.sign_request(pk, credential, message, types)
+    assert compact_serialization.is_compact(message_signature)
+    assert server.check_request_signature(pk, message, types, message_signature)
+
+
+def test_success_request_unfolded_signature():
+    """ the server also accepts proofs in the unfolded format """
+    server = Server()
+    client = Client()
+    subscriptions = ["restaurant", "bar", "dojo", "username"]
+    sk, pk = server.generate_ca(subscriptions)
+    client_subscriptions = ["restaurant", "bar"]
+    issue_request, state = client.prepare_registration(pk, "username", client_subscriptions)
+    blind_signature = server.process_registration(sk, pk, issue_request, "username", client_subscriptions)
+    credential = client.process_registration_response(pk, blind_signature, state)
+    session = client.get_session(pk, credential)
+    message = f"{46.5197},{6.6323}".encode()
+    disclosure_proof = create_disclosure_proof(session.pk, session.credential.anonymize(),
+                                               session.hidden_attributes(["restaurant"]), message)
+    message_signature = serialize_to_bytes(disclosure_proof)
+    assert server.check_request_signature(pk, message, ["restaurant"], message_signature)
+    assert server.check_request_signatures(pk, [(message, ["restaurant"], message_signature)]) == [True]
+    # a proof without generators nor indices is malformed
+    disclosure_proof.pi.generators = None
+    message_signature = serialize_to_bytes(disclosure_proof)
+    assert not server.check_request_signature(pk, message, ["restaurant"], message_signature)
+
+
+def test_server_key_cache():
+    server = Server()
+    client = Client()
+    subscriptions = ["restaurant", "bar", "dojo", "username"]
+    sk, pk = server.generate_ca(subscriptions)
+    # keys are decoded once per serialization
+    assert server.load_public_key(pk) is server.load_public_key(pk)
+    assert server.load_secret_key(sk) is server.load_secret_key(sk)
+    client_subscriptions = ["restaurant"]
+    issue_request, state = client.prepare_registration(pk, "username", client_subscriptions)
+    blind_signature = server.process_registration(sk, pk, issue_request, "username", client_subscriptions)
+    credential = client.process_registration_response(pk, blind_signature, state)
+    message = f"{46.5197},{6.6323}".encode()
+    message_signature = client.sign_request(pk, credential, message, ["restaurant"])
+    assert server.check_request_signature(pk, message, ["restaurant"], message_signature)
+    assert len(server.key_cache.keys) == 2
+    # key rotation
+    cached_pk = server.load_public_key(pk)
+    server.invalidate_keys(pk)
+    assert len(server.key_cache.keys) == 1
+    assert server.load_public_key(pk) is not cached_pk
+    server.invalidate_keys()
+    assert len(server.key_cache.keys) == 0
+
+
+def test_key_cache_threads():
+    """ the cache is shared by the threads of a threaded server """
+    cache = KeyCache(max_size=2)
+    serialized_keys = [bytes([i]) for i in range(4)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        keys = list(executor.map(lambda i: cache.get(serialized_keys[i % 4], lambda data: [data]), range(1000)))
+    assert all(key == [serialized_keys[i % 4]] for i, key in enumerate(keys))
+    assert len(cache.keys) == 2
+
+
+def test_client_session():
+    server = Server()
+    client = Client()
+    subscriptions = ["restaurant", "bar", "dojo", "username"]
+    sk, pk = server.generate_ca(subscriptions)
+    client_subscriptions = ["restaurant", "bar"]
+    issue_request, state = client.prepare_registration(pk, "username", client_subscriptions)
+    blind_signature = server.process_registration(sk, pk, issue_request, "username", client_subscriptions)
+    credential = client.process_registration_response(pk, blind_signature, state)
+    session = client.get_session(pk, credential)
+    # the session is reused across requests
+    for types in [["restaurant"], ["bar"], ["restaurant", "bar"]]:
+        message = f"{46.5197},{6.6323}".encode()
+        message_signature = client.sign_request(pk, credential, message, types)
+        assert client.session is session
+        assert server.check_request_signature(pk, message, types, message_signature)
+    assert session.sign_request(b"message", ["bar"]) is not None
+    # a new registration invalidates the session
+    client.prepare_registration(pk, "username", client_subscriptions)
+    assert client.session is None
+
+
+def test_client_session_coupons():
+    server = Server()
+    client = Client()
+    subscriptions = ["restaurant", "bar", "dojo", "username"]
+    sk, pk = server.generate_ca(subscriptions)
+    client_subscriptions = ["restaurant", "bar"]
+    issue_request, state = client.prepare_registration(pk, "username", client_subscriptions)
+    blind_signature = server.process_registration(sk, pk, issue_request, "username", client_subscriptions)
+    credential = client.process_registration_response(pk, blind_signature, state)
+    session = client.get_session(pk, credential)
+    session.precompute(["restaurant"], 2)
+    session.precompute_in_background(["bar", "restaurant"]).result()
+    assert session.available_coupons(["restaurant"]) == 2
+    assert session.available_coupons(["restaurant", "bar"]) == 1
+    for types in [["restaurant"], ["restaurant"], ["restaurant", "bar"], ["restaurant"]]:
+        message = f"{46.5197},{6.6323}".encode()
+        message_signature = client.sign_request(pk, credential, message, types)
+        assert server.check_request_signature(pk, message, types, message_signature)
+    assert session.available_coupons(["restaurant"]) == 0
+    # a new registration closes the session and its background thread
+    session.precompute_in_background(["restaurant"])
+    client.prepare_registration(pk, "username", client_subscriptions)
+    assert client.session is None and session.executor is None
+
+
+def test_verification_service():
+    server = Server()
+    client = Client()
+    subscriptions = ["restaurant", "bar", "dojo", "username"]
+    sk, pk = server.generate_ca(subscriptions)
+    client_subscriptions = ["restaurant", "bar"]
+    issue_request, state = client.prepare_registration(pk, "username", client_subscriptions)
+    blind_signature = server.process_registration(sk, pk, issue_request, "username", client_subscriptions)
+    credential = client.process_registration_response(pk, blind_signature, state)
+    message = f"{46.5197},{6.6323}".encode()
+    requests = [(message, ["restaurant"], client.sign_request(pk, credential, message, ["restaurant"])),
+                (message, ["dojo"], client.sign_request(pk, credential, message, ["dojo"])),
+                (b"other message", ["bar"], client.sign_request(pk, credential, message, ["bar"])),
+                (message, ["bar"], b"malformed"),
+                (message, ["bar"], client.sign_request(pk, credential, message, ["bar"]))]
+    # signatures that decode but are not well-formed disclosure proofs
+    wrong_types = from_bytes_deserialize(client.sign_request(pk, credential, message, ["bar"]))
+    wrong_types.pi.s = "not a list of responses"
+    requests += [(message, ["bar"], serialize_to_bytes(None)),
+                 (message, ["bar"], serialize_to_bytes(Attribute(0, "bar", "true"))),
+                 (message, ["bar"], serialize_to_bytes(wrong_types)),
+                 (message, ["restaurant"], client.sign_request(pk, credential, message, ["restaurant"]))]
+    expected = [True, False, False, False, True, False, False, False, True]
+    assert server.check_request_signatures(pk, requests) == expected
+    for workers in [0, 2]:
+        service = VerificationService(pk, workers=workers, window=0.05)
+        futures = [service.submit(*request) for request in requests]
+        assert [future.result() for future in futures] == expected
+        service.close()
+
+
+def test_verification_service_worker_crash():
+    """ a worker that dies does not disable the service """
+    server = Server()
+    client = Client()
+    subscriptions = ["restaurant", "bar", "dojo", "username"]
+    sk, pk = server.generate_ca(subscriptions)
+    client_subscriptions = ["restaurant", "bar"]
+    issue_request, state = client.prepare_registration(pk, "username", client_subscriptions)
+    blind_signature = server.process_registration(sk, pk, issue_request, "username", client_subscriptions)
+    credential = client.process_registration_response(pk, blind_signature, state)
+    message = f"{46.5197},{6.6323}".encode()
+    requests = [(message, ["restaurant"], client.sign_request(pk, credential, message, ["restaurant"])),
+                (message, ["dojo"], client.sign_request(pk, credential, message, ["dojo"])),
+                (message, ["bar"], client.sign_request(pk, credential, message, ["bar"]))]
+    expected = [True, False, True]
+    service = VerificationService(pk, workers=2, window=0.05)
+    assert [future.result() for future in [service.submit(*request) for request in requests]] == expected
+    # kill a worker, the pool is broken
+    broken = service.executor
+    os.kill(next(iter(broken._processes)), signal.SIGKILL)
+    assert [future.result() for future in [service.submit(*request) for request in requests]] == expected
+    assert [future.result() for future in [service.submit(*request) for request in requests]] == expected
+    assert service.executor is not broken
+    service.close()
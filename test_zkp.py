@@ -3,6 +3,7 @@ import pytest
 from credential import *
 from credential_utils import *
 from zkp_utils import *
+from zkp_utils import _straus_multi_exponentiation
 
 def test_success_zkp_no_message_1():
     sk, pk = generate_key(["key"] * 5)
@@ -163,3 +164,27 @@ def test_failure_zkp_enpty_message_2():
     # zkp protocol
     c, s = generate_zkp(generators, prover_inputs, C, b"hello world")
     assert verify_zkp(C, generators, c, s)
+
+""" Multi-exponentiation tests """
+def naive_multi_exponentiation(bases, exponents):
+    result = bases[0] ** exponents[0]
+    for base, exponent in zip(bases[1:], exponents[1:]):
+        result *= base ** exponent
+    return result
+
+@pytest.mark.parametrize("group", [G1, G2, GT])
+def test_success_multi_exponentiation(group):
+    bases = [group.generator() ** G1.order().random() for _ in range(10)]
+    exponents = [G1.order().random() for _ in range(10)]
+    assert multi_exponentiation(bases, exponents) == naive_multi_exponentiation(bases, exponents)
+
+@pytest.mark.parametrize("group", [G1, G2, GT])
+def test_success_straus_multi_exponentiation(group):
+    bases = [group.generator() ** G1.order().random() for _ in range(10)]
+    # negative exponents are reduced modulo the group order
+    exponents = [G1.order().random() for _ in range(9)] + [G1.order().random().int_neg()]
+    assert _straus_multi_exponentiation(group, bases, exponents) == naive_multi_exponentiation(bases, exponents)
+
+@pytest.mark.xfail(raises=ValueError)
+def test_failure_multi_exponentiation_different_lengths():
+    multi_exponentiation([G1.generator()], [])
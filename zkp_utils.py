@@ -54,10 +54,82 @@ import hashlib
 from typing import Any, List, Tuple
 
 from petrelic.bn import Bn
-from petrelic.multiplicative.pairing import G1
+from petrelic.multiplicative.pairing import G1, G2, GT, G1Element, G2Element, GTElement
 
 from credential_utils import bytes_to_Z_p
 
+# window size (in bits) of the simultaneous multi-exponentiation
+MULTIEXP_WINDOW_BITS = 4
+# below this number of bases, independent exponentiations are faster
+MULTIEXP_MIN_BASES = 4
+
+
+def multi_exponentiation(
+        bases: List[Any], # G1Element, G2Element or GTElement, all from the same group
+        exponents: List[Bn]
+        ) -> Any:
+        """ Compute bases[0]^exponents[0] * ... * bases[k]^exponents[k]
+
+        Uses RELIC's simultaneous exponentiation (`wprod`) when petrelic exposes it
+        for the group, and a windowed Straus multi-exponentiation otherwise: the
+        squarings are shared by all the bases instead of being done once per base.
+        """
+        if len(bases) == 0 or len(bases) != len(exponents):
+                raise ValueError("The number of bases and exponents must be equal and non-zero")
+
+        group = _group_of(bases[0])
+        wprod = getattr(group, "wprod", None)
+        if wprod is not None:
+                return wprod(exponents, bases)
+        if len(bases) < MULTIEXP_MIN_BASES:
+                result = bases[0] ** exponents[0]
+                for base, exponent in zip(bases[1:], exponents[1:]):
+                        result *= base ** exponent
+                return result
+        return _straus_multi_exponentiation(group, bases, exponents)
+
+def _group_of(element: Any) -> Any:
+        """ Return the group (G1, G2 or GT) of an element """
+        if isinstance(element, G1Element):
+                return G1
+        if isinstance(element, G2Element):
+                return G2
+        if isinstance(element, GTElement):
+                return GT
+        raise TypeError("Unsupported group element: {}".format(type(element)))
+
+def _straus_multi_exponentiation(
+        group: Any,
+        bases: List[Any],
+        exponents: List[Bn]
+        ) -> Any:
+        """ Windowed simultaneous exponentiation (Straus' method) """
+        w = MULTIEXP_WINDOW_BITS
+        mask = (1 << w) - 1
+        p = G1.order()
+        # all groups have order p, exponents can be reduced (this also removes negative exponents)
+        ints = [e.mod(p).int() for e in exponents]
+
+        # tables[j][d] = bases[j]^d for d in [1, 2^w - 1]
+        tables = []
+        for base in bases:
+                table = [None, base]
+                for _ in range(2, mask + 1):
+                        table.append(table[-1] * base)
+                tables.append(table)
+
+        num_windows = (max(e.bit_length() for e in ints) + w - 1) // w
+        result = group.unity()
+        for window in reversed(range(num_windows)):
+                for _ in range(w):
+                        result = result * result
+                shift = window * w
+                for table, e in zip(tables, ints):
+                        digit = (e >> shift) & mask
+                        if digit:
+                                result = result * table[digit]
+        return result
+
 
 def get_zkp_commitment(
         generators : List[Any] # the type is Any because can be G1Element or GTElement
@@ -66,9 +138,7 @@ def get_zkp_commitment(
     # pick a list of random numbers from integers modulo p
     randoms = [G1.order().random() for _ in generators]
     # generate ZKP commitment
-    R = generators[0] ** randoms[0]
-    for generator, random in zip(generators[1:], randoms[1:]):
-        R *= generator ** random
+    R = multi_exponentiation(generators, randoms)
 
     return randoms, R
 
@@ -104,13 +174,24 @@ def generate_zkp(
         message: bytes = None
         ) -> Tuple[Bn, List[Bn]]:
         """ Generate a zero-knowledge proof """
+        c, s, _ = generate_zkp_with_commitment(generators, prover_input, com, message)
+        return c, s
+
+def generate_zkp_with_commitment(
+        generators: List[Any],
+        prover_input: List[Bn],
+        com: Any,
+        message: bytes = None
+        ) -> Tuple[Bn, List[Bn], Any]:
+        """ Generate a zero-knowledge proof and also return the ZKP commitment R """
+        """ R is not needed by verify_zkp, but lets a verifier check many proofs at once (batch verification) """
         # generate ZKP commitment
         randoms, R = get_zkp_commitment(generators)
         # generate ZKP challenge
         c = get_zkp_challenge(generators, com, R) if message == None else get_zkp_challenge(generators, com, R, message)
         # generate ZKP response
         s = get_zkp_response(randoms, c, prover_input)
-        return c, s
+        return c, s, R
         
 def verify_zkp(
         com: Any,
@@ -120,10 +201,9 @@ def verify_zkp(
         message: bytes = None
         ) -> bool:
         """ Verify a zero-knowledge proof """
-        # generate R'
-        R_prime = com ** c
-        for generator, resp in zip(generators, s):
-                R_prime *= generator ** resp
+        # generate R' = com^c * g_0^s_0 * g_1^s_1 * ... * g_k^s_k
+        pairs = list(zip(generators, s))
+        R_prime = multi_exponentiation([com] + [g for g, _ in pairs], [c] + [resp for _, resp in pairs])
         # generate c'
         c_prime = get_zkp_challenge(generators, com, R_prime) if message == None else get_zkp_challenge(generators, com, R_prime, message)
         # accept if and only if c == c'